@@ -1,73 +1,138 @@
 import json
 import os
 import sys
-import datetime
-import flask
 
 from dotenv import load_dotenv
-from flask import Flask, request
-from humanfriendly.text import random_string
+from flask import Flask, Response, request
+
+from client_registry import ClientRegistry
+from job_queue import JobQueue, WorkerPool, FAILED
 
 ROOT_DIR = os.path.dirname(__file__)
 TASKS_DIR = os.path.join(ROOT_DIR, 'tasks')
 
+load_dotenv()
+
 app = Flask(__name__)
 
-# Make workflow parameters available in the call-on-close hook
-step = None
-params = {}
-options = None
-client_ = None
+# Jobs are stored in SQLite, so they survive restarts and are shared by all processes
+jobs = JobQueue(os.environ.get('JOBS_DB', os.path.join(TASKS_DIR, 'jobs.sqlite')))
 
-load_dotenv()
+# Configuration and warm workflow instances of each client, reloaded when modified
+clients = ClientRegistry()
+
+
+def run_workflow(job):
+    """
+    Run the workflow step of a job with its own parameters and options.
+    """
+    with clients.workflow(job['client']) as workflow:
+        result = workflow.call(job['step'], **job['params'], options=job['options'])
+
+    # Workflows may report their output in the task file, take it as the result
+    task_file = os.path.join(TASKS_DIR, job['task_id'] + '.json')
+    if os.path.exists(task_file):
+        with open(task_file) as f:
+            result = json.load(f)
+        os.remove(task_file)
+    return result
+
+
+workers = WorkerPool(
+    jobs,
+    run_workflow,
+    workers=int(os.environ.get('JOB_WORKERS', '2')),
+    # Finished tasks can be read again until they expire
+    result_ttl=int(os.environ.get('JOB_RESULT_TTL', '3600')),
+    # Jobs interrupted this many times (i.e. killing their process) fail
+    max_attempts=int(os.environ.get('JOB_MAX_ATTEMPTS', '3')),
+)
+
+# Max time a status request waits for its task to finish
+MAX_WAIT = 60
 
 
 @app.route('/<client>/<task_id>', methods=['GET'])
 def get_status(client:str, task_id: str):
     """
     Get the status of a task
-    """
-    global client_
 
-    # Disable after-request processing by setting the global client_ to None
-    client_ = None
+    With `?wait=<seconds>`, the request waits for the task to finish (up to
+    MAX_WAIT seconds) before returning its status.
+    """
+    workers.start()
 
-    # Generate the path to the task file
-    task_file = os.path.join(TASKS_DIR, task_id + '.json')
+    wait = min(request.args.get('wait', 0, type=float), MAX_WAIT)
+    data = jobs.wait(task_id, wait) if wait > 0 else jobs.get(task_id)
 
-    # If there is no file for this task_id, return HTTP 404
-    if not os.path.exists(task_file):
-        print(f"Task file not found: {task_file}")
+    # If there is no such task for this client, return HTTP 404
+    if data is None or data['client'] != client:
+        print(f"Task not found: {task_id}")
         return {
             'error': f'No such task: {task_id}'
         }, 404
 
-    print(f"Task file found: {task_file}")
-
-    # Load the file
-    with open(task_file) as f:
-        data = json.load(f)
-
     # If the task is not finished, return HTTP 202
     if not data['done']:
         print(f"Task {task_id} seems not to be finished yet")
-        return data, 202
+        return format_status(data), 202
 
-    # If the task is finished, remove the file and return HTTP 200
-    os.remove(task_file)
+    # If the task is finished return HTTP 200 (HTTP 500 if it failed), it is kept until it expires
     print(f"Task {task_id} finished")
-    print(data)
-    return data, 200
+    return format_status(data), 500 if data['status'] == FAILED else 200
+
+
+@app.route('/<client>/<task_id>/events', methods=['GET'])
+def stream_status(client: str, task_id: str):
+    """
+    Stream the status of a task as server-sent events, one on every change of the
+    task, until it is finished
+    """
+    workers.start()
+
+    data = jobs.get(task_id)
+    if data is None or data['client'] != client:
+        return {
+            'error': f'No such task: {task_id}'
+        }, 404
+
+    def events(data):
+        while True:
+            yield f"data: {json.dumps(format_status(data))}\n\n"
+            if data['done']:
+                return
+            version = data['version']
+            while data is not None and data['version'] == version:
+                data = jobs.wait(task_id, 15, version=version)
+                if data is not None and data['version'] == version:
+                    # Keep the connection open through proxies
+                    yield ": keep-alive\n\n"
+            if data is None:
+                # The task expired while streaming
+                return
+
+    return Response(events(data), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+def format_status(data):
+    """
+    Status of a task as returned to the clients.
+    """
+    data = dict(data)
+    result = data.pop('result')
+    if isinstance(result, dict):
+        # Output of the workflow task file, as returned before the job queue
+        data = {**result, **data}
+    elif data['done']:
+        data['result'] = result
+    return data
 
 
 @app.route('/<client>', methods=['POST'])
 def serve_client(client: str):
-    global step, params, options, client_
+    workers.start()
 
-    config, custom = prepare_configuration_for_client(client)
-
-    # Enable after-request processing by setting the global client_ to client
-    client_ = client
+    config, custom = clients.get(client)
 
     step = request.form['step']
 
@@ -91,70 +156,14 @@ def serve_client(client: str):
         # Take the corresponding value from the form, use None if not set
         params[key] = request.form.get(key, None)
 
-    # Generate a unique filesafe task_id
-    task_id = random_string(8)
-    task_file = os.path.join(TASKS_DIR, task_id + '.json')
-
-    # Call the function with the parameters
-    options['task_id'] = task_id
-
-    status = {
-        'done': False,
-        'message': 'Generation process started',
-        'task_id': task_id,
-        "started": datetime.datetime.now().isoformat()
-    }
-
-    # Create the task file
-    with open(task_file, 'w') as f:
-        json.dump(status, f)
+    # Queue the job with its own parameters, the task_id is added to its options
+    status = jobs.submit(client, step, params, options)
+    workers.notify()
 
     # Return HTTP 202 Accepted status code
     return status, 202
 
 
-@app.after_request
-def response_processor(response):
-    # Prepare all the local variables you need since the request context
-    # will be gone in the callback function
-    global step, params, options, client_
-
-    print(f"Processing response for step {step} with params {params} and options {options}")
-
-    # If the global client_ is None, we don't need to do anything
-    if client_ is None:
-        print("Not the main route, returning without further action")
-        return response
-
-    print("Enabling the after-request handler")
-    # Get the configuration and custom module for the client
-    config, custom = prepare_configuration_for_client(client_)
-
-    # Call the callback function after the response has been sent
-    @flask.copy_current_request_context
-    @response.call_on_close
-    def process_after_request():
-        print("Processing after request using custom workflow")
-        custom.Workflow().call(step, **params, options=options)
-        print("Finished processing after request using custom workflow")
-
-    return response
-
-
-def prepare_configuration_for_client(client):
-    CUSTOM_DIR = os.path.join('prototypes', client)
-    BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), CUSTOM_DIR)
-    sys.path.append(BASE_DIR)
-    # Load JSON config file
-    with open(os.path.join(BASE_DIR, 'config.json')) as f:
-        config = json.load(f)
-    # Import the "custom" module from CUSTOM_DIR (e.g. "prototypes/demo/custom") and make it accessible as 'custom'
-    import importlib
-    custom = __import__(CUSTOM_DIR.replace('/', '.') + '.custom', fromlist=['Workflow'])
-    importlib.reload(custom)
-    return config, custom
-
-
 if __name__ == '__main__':
     # Get debug options from command line
     debug = False
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 from dotenv import load_dotenv
 from generic_tasks import OllamaEmbedder
-from langchain.chains import RetrievalQA
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.chains.question_answering import load_qa_chain
 from langchain.embeddings import HuggingFaceEmbeddings
 from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
 from langchain.embeddings.ollama import OllamaEmbeddings
@@ -10,6 +11,7 @@ from langchain.llms import GPT4All, LlamaCpp, Ollama
 import chromadb
 import os
 import argparse
+import json
 import time
 
 load_dotenv()
@@ -22,6 +24,56 @@ target_source_chunks = int(os.environ.get('TARGET_SOURCE_CHUNKS',4))
 
 from constants import CHROMA_SETTINGS
 
+class FirstTokenTimer(BaseCallbackHandler):
+    """Records when the LLM generates its first token"""
+
+    def __init__(self):
+        self.first_token_at = None
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.first_token_at = None
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+
+class AnswerPipeline:
+    """
+    Answers a query from the documents of the vectorstore: the query is embedded,
+    the most similar chunks searched, and stuffed in the prompt of the LLM.
+
+    The documents are retrieved a single time per query, and the time spent in
+    each stage is reported with the answer.
+    """
+
+    def __init__(self, db, embeddings, llm, k, timer):
+        self.db = db
+        self.embeddings = embeddings
+        self.k = k
+        self.timer = timer
+        self.chain = load_qa_chain(llm=llm, chain_type="stuff")
+
+    def answer(self, query):
+        start = time.perf_counter()
+        embedding = self.embeddings.embed_query(query)
+        embedded = time.perf_counter()
+        docs = self.db.similarity_search_by_vector(embedding, k=self.k)
+        searched = time.perf_counter()
+        answer = self.chain.run(input_documents=docs, question=query)
+        generated = time.perf_counter()
+
+        first_token_at = self.timer.first_token_at
+        timings = {
+            'embed': embedded - start,
+            'search': searched - embedded,
+            'generate': generated - searched,
+            'first_token': first_token_at - start if first_token_at is not None else None,
+            'total': generated - start,
+        }
+        return answer, docs, timings
+
+
 def main():
     # Parse the command line arguments
     args = parse_arguments()
@@ -31,13 +83,18 @@ def main():
     )
     chroma_client = chromadb.PersistentClient(settings=CHROMA_SETTINGS , path=persist_directory)
     db = Chroma(persist_directory=persist_directory, embedding_function=embeddings, client_settings=CHROMA_SETTINGS, client=chroma_client)
-    retriever = db.as_retriever(search_kwargs={"k": target_source_chunks})
     # activate/deactivate the streaming StdOut callback for LLMs
-    callbacks = [] if args.mute_stream else [StreamingStdOutCallbackHandler()]
+    timer = FirstTokenTimer()
+    callbacks = [timer] if args.mute_stream else [timer, StreamingStdOutCallbackHandler()]
     # Prepare the LLM
     llm = Ollama(model=model_name, callbacks=callbacks)
 
-    qa = RetrievalQA.from_chain_type(llm=llm, chain_type="stuff", retriever=retriever, return_source_documents= not args.hide_source)
+    pipeline = AnswerPipeline(db, embeddings, llm, target_source_chunks, timer)
+
+    if args.queries:
+        answer_queries(pipeline, args.queries, args.output)
+        return
+
     # Interactive questions and answers
     while True:
         query = input("\nEnter a query: ")
@@ -46,21 +103,59 @@ def main():
         if query.strip() == "":
             continue
 
-        # Get the answer from the chain
-        start = time.time()
-        chunks = retriever.get_relevant_documents(query)
-
-        res = qa(query)
-        answer, docs = res['result'], [] if args.hide_source else res['source_documents']
-        end = time.time()
+        # Get the answer from the pipeline
+        answer, docs, timings = pipeline.answer(query)
 
         # Print the result
-        print(f"\n> Answer took {round(end - start, 2)} s.")
+        print(f"\n> Answer took {round(timings['total'], 2)} s. ({format_timings(timings)})")
 
         # Print the relevant sources used for the answer
-        for document in docs:
-            print("\n> " + document.metadata["source"] + ":")
-            print(document.page_content)
+        if not args.hide_source:
+            for document in docs:
+                print("\n> " + document.metadata["source"] + ":")
+                print(document.page_content)
+
+
+def answer_queries(pipeline, queries_file, output_file=None):
+    """
+    Answers the queries of a file (one per line), for batch evaluation
+
+    The answers, sources and timings are written as JSON lines to the output file,
+    and the mean time of each stage is printed at the end.
+    """
+    with open(queries_file) as f:
+        queries = [line.strip() for line in f if line.strip()]
+
+    totals = {}
+    output = open(output_file, 'w') if output_file else None
+    try:
+        for number, query in enumerate(queries, 1):
+            answer, docs, timings = pipeline.answer(query)
+            print(f"\n> [{number}/{len(queries)}] {query} ({format_timings(timings)})")
+            for stage, duration in timings.items():
+                if duration is not None:
+                    totals.setdefault(stage, []).append(duration)
+            if output:
+                output.write(json.dumps({
+                    'query': query,
+                    'answer': answer,
+                    'sources': [document.metadata.get("source") for document in docs],
+                    'timings': timings,
+                }) + "\n")
+                output.flush()
+    finally:
+        if output:
+            output.close()
+
+    means = {stage: sum(durations) / len(durations) for stage, durations in totals.items()}
+    print(f"\n> Answered {len(queries)} queries, mean timings: {format_timings(means)}")
+
+
+def format_timings(timings):
+    return ", ".join(
+        f"{stage} {duration:.2f} s" for stage, duration in timings.items() if duration is not None
+    )
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='privateGPT: Ask questions to your documents without an internet connection, '
@@ -72,6 +167,12 @@ def parse_arguments():
                         action='store_true',
                         help='Use this flag to disable the streaming StdOut callback for LLMs.')
 
+    parser.add_argument("--queries", "-Q",
+                        help='Answer the queries of this file (one per line) instead of asking for them.')
+
+    parser.add_argument("--output", "-O",
+                        help='Write the answers, sources and timings of the --queries as JSON lines to this file.')
+
     return parser.parse_args()
 
 
@@ -0,0 +1,101 @@
+import importlib
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROTOTYPES_DIR = os.path.join(ROOT_DIR, 'prototypes')
+
+
+class ClientRegistry:
+    """
+    Registry of the configuration and workflow module of each client.
+
+    The `config.json` and `custom` module of a client (in `prototypes/<client>`) are
+    loaded once, and only loaded again when one of their files is modified.
+
+    Workflow instances are kept warm: a `Workflow()` is created when no idle
+    instance of the client is available, and given back to the registry once its
+    task is done, so the models it loaded are reused by the next tasks. An instance
+    is only used by one task at a time. Instances of a module that has been
+    reloaded since, and the instances of failed tasks, are dropped.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, client):
+        """
+        Get the configuration and the custom module of a client.
+        """
+        entry = self._get_entry(client)
+        return entry.config, entry.custom
+
+    @contextmanager
+    def workflow(self, client):
+        """
+        Use a warm `Workflow` instance of a client for the duration of a task.
+        """
+        entry = self._get_entry(client)
+        with self._lock:
+            instance = entry.idle.pop() if entry.idle else None
+        if instance is None:
+            print(f"Creating a workflow instance for client {client}")
+            instance = entry.custom.Workflow()
+        try:
+            yield instance
+        except BaseException:
+            # The instance may be left broken (i.e. by a failed model load), not reused
+            print(f"Dropping the workflow instance of client {client} after a failure")
+            raise
+        else:
+            with self._lock:
+                # Instances of a reloaded module are not reused
+                if self._clients.get(client) is entry:
+                    entry.idle.append(instance)
+
+    def _get_entry(self, client):
+        base_dir = os.path.join(PROTOTYPES_DIR, client)
+        config_file = os.path.join(base_dir, 'config.json')
+        with self._lock:
+            entry = self._clients.get(client)
+            if entry is not None and entry.mtimes == _mtimes(entry.files):
+                return entry
+
+            print(f"Loading configuration of client {client}")
+            # Load JSON config file
+            with open(config_file) as f:
+                config = json.load(f)
+
+            if entry is None or _mtimes([entry.custom.__file__]) != entry.mtimes[1:]:
+                if base_dir not in sys.path:
+                    sys.path.append(base_dir)
+                print(f"Loading workflow module of client {client}")
+                # Import the "custom" module (e.g. "prototypes.demo.custom"), reloaded if it changed
+                custom = __import__(f'prototypes.{client}.custom', fromlist=['Workflow'])
+                if entry is not None:
+                    custom = importlib.reload(custom)
+                entry = _Client(config, custom, [config_file, custom.__file__])
+            else:
+                # Only the configuration changed, the warm workflow instances are kept
+                entry.config = config
+                entry.mtimes = _mtimes(entry.files)
+            self._clients[client] = entry
+            return entry
+
+
+class _Client:
+    def __init__(self, config, custom, files):
+        self.config = config
+        self.custom = custom
+        self.files = files
+        self.mtimes = _mtimes(files)
+        # Workflow instances waiting for a task
+        self.idle = []
+
+
+def _mtimes(files):
+    return [os.stat(file).st_mtime_ns for file in files]
@@ -2,7 +2,8 @@
 import json
 import os
 import glob
-from typing import List
+from collections import deque
+from typing import Iterable, Iterator, List, Tuple
 from dotenv import load_dotenv
 from multiprocessing import Pool
 
@@ -29,6 +30,8 @@ from langchain.docstore.document import Document
 from txtai import Embeddings
 
 from constants import CHROMA_SETTINGS
+from ingest_batches import Batch, add_batches, batch_chunks
+from source_manifest import SourceManifest
 import chromadb
 from chromadb.api.segment import API
 from generic_tasks import OllamaEmbedder
@@ -41,6 +44,8 @@ persist_directory = os.environ.get('PERSIST_DIRECTORY', os.path.join(CUSTOM_DIR,
 source_directory = os.environ.get('SOURCE_DIRECTORY', os.path.join(CUSTOM_DIR, 'source_documents'))
 chunk_size = 500
 chunk_overlap = 50
+# Chunks embedded and added at once, capped by the max batch size of the chroma client
+ingest_batch_size = int(os.environ.get('INGEST_BATCH_SIZE', 1000))
 
 
 # Custom document loaders
@@ -96,76 +101,110 @@ def load_single_document(file_path: str) -> List[Document]:
     raise ValueError(f"Unsupported file extension '{ext}'")
 
 
-def load_documents(source_dir: str, ignored_files: List[str] = []) -> List[Document]:
+def find_source_files(source_dir: str) -> List[str]:
     """
-    Loads all documents from the source documents directory, ignoring specified files
+    Lists the files of the source documents directory that can be loaded
     """
-    all_files = []
+    all_files = set()
     for ext in LOADER_MAPPING:
-        all_files.extend(
+        all_files.update(
             glob.glob(os.path.join(source_dir, f"**/*{ext.lower()}"), recursive=True)
         )
-        all_files.extend(
+        all_files.update(
             glob.glob(os.path.join(source_dir, f"**/*{ext.upper()}"), recursive=True)
         )
-    filtered_files = [file_path for file_path in all_files if file_path not in ignored_files]
+    return sorted(all_files)
 
-    with Pool(processes=os.cpu_count()) as pool:
-        results = []
-        with tqdm(total=len(filtered_files), desc='Loading new documents', ncols=160) as pbar:
-            for i, docs in enumerate(pool.imap_unordered(load_single_document, filtered_files)):
-                results.extend(docs)
+
+def load_documents(file_paths: List[str]) -> Iterator[Tuple[str, List[Document]]]:
+    """
+    Loads the documents of the given files, yielding each file with its documents
+
+    Files are loaded by a pool of processes, and their documents yielded as soon as
+    they are loaded. Only a few files per process are loaded ahead of the
+    consumer, so memory stays flat whatever the number of files.
+    """
+    processes = os.cpu_count() or 1
+    with Pool(processes=processes) as pool:
+        in_flight = deque()
+        files = iter(file_paths)
+        with tqdm(total=len(file_paths), desc='Loading new documents', ncols=160) as pbar:
+            while True:
+                while len(in_flight) < 2 * processes:
+                    file_path = next(files, None)
+                    if file_path is None:
+                        break
+                    in_flight.append((file_path, pool.apply_async(load_single_document, (file_path,))))
+                if not in_flight:
+                    return
+                file_path, docs = in_flight.popleft()
+                docs = docs.get()
                 pbar.update()
+                yield file_path, docs
 
-    return results
 
+def linearize_metadata(document: Document) -> Document:
+    """
+    Joins the list entries of the metadata, which Chroma can't store
+    """
+    for key in ('emphasized_text_contents', 'emphasized_text_tags', 'link_urls', 'link_texts'):
+        if key in document.metadata:
+            document.metadata[key] = ' '.join(document.metadata[key])
+    return document
 
-def process_documents(ignored_files: List[str] = []) -> List[Document]:
+
+def process_documents(file_paths: List[str]) -> Iterator[Tuple[str, List[Document]]]:
     """
-    Load documents and split in chunks
+    Load documents and split in chunks, yielding the chunks of each file as soon as it is loaded
     """
     print(f"Loading documents from {source_directory}")
-    documents = load_documents(source_directory, ignored_files)
-    if not documents:
-        print("No new documents to load")
-        exit(0)
-    print(f"Loaded {len(documents)} new documents from {source_directory}")
-
-    # Linearize list entries
-    for document in documents:
-        if 'emphasized_text_contents' in document.metadata:
-            document.metadata['emphasized_text_contents'] = ' '.join(document.metadata['emphasized_text_contents'])
-        if 'emphasized_text_tags' in document.metadata:
-            document.metadata['emphasized_text_tags'] = ' '.join(document.metadata['emphasized_text_tags'])
-        if 'link_urls' in document.metadata:
-            document.metadata['link_urls'] = ' '.join(document.metadata['link_urls'])
-        if 'link_texts' in document.metadata:
-            document.metadata['link_texts'] = ' '.join(document.metadata['link_texts'])
-
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    documents = text_splitter.split_documents(documents)
-    print(f"Split into {len(documents)} chunks of text (max. {chunk_size} tokens each)")
-    return documents
+    document_count = chunk_count = 0
+    for file_path, documents in load_documents(file_paths):
+        document_count += len(documents)
+        chunks = text_splitter.split_documents([linearize_metadata(document) for document in documents])
+        chunk_count += len(chunks)
+        yield file_path, chunks
+
+    if not document_count:
+        print("No new documents to load")
+        return
+    print(f"Loaded {document_count} new documents from {source_directory}, "
+          f"split into {chunk_count} chunks of text (max. {chunk_size} tokens each)")
 
 
-def batch_chromadb_insertions(chroma_client: API, documents: List[Document]) -> List[Document]:
+def batch_chromadb_insertions(chroma_client: API, files_chunks: Iterable[Tuple[str, List[Document]]]) \
+        -> Iterator[Batch]:
     """
-    Split the total documents to be inserted into batches of documents that the local chroma client can process
+    Group the documents to be inserted into batches of documents that the local chroma client can process
+
+    Each batch comes with the files it has chunks of, and the files whose last chunk it holds.
     """
     # Get max batch size.
-    max_batch_size = chroma_client.max_batch_size
-    for i in range(0, len(documents), max_batch_size):
-        yield documents[i:i + max_batch_size]
+    max_batch_size = min(chroma_client.max_batch_size, ingest_batch_size)
+    return batch_chunks(files_chunks, max_batch_size)
 
 
-def does_vectorstore_exist(persist_directory: str, embeddings: OllamaEmbeddings) -> bool:
+def does_vectorstore_exist(db: Chroma) -> bool:
     """
-    Checks if vectorstore exists
+    Checks if vectorstore exists, without reading its documents
     """
-    db = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
-    if not db.get()['documents']:
-        return False
-    return True
+    return db._collection.count() > 0
+
+
+def known_sources(db: Chroma, page_size: int = 10000) -> Iterator[str]:
+    """
+    Lists the sources of the documents of the vectorstore, reading their metadata page by page
+    """
+    offset = 0
+    while True:
+        metadatas = db.get(include=['metadatas'], limit=page_size, offset=offset)['metadatas']
+        if not metadatas:
+            return
+        for metadata in metadatas:
+            if metadata and 'source' in metadata:
+                yield metadata['source']
+        offset += len(metadatas)
 
 
 def main():
@@ -175,48 +214,47 @@ def main():
     # Chroma client
     chroma_client = chromadb.PersistentClient(settings=CHROMA_SETTINGS, path=persist_directory)
 
-    if does_vectorstore_exist(persist_directory, embeddings):
+    db = Chroma(persist_directory=persist_directory, embedding_function=embeddings, client_settings=CHROMA_SETTINGS,
+                client=chroma_client)
+    # Ingested files, to only ingest the new and modified ones
+    manifest = SourceManifest(os.path.join(persist_directory, 'sources.sqlite'))
+    store_exists = does_vectorstore_exist(db)
+    if store_exists:
         # Update and store locally vectorstore
         print(f"Appending to existing vectorstore at {persist_directory}")
-        db = Chroma(persist_directory=persist_directory, embedding_function=embeddings, client_settings=CHROMA_SETTINGS,
-                    client=chroma_client)
-        collection = db.get()
-        documents = process_documents([metadata['source'] for metadata in collection['metadatas']])
-        print(f"Creating embeddings. May take some minutes...")
-        add_documents_to_chromadb(db, batch_chromadb_insertions(chroma_client, documents))
+        if manifest.is_empty():
+            # Vectorstore created before the manifest
+            manifest.bootstrap(known_sources(db))
     else:
         # Create and store locally vectorstore
         print("Creating new vectorstore")
-        documents = process_documents()
-        print(f"Creating embeddings. May take some minutes...")
-        # Create the db with the first batch of documents to insert
-        batched_chromadb_insertions = batch_chromadb_insertions(chroma_client, documents)
-        created = False
-        while not created:
-            try:
-                first_insertion = next(batched_chromadb_insertions)
-                db = Chroma.from_documents(first_insertion, embeddings, persist_directory=persist_directory,
-                                           client_settings=CHROMA_SETTINGS, client=chroma_client)
-                created = True
-            except ValueError as e:
-                print(f"Error: {e}\nSkipping this batch of documents")
-                print(first_insertion)
-                continue
-
-        # Add the rest of batches of documents
-        add_documents_to_chromadb(db, batched_chromadb_insertions)
+        manifest.clear()
+
+    files_to_ingest, modified_files = manifest.changes(find_source_files(source_directory))
+    if store_exists:
+        # The chunks of the previous version are replaced, and so are the chunks left
+        # by a previous run that failed before the file was recorded
+        for file_path in files_to_ingest:
+            db._collection.delete(where={'source': file_path})
+    if modified_files:
+        print(f"Replacing {len(modified_files)} modified documents")
+
+    # Each batch is embedded and added while the next documents are being loaded
+    print(f"Creating embeddings. May take some minutes...")
+    files_chunks = process_documents(list(files_to_ingest))
+    for completed_files in add_documents_to_chromadb(db, batch_chromadb_insertions(chroma_client, files_chunks)):
+        manifest.record({file_path: files_to_ingest[file_path] for file_path in completed_files})
 
     print(f"Ingestion complete! You can now run the {CUSTOM_NAME} prototype to query your documents")
 
 
 def add_documents_to_chromadb(db, chromadb_insertion):
-    for batched_chromadb_insertion in chromadb_insertion:
-        try:
-            db.add_documents(batched_chromadb_insertion)
-        except ValueError as e:
-            print(f"Error: {e}\nSkipping this batch of documents")
-            print(batched_chromadb_insertion)
-            continue
+    """
+    Adds the batches of documents, yielding the files completed by each batch added
+
+    The files with chunks in a failed batch are not recorded, so they are ingested again next time.
+    """
+    return add_batches(db.add_documents, chromadb_insertion)
 
 
 if __name__ == "__main__":
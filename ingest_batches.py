@@ -0,0 +1,51 @@
+from typing import Callable, Iterable, Iterator, List, Set, Tuple, TypeVar
+
+Chunk = TypeVar('Chunk')
+
+# Chunks of a batch, files with chunks in the batch, files completed by the batch
+Batch = Tuple[List[Chunk], List[str], List[str]]
+
+
+def batch_chunks(files_chunks: Iterable[Tuple[str, List[Chunk]]], max_batch_size: int) \
+        -> Iterator[Batch]:
+    """
+    Group the chunks of the files into batches of at most `max_batch_size` chunks
+
+    Each batch comes with the files it has chunks of, and the files whose last chunk
+    is in the batch.
+    """
+    batch = []
+    batch_files = []
+    completed_files = []
+    for file_path, chunks in files_chunks:
+        for chunk in chunks:
+            if not batch_files or batch_files[-1] != file_path:
+                batch_files.append(file_path)
+            batch.append(chunk)
+            if len(batch) >= max_batch_size:
+                yield batch, batch_files, completed_files
+                batch, batch_files, completed_files = [], [], []
+        completed_files.append(file_path)
+    if batch or completed_files:
+        yield batch, batch_files, completed_files
+
+
+def add_batches(add_chunks: Callable[[List[Chunk]], object], batches: Iterable[Batch]) \
+        -> Iterator[List[str]]:
+    """
+    Adds the batches of chunks, yielding the files completely added by each batch
+
+    A file with chunks in a failed batch is never yielded, so it is not recorded and
+    is ingested again next time, even if its other batches were added.
+    """
+    failed_files: Set[str] = set()
+    for chunks, batch_files, completed_files in batches:
+        try:
+            if chunks:
+                add_chunks(chunks)
+        except ValueError as e:
+            print(f"Error: {e}\nSkipping this batch of documents")
+            print(chunks)
+            failed_files.update(batch_files)
+            continue
+        yield [file_path for file_path in completed_files if file_path not in failed_files]
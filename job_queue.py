@@ -0,0 +1,471 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Max time between two reads of a waited job, to see the changes made by other processes
+_MAX_WAIT_SLICE = 1.0
+
+# Job run by the current worker thread
+_current = threading.local()
+
+
+def report_progress(message):
+    """
+    Report the progress of the task run by the current thread.
+
+    Meant to be called by the workflows, the message is shown in the status of the
+    task. Does nothing outside a job worker.
+    """
+    job = getattr(_current, 'job', None)
+    if job is not None:
+        queue, job_id = job
+        queue.progress(job_id, message)
+
+
+class JobQueue:
+    """
+    Persistent queue of the workflow jobs, stored in a SQLite database.
+
+    Each job records the client and step it runs, its own parameters and options,
+    its status (queued, running, done or failed) and its result. Jobs survive
+    restarts: the workers running a job record a heartbeat on it, and jobs whose
+    heartbeat stopped, left running by a process that is gone, are queued again.
+
+    Every change of a job increments its version, and wakes up the threads waiting
+    for it in `wait`. Only the changes made by this process wake them up: the ones
+    made by other processes are only seen by reading SQLite again, every
+    `_MAX_WAIT_SLICE` seconds. A change wakes up all the waiting threads, whatever
+    job they wait for, each reading its job again.
+
+    The database can be shared by several processes (i.e. uwsgi workers), a job
+    is claimed by a single worker.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._changed = threading.Condition()
+        # Incremented on every change made by this process
+        self._generation = 0
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, "
+                "client TEXT NOT NULL, "
+                "step TEXT NOT NULL, "
+                "params TEXT NOT NULL, "
+                "options TEXT NOT NULL, "
+                "status TEXT NOT NULL, "
+                "message TEXT, "
+                "result TEXT, "
+                "worker TEXT, "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "created TEXT NOT NULL, "
+                "started TEXT, "
+                "finished TEXT, "
+                "version INTEGER NOT NULL DEFAULT 0, "
+                "heartbeat REAL)"
+            )
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(jobs)")]
+            if 'version' not in columns:
+                # Database created before the jobs were versioned
+                connection.execute(
+                    "ALTER TABLE jobs ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+                )
+            if 'heartbeat' not in columns:
+                # Database created before the heartbeats, its running jobs are stale
+                connection.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished)"
+            )
+        # SQLite connections must not cross a fork (i.e. of the uwsgi master loading
+        # the app): the threads of the forked processes open their own
+        self._local.connection.close()
+        del self._local.connection
+
+    def submit(self, client, step, params, options):
+        """
+        Queue a job and return its status.
+        """
+        job_id = uuid.uuid4().hex
+        options = dict(options, task_id=job_id)
+        now = datetime.datetime.now().isoformat()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, client, step, params, options, status, message, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, client, step, json.dumps(params), json.dumps(options), QUEUED,
+                 'Generation process queued', now)
+            )
+        self._notify()
+        return self.get(job_id)
+
+    def claim(self, worker):
+        """
+        Mark the oldest queued job as running by `worker` and return it, None if
+        there is no queued job.
+        """
+        now = datetime.datetime.now().isoformat()
+        with self._connect() as connection:
+            # Taking the write lock first, so no other worker claims the same job
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, "
+                "started = ?, message = ?, heartbeat = ?, version = version + 1 "
+                "WHERE id = ?",
+                (RUNNING, worker, now, 'Generation process started', time.time(), row[0])
+            )
+        self._notify()
+        return self._get(row[0], with_inputs=True)
+
+    def progress(self, job_id, message):
+        """
+        Update the message of a running job.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET message = ?, version = version + 1 "
+                "WHERE id = ? AND status = ?",
+                (message, job_id, RUNNING)
+            )
+        self._notify()
+
+    def finish(self, job_id, result=None, error=None):
+        """
+        Record the result of a job, or the error that made it fail.
+        """
+        now = datetime.datetime.now().isoformat()
+        if error is None:
+            status, message = DONE, 'Generation process finished'
+        else:
+            status, message = FAILED, f'Generation process failed: {error}'
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, message = ?, result = ?, finished = ?, "
+                "version = version + 1 WHERE id = ?",
+                (status, message, json.dumps(result, default=str), now, job_id)
+            )
+        self._notify()
+
+    def get(self, job_id):
+        """
+        Get the status of a job, None if there is no such job.
+        """
+        return self._get(job_id)
+
+    def wait(self, job_id, timeout, version=None):
+        """
+        Wait up to `timeout` seconds for a job to change, and return its status.
+
+        Without `version`, waits for the job to be done. With it, waits for a
+        version of the job newer than `version`. Changes made by this process wake
+        up the waiting threads right away, the ones made by other processes are
+        seen within a second.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._changed:
+                generation = self._generation
+            job = self._get(job_id)
+            if job is None or job['done'] or (version is not None and job['version'] > version):
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            with self._changed:
+                if self._generation == generation:
+                    self._changed.wait(min(remaining, _MAX_WAIT_SLICE))
+
+    def purge(self, ttl):
+        """
+        Delete the jobs finished more than `ttl` seconds ago.
+        """
+        expired = (datetime.datetime.now() - datetime.timedelta(seconds=ttl)).isoformat()
+        with self._connect() as connection:
+            count = connection.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished < ?",
+                (DONE, FAILED, expired)
+            ).rowcount
+        if count:
+            print(f"Deleted {count} expired task results")
+        return count
+
+    def heartbeat(self, running):
+        """
+        Record that the given (worker, job ID) pairs are still running.
+
+        Doesn't change the version of the jobs, nor wake up the waiting threads.
+        """
+        if not running:
+            return
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ? AND status = ?",
+                [(now, job_id, worker, RUNNING) for worker, job_id in running]
+            )
+
+    def requeue_orphans(self, timeout, max_attempts):
+        """
+        Queue again the jobs left running by workers that are gone.
+
+        A worker is gone when it didn't record a heartbeat on its job for `timeout`
+        seconds. Unlike process IDs, which are reused after a restart, a stopped
+        heartbeat can't be mistaken for a live worker.
+
+        Jobs already run `max_attempts` times fail instead: a job that kills its
+        process (i.e. out of memory) would otherwise kill a worker after every restart.
+        """
+        stale = time.time() - timeout
+        now = datetime.datetime.now().isoformat()
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            rows = connection.execute(
+                "SELECT id, attempts FROM jobs WHERE status = ? "
+                "AND (heartbeat IS NULL OR heartbeat < ?)", (RUNNING, stale)
+            ).fetchall()
+            orphans = [job_id for job_id, attempts in rows if attempts < max_attempts]
+            failed = [
+                (job_id, attempts) for job_id, attempts in rows if attempts >= max_attempts
+            ]
+            connection.executemany(
+                "UPDATE jobs SET status = ?, worker = NULL, message = ?, "
+                "version = version + 1 WHERE id = ?",
+                [(QUEUED, 'Generation process queued again', job_id) for job_id in orphans]
+            )
+            connection.executemany(
+                "UPDATE jobs SET status = ?, message = ?, finished = ?, "
+                "version = version + 1 WHERE id = ?",
+                [(FAILED, f'Generation process failed: interrupted {attempts} times',
+                  now, job_id) for job_id, attempts in failed]
+            )
+        if rows:
+            self._notify()
+        if orphans:
+            print(f"Queued again {len(orphans)} interrupted jobs")
+        if failed:
+            print(f"Failed {len(failed)} jobs interrupted {max_attempts} times")
+        return orphans
+
+    def _get(self, job_id, with_inputs=False):
+        row = self._connect().execute(
+            "SELECT id, client, step, params, options, status, message, result, "
+            "created, started, finished, version FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        (job_id, client, step, params, options, status, message, result, created, started,
+         finished, version) = row
+        job = {
+            'done': status in (DONE, FAILED),
+            'status': status,
+            'message': message,
+            'task_id': job_id,
+            'client': client,
+            'step': step,
+            'created': created,
+            'started': started,
+            'finished': finished,
+            'version': version,
+            'result': json.loads(result) if result is not None else None,
+        }
+        if with_inputs:
+            job['params'] = json.loads(params)
+            job['options'] = json.loads(options)
+        return job
+
+    def _connect(self):
+        # One connection per thread, SQLite connections can't be shared
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.connection = connection
+        return _Transaction(connection)
+
+    def _notify(self):
+        with self._changed:
+            self._generation += 1
+            self._changed.notify_all()
+
+
+class _Transaction:
+    """
+    SQLite connection used as a context manager running a single transaction.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, *args):
+        return self.connection.execute(*args)
+
+    def executemany(self, *args):
+        return self.connection.executemany(*args)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.connection.in_transaction:
+            self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class WorkerPool:
+    """
+    Pool of worker threads running the queued jobs.
+
+    Each worker claims a job, runs it with `run_job(job)` and records its result.
+    The pool is started on first use, so it is started in the serving process
+    rather than in a process forking it.
+
+    While running jobs, a thread of the pool records a heartbeat on them every
+    `heartbeat_interval` seconds. Idle workers queue again the jobs of any process
+    whose heartbeat stopped for `orphan_timeout` seconds, up to `max_attempts` runs
+    of each job, and delete the results kept for more than `result_ttl` seconds.
+
+    A job whose result can't be recorded stops getting heartbeats, so it is queued
+    again, and the worker goes on with the next jobs.
+    """
+
+    def __init__(self, queue, run_job, workers=2, poll_interval=0.5, result_ttl=3600,
+                 heartbeat_interval=10, orphan_timeout=60, max_attempts=3):
+        self.queue = queue
+        self.run_job = run_job
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.result_ttl = result_ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.orphan_timeout = orphan_timeout
+        self.max_attempts = max_attempts
+        # Unique to this pool, unlike the process ID reused after a restart
+        self.instance = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._last_purge = 0
+        self._last_requeue = 0
+        self._wakeup = threading.Condition()
+        self._threads = []
+        # (worker, job ID) run by each worker thread
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._last_requeue = time.monotonic()
+            self.queue.requeue_orphans(self.orphan_timeout, self.max_attempts)
+            for number in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work, name=f'job-worker-{number}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            threading.Thread(
+                target=self._heartbeat, name='job-heartbeat', daemon=True
+            ).start()
+            print(f"Started {self.workers} job workers in process {os.getpid()}")
+
+    def notify(self):
+        """
+        Wake up a worker waiting for jobs.
+        """
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def _worker_name(self, thread_name):
+        return f'{self.instance}:{thread_name}'
+
+    def _work(self):
+        worker = self._worker_name(threading.current_thread().name)
+        while True:
+            try:
+                job = self.queue.claim(worker)
+            except sqlite3.Error as e:
+                print(f"Worker {worker} failed to claim a job: {e!r}")
+                job = None
+            if job is None:
+                self._requeue_orphans()
+                self._purge()
+                # Jobs queued by other processes are only seen when polling
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+            thread = threading.current_thread()
+            with self._lock:
+                self._running[thread] = (worker, job['task_id'])
+            try:
+                self._run(worker, job)
+            except BaseException as e:
+                # Left running without heartbeat, the job is queued again
+                print(f"Worker {worker} failed to record task {job['task_id']}: {e!r}")
+            finally:
+                with self._lock:
+                    del self._running[thread]
+
+    def _run(self, worker, job):
+        print(f"Worker {worker} running task {job['task_id']} step {job['step']}")
+        start = time.monotonic()
+        _current.job = (self.queue, job['task_id'])
+        try:
+            result = self.run_job(job)
+        except BaseException as e:
+            # i.e. SystemExit raised by a workflow, which must not stop the worker
+            print(f"Task {job['task_id']} failed: {e!r}")
+            self.queue.finish(job['task_id'], error=repr(e))
+            return
+        finally:
+            _current.job = None
+        self.queue.finish(job['task_id'], result=result)
+        print(f"Task {job['task_id']} finished in {time.monotonic() - start:.1f}s")
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self._lock:
+                running = [
+                    running for thread, running in self._running.items()
+                    if thread.is_alive()
+                ]
+            try:
+                self.queue.heartbeat(running)
+            except sqlite3.Error as e:
+                print(f"Failed to record the heartbeat of the job workers: {e!r}")
+
+    def _requeue_orphans(self):
+        # At most once per heartbeat interval, by a single worker
+        with self._lock:
+            if time.monotonic() - self._last_requeue < self.heartbeat_interval:
+                return
+            self._last_requeue = time.monotonic()
+        try:
+            self.queue.requeue_orphans(self.orphan_timeout, self.max_attempts)
+        except sqlite3.Error as e:
+            print(f"Failed to queue again the interrupted jobs: {e!r}")
+
+    def _purge(self):
+        # At most once a minute, by a single worker
+        with self._lock:
+            if time.monotonic() - self._last_purge < 60:
+                return
+            self._last_purge = time.monotonic()
+        try:
+            self.queue.purge(self.result_ttl)
+        except sqlite3.Error as e:
+            print(f"Failed to delete the expired task results: {e!r}")
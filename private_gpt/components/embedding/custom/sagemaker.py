@@ -1,10 +1,44 @@
 # mypy: ignore-errors
+import asyncio
 import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
 import boto3
+from botocore.config import Config
+from llama_index.bridge.pydantic import Field, PrivateAttr
 from llama_index.embeddings.base import BaseEmbedding
-from pydantic import Field, PrivateAttr
+
+logger = logging.getLogger(__name__)
+
+# Size of the JSON request around the texts, and rough number of chars per token
+_PAYLOAD_OVERHEAD_BYTES = 32
+_CHARS_PER_TOKEN = 4
+# Errors of requests too large for the endpoint, and of throttled requests
+_TOO_LARGE_CODES = {"ValidationError"}
+_THROTTLING_CODES = {"ThrottlingException", "Throttling", "TooManyRequestsException"}
+# Base delay of the retries, in seconds
+_RETRY_DELAY = 0.1
+_THROTTLING_RETRY_DELAY = 1.0
+
+
+def _error_kind(error: Exception) -> str:
+    """Kind of a failed request: too_large, throttled, rejected or transient."""
+    response = getattr(error, "response", None) or {}
+    status = response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+    code = response.get("Error", {}).get("Code")
+    if status == 413 or code in _TOO_LARGE_CODES:
+        return "too_large"
+    if status == 429 or code in _THROTTLING_CODES:
+        return "throttled"
+    if 400 <= status < 500:
+        # i.e. denied access or unknown endpoint, failing again if retried
+        return "rejected"
+    return "transient"
 
 
 class SagemakerEmbedding(BaseEmbedding):
@@ -23,55 +57,178 @@ class SagemakerEmbedding(BaseEmbedding):
     Make sure the credentials / roles used have the required policies to
     access the Sagemaker endpoint.
     See: https://docs.aws.amazon.com/IAM/latest/UserGuide/access_policies.html
-    """
 
-    endpoint_name: str = Field(description="")
+    Texts are split in batches of at most `max_batch_size` texts, estimated
+    `max_batch_tokens` tokens and `max_payload_bytes` bytes of request. Batches are
+    sent concurrently, up to `max_pool_connections` at a time, and their embeddings
+    put back in the order of the texts.
 
-    _boto_client: Any = boto3.client(
-        "sagemaker-runtime",
-    )  # TODO make it an optional field
+    Failed and throttled batches are retried up to `max_retries` times, with an
+    exponential backoff, longer when throttled. Batches rejected as too large (a 413
+    or a validation error) are split in two halves embedded separately. Retries
+    are only made here, botocore doesn't retry on top of them.
+    """
 
-    _async_not_implemented_warned: bool = PrivateAttr(default=False)
+    endpoint_name: str = Field(description="")
+    endpoint_url: str | None = Field(
+        default=None, description="URL of the endpoint, the AWS one if None."
+    )
+    max_pool_connections: int = Field(
+        default=10, description="Max number of concurrent requests to the endpoint."
+    )
+    max_batch_size: int = Field(
+        default=32, description="Max number of texts of a request."
+    )
+    max_batch_tokens: int = Field(
+        default=8192, description="Max (estimated) number of tokens of a request."
+    )
+    max_payload_bytes: int = Field(
+        default=5 * 1024 * 1024, description="Max size of the body of a request."
+    )
+    max_retries: int = Field(
+        default=2, description="Number of retries of a failing request."
+    )
+
+    _boto_client: Any = PrivateAttr(default=None)
+    _executor: ThreadPoolExecutor | None = PrivateAttr(default=None)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, **kwargs: Any) -> None:
+        # Batches given by llama_index are split in requests here
+        kwargs.setdefault("embed_batch_size", 256)
+        super().__init__(**kwargs)
 
     @classmethod
     def class_name(cls) -> str:
         return "SagemakerEmbedding"
 
-    def _async_not_implemented_warn_once(self) -> None:
-        if not self._async_not_implemented_warned:
-            print("Async embedding not available, falling back to sync method.")
-            self._async_not_implemented_warned = True
-
-    def _embed(self, sentences: list[str]) -> list[list[float]]:
+    @property
+    def client(self) -> Any:
+        """The boto3 sagemaker-runtime client, created on first use."""
+        if self._boto_client is None:
+            with self._lock:
+                if self._boto_client is None:
+                    # Clients are thread safe, sessions are not: use a new one
+                    self._boto_client = boto3.session.Session().client(
+                        "sagemaker-runtime",
+                        endpoint_url=self.endpoint_url,
+                        config=Config(
+                            max_pool_connections=self.max_pool_connections,
+                            # Keeps the client side rate limiting of the throttled
+                            # requests, without retries
+                            retries={"mode": "adaptive", "total_max_attempts": 1},
+                        ),
+                    )
+        return self._boto_client
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_pool_connections,
+                        thread_name_prefix="sagemaker-embedding",
+                    )
+        return self._executor
+
+    def _batches(self, sentences: list[str]) -> list[list[str]]:
+        """Split the texts in requests within the size limits, in order."""
+        batches: list[list[str]] = []
+        batch: list[str] = []
+        batch_tokens = 0
+        batch_bytes = _PAYLOAD_OVERHEAD_BYTES
+        for sentence in sentences:
+            tokens = len(sentence) // _CHARS_PER_TOKEN + 1
+            # Size of the text in the JSON array, with its separator
+            size = len(json.dumps(sentence)) + 2
+            if batch and (
+                len(batch) >= self.max_batch_size
+                or batch_tokens + tokens > self.max_batch_tokens
+                or batch_bytes + size > self.max_payload_bytes
+            ):
+                batches.append(batch)
+                batch, batch_tokens, batch_bytes = [], 0, _PAYLOAD_OVERHEAD_BYTES
+            batch.append(sentence)
+            batch_tokens += tokens
+            batch_bytes += size
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _invoke(self, sentences: list[str]) -> list[list[float]]:
         request_params = {
             "inputs": sentences,
         }
 
-        resp = self._boto_client.invoke_endpoint(
+        resp = self.client.invoke_endpoint(
             EndpointName=self.endpoint_name,
             Body=json.dumps(request_params),
             ContentType="application/json",
         )
 
-        response_body = resp["Body"]
-        response_str = response_body.read().decode("utf-8")
-        response_json = json.loads(response_str)
+        response_json = json.loads(resp["Body"].read())
+        vectors = response_json["vectors"]
+        if len(vectors) != len(sentences):
+            raise ValueError(
+                f"Got {len(vectors)} embeddings for {len(sentences)} texts"
+            )
+        return vectors
+
+    def _embed_batch(self, sentences: list[str]) -> list[list[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._invoke(sentences)
+            except Exception as e:
+                kind = _error_kind(e)
+                if kind == "too_large" and len(sentences) > 1:
+                    break
+                if kind in ("too_large", "rejected") or attempt == self.max_retries:
+                    raise
+                delay = (
+                    _THROTTLING_RETRY_DELAY if kind == "throttled" else _RETRY_DELAY
+                ) * (2**attempt * (1 + random.random()))
+                logger.warning(
+                    "Embedding batch of count=%s texts %s, retrying in %.2fs",
+                    len(sentences),
+                    "throttled" if kind == "throttled" else "failed",
+                    delay,
+                    exc_info=True,
+                )
+                time.sleep(delay)
+        # Too large for the endpoint: embed each half apart
+        logger.warning("Splitting too large batch of count=%s texts", len(sentences))
+        half = len(sentences) // 2
+        return self._embed_batch(sentences[:half]) + self._embed_batch(sentences[half:])
 
-        return response_json["vectors"]
+    def _embed(self, sentences: list[str]) -> list[list[float]]:
+        batches = self._batches(sentences)
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+        futures = [self.executor.submit(self._embed_batch, batch) for batch in batches]
+        return [vector for future in futures for vector in future.result()]
+
+    async def _aembed(self, sentences: list[str]) -> list[list[float]]:
+        results = await asyncio.gather(
+            *(
+                asyncio.wrap_future(self.executor.submit(self._embed_batch, batch))
+                for batch in self._batches(sentences)
+            )
+        )
+        return [vector for vectors in results for vector in vectors]
 
     def _get_query_embedding(self, query: str) -> list[float]:
         """Get query embedding."""
         return self._embed([query])[0]
 
     async def _aget_query_embedding(self, query: str) -> list[float]:
-        # Warn the user that sync is being used
-        self._async_not_implemented_warn_once()
-        return self._get_query_embedding(query)
+        return (await self._aembed([query]))[0]
 
     async def _aget_text_embedding(self, text: str) -> list[float]:
-        # Warn the user that sync is being used
-        self._async_not_implemented_warn_once()
-        return self._get_text_embedding(text)
+        return (await self._aembed([text]))[0]
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        return await self._aembed(texts)
 
     def _get_text_embedding(self, text: str) -> list[float]:
         """Get text embedding."""
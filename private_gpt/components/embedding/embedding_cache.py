@@ -0,0 +1,344 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from llama_index.bridge.pydantic import PrivateAttr
+from llama_index.embeddings.base import BaseEmbedding, Embedding
+from starlette.concurrency import run_in_threadpool
+
+from private_gpt.components.embedding.wrapped_embedding import WrappedEmbedding
+
+logger = logging.getLogger(__name__)
+
+# Max number of variables of a SQLite statement in old SQLite versions
+_SQLITE_MAX_VARIABLES = 999
+# Recency of the hits is written to the index in batches, at least this often
+_TOUCH_FLUSH_ENTRIES = 1000
+_TOUCH_FLUSH_SECONDS = 5.0
+
+
+class EmbeddingCache:
+    """Cache of the embeddings computed by a single embedding model.
+
+    Embeddings are stored on disk in `cache_dir`, in two files:
+
+    * `vectors.f32`: memory-mapped matrix of float32, one row (slot) per embedding.
+      Its size is fixed, the max number of embeddings it can hold is computed from
+      `max_size_bytes` and the dimension of the first embedding stored.
+    * `index.sqlite`: the hash index, mapping the key of each embedding to its slot
+      in the matrix and the last time it was used.
+
+    Once the matrix is full, the least recently used embeddings are evicted and
+    their slots reused. The `memory_entries` most recently used embeddings are also
+    kept in memory, so they are served without reading the disk.
+
+    Hits don't write to the index: their last use is kept in memory and written in
+    a single statement every `_TOUCH_FLUSH_ENTRIES` hits or `_TOUCH_FLUSH_SECONDS`,
+    before evicting and when closing. Recency lost in a crash only makes those
+    embeddings more likely to be evicted.
+
+    The cache is thread-safe.
+    """
+
+    def __init__(
+        self, cache_dir: Path, max_size_bytes: int, memory_entries: int
+    ) -> None:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = cache_dir / "vectors.f32"
+        self._max_size_bytes = max_size_bytes
+        self._memory_entries = memory_entries
+        self._memory: OrderedDict[str, Embedding] = OrderedDict()
+        self._vectors: np.memmap[Any, np.dtype[np.float32]] | None = None
+        self._capacity = 0
+        self._count = 0
+        self._touched: dict[str, int] = {}
+        self._touched_flush = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            str(cache_dir / "index.sqlite"),
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, "
+                "slot INTEGER NOT NULL UNIQUE, "
+                "last_used INTEGER NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)"
+            )
+            dimension = self._get_meta("dimension")
+            if dimension is not None:
+                self._open_vectors(dimension)
+
+    @staticmethod
+    def key(kind: str, text: str) -> str:
+        """Key of the embedding of `text`, `kind` being `query` or `text`."""
+        return hashlib.sha256(f"{kind}\n{text}".encode()).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict[str, Embedding]:
+        """Get the cached embeddings of the given keys, missing keys are omitted."""
+        found: dict[str, Embedding] = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                embedding = self._memory.get(key)
+                if embedding is None:
+                    missing.append(key)
+                else:
+                    self._memory.move_to_end(key)
+                    found[key] = embedding
+            if missing and self._vectors is not None:
+                slots = self._get_slots(missing)
+                if slots:
+                    vectors = self._vectors[list(slots.values())]
+                    for key, vector in zip(slots, vectors, strict=True):
+                        found[key] = vector.tolist()
+                        self._remember(key, found[key])
+            now = time.time_ns()
+            self._touched.update((key, now) for key in found)
+            if (
+                len(self._touched) >= _TOUCH_FLUSH_ENTRIES
+                or time.monotonic() - self._touched_flush >= _TOUCH_FLUSH_SECONDS
+            ):
+                self._flush_touched()
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, embeddings: dict[str, Embedding]) -> None:
+        """Store the given embeddings, evicting the least recently used if full."""
+        if not embeddings:
+            return
+        with self._lock:
+            for key, embedding in embeddings.items():
+                self._remember(key, embedding)
+            if self._vectors is None:
+                dimension = len(next(iter(embeddings.values())))
+                self._set_meta("dimension", dimension)
+                self._open_vectors(dimension)
+            assert self._vectors is not None
+
+            # Overwrite the embeddings already stored, allocate slots for the new ones
+            slots = self._get_slots(list(embeddings))
+            now = time.time_ns()
+            # Marked as used, so they are not evicted to make room for the new ones
+            self._touched.update((key, now) for key in slots)
+            self._flush_touched()
+            new_keys = [key for key in embeddings if key not in slots]
+            # Keys beyond the capacity of the cache would be evicted straight away
+            room = max(self._capacity - len(slots), 0)
+            new_keys = new_keys[max(len(new_keys) - room, 0) :] if room else []
+            free_slots = list(
+                range(self._count, min(self._count + len(new_keys), self._capacity))
+            )
+            self._count += len(free_slots)
+            evicted_slots = self._evict(len(new_keys) - len(free_slots))
+            slots.update(zip(new_keys, free_slots + evicted_slots, strict=True))
+
+            self._vectors[list(slots.values())] = np.array(
+                [embeddings[key] for key in slots], dtype=np.float32
+            )
+            # The vectors must be on disk before the index points to them
+            self._vectors.flush()
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                [(key, slot, now) for key, slot in slots.items()],
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_touched()
+            if self._vectors is not None:
+                self._vectors.flush()
+            self._connection.close()
+
+    def _open_vectors(self, dimension: int) -> None:
+        capacity = self._max_size_bytes // (dimension * np.dtype(np.float32).itemsize)
+        if capacity < 1:
+            raise ValueError(
+                f"Embedding cache max size={self._max_size_bytes} bytes can't hold "
+                f"a single embedding of dimension={dimension}"
+            )
+        if self._get_meta("capacity") != capacity or not self._vectors_path.exists():
+            # New cache, or its max size changed: start from scratch
+            logger.info(
+                "Creating embedding cache path=%s capacity=%s",
+                self._vectors_path,
+                capacity,
+            )
+            self._connection.execute("DELETE FROM entries")
+            self._vectors_path.unlink(missing_ok=True)
+            self._set_meta("capacity", capacity)
+        self._vectors = np.memmap(
+            self._vectors_path,
+            dtype=np.float32,
+            mode="r+" if self._vectors_path.exists() else "w+",
+            shape=(capacity, dimension),
+        )
+        self._capacity = capacity
+        (self._count,) = self._connection.execute(
+            "SELECT COUNT(*) FROM entries"
+        ).fetchone()
+
+    def _flush_touched(self) -> None:
+        if self._touched:
+            # A single transaction, keys evicted since their hit match no row
+            with self._connection:
+                self._connection.execute("BEGIN")
+                self._connection.executemany(
+                    "UPDATE entries SET last_used = ? WHERE key = ?",
+                    [(last_used, key) for key, last_used in self._touched.items()],
+                )
+            self._touched.clear()
+        self._touched_flush = time.monotonic()
+
+    def _evict(self, count: int) -> list[int]:
+        if count <= 0:
+            return []
+        rows = self._connection.execute(
+            "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (count,)
+        ).fetchall()
+        # Committed before the slots are overwritten, so the index never points
+        # to a slot holding the embedding of another key
+        self._connection.executemany(
+            "DELETE FROM entries WHERE key = ?", [(key,) for key, _ in rows]
+        )
+        logger.debug("Evicted count=%s embeddings from the cache", len(rows))
+        return [slot for _, slot in rows]
+
+    def _get_slots(self, keys: list[str]) -> dict[str, int]:
+        slots: dict[str, int] = {}
+        for start in range(0, len(keys), _SQLITE_MAX_VARIABLES):
+            chunk = keys[start : start + _SQLITE_MAX_VARIABLES]
+            rows = self._connection.execute(
+                "SELECT key, slot FROM entries "
+                f"WHERE key IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+            slots.update(rows)
+        return slots
+
+    def _remember(self, key: str, embedding: Embedding) -> None:
+        if self._memory_entries <= 0:
+            return
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_entries:
+            self._memory.popitem(last=False)
+
+    def _get_meta(self, key: str) -> int | None:
+        row = self._connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return int(row[0]) if row is not None else None
+
+    def _set_meta(self, key: str, value: int) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+        )
+
+
+class CachedEmbedding(WrappedEmbedding):
+    """Embedding model that caches the embeddings computed by another one.
+
+    Batch calls look up the cache first, and only the texts missing from it are sent
+    to the wrapped model, in a single batch. The async calls look up and store the
+    embeddings in a worker thread, the cache reading and writing the disk.
+    """
+
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, cache: EmbeddingCache) -> None:
+        super().__init__(embed_model)
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        return self._cache
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        key = EmbeddingCache.key("query", query)
+        cached = self._cache.get_many([key])
+        if key in cached:
+            return cached[key]
+        embedding = self._embed_model.get_query_embedding(query)
+        self._cache.put_many({key: embedding})
+        return embedding
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        key = EmbeddingCache.key("query", query)
+        cached = await run_in_threadpool(self._cache.get_many, [key])
+        if key in cached:
+            return cached[key]
+        embedding = await self._embed_model.aget_query_embedding(query)
+        await run_in_threadpool(self._cache.put_many, {key: embedding})
+        return embedding
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        keys, cached, missing = self._lookup_texts(texts)
+        if missing:
+            embeddings = self._embed_model.get_text_embedding_batch(
+                list(missing.values())
+            )
+            cached.update(self._store(missing, embeddings))
+        return [cached[key] for key in keys]
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        keys, cached, missing = await run_in_threadpool(self._lookup_texts, texts)
+        if missing:
+            embeddings = await self._embed_model.aget_text_embedding_batch(
+                list(missing.values())
+            )
+            cached.update(await run_in_threadpool(self._store, missing, embeddings))
+        return [cached[key] for key in keys]
+
+    def _lookup_texts(
+        self, texts: list[str]
+    ) -> tuple[list[str], dict[str, Embedding], dict[str, str]]:
+        keys = [EmbeddingCache.key("text", text) for text in texts]
+        cached = self._cache.get_many(keys)
+        # Texts repeated in the batch are only embedded once
+        missing = {
+            key: text
+            for key, text in zip(keys, texts, strict=True)
+            if key not in cached
+        }
+        logger.debug(
+            "Embedding cache hits=%s misses=%s", len(texts) - len(missing), len(missing)
+        )
+        return keys, cached, missing
+
+    def _store(
+        self, missing: dict[str, str], embeddings: list[Embedding]
+    ) -> dict[str, Embedding]:
+        computed = dict(zip(missing, embeddings, strict=True))
+        self._cache.put_many(computed)
+        return computed
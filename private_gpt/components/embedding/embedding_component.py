@@ -1,40 +1,143 @@
+import hashlib
+import logging
+from collections.abc import Callable
+
 from injector import inject, singleton
 from llama_index import MockEmbedding
 from llama_index.embeddings.base import BaseEmbedding
+from starlette.concurrency import run_in_threadpool
 
-from private_gpt.paths import models_cache_path
+from private_gpt.components.embedding.embedding_cache import (
+    CachedEmbedding,
+    EmbeddingCache,
+)
+from private_gpt.components.embedding.query_embedding_batcher import (
+    BatchedQueryEmbedding,
+    QueryEmbeddingBatcher,
+)
+from private_gpt.components.embedding.wrapped_embedding import WrappedEmbedding
+from private_gpt.paths import local_data_path, models_cache_path
 from private_gpt.settings.settings import Settings
 
+logger = logging.getLogger(__name__)
+
 
 @singleton
 class EmbeddingComponent:
     embedding_model: BaseEmbedding
+    # Whether the model implements its async API, or just calls its sync API
+    native_async: bool = False
+
+    # Embeds many queries in a single call to the model, None if not supported
+    embed_queries: Callable[[list[str]], list[list[float]]] | None = None
 
     @inject
     def __init__(self, settings: Settings) -> None:
         match settings.llm.mode:
             case "local":
                 from llama_index.embeddings import HuggingFaceEmbedding
+                from llama_index.embeddings.huggingface_utils import format_query
 
-                self.embedding_model = HuggingFaceEmbedding(
+                hf_model = HuggingFaceEmbedding(
                     model_name=settings.local.embedding_hf_model_name,
                     cache_folder=str(models_cache_path),
                 )
+                self.embedding_model = hf_model
+                self.embed_queries = lambda queries: hf_model._embed(
+                    [
+                        format_query(
+                            query, hf_model.model_name, hf_model.query_instruction
+                        )
+                        for query in queries
+                    ]
+                )
             case "sagemaker":
 
                 from private_gpt.components.embedding.custom.sagemaker import (
                     SagemakerEmbedding,
                 )
 
-                self.embedding_model = SagemakerEmbedding(
+                sagemaker_model = SagemakerEmbedding(
                     endpoint_name=settings.sagemaker.embedding_endpoint_name,
+                    endpoint_url=settings.sagemaker.embedding_endpoint_url,
+                    max_pool_connections=settings.sagemaker.max_pool_connections,
+                    max_batch_size=settings.sagemaker.embedding_max_batch_size,
+                    max_batch_tokens=settings.sagemaker.embedding_max_batch_tokens,
+                    max_payload_bytes=settings.sagemaker.embedding_max_payload_bytes,
                 )
+                self.embedding_model = sagemaker_model
+                self.embed_queries = sagemaker_model._embed
+                self.native_async = True
             case "openai":
                 from llama_index import OpenAIEmbedding
 
                 openai_settings = settings.openai.api_key
                 self.embedding_model = OpenAIEmbedding(api_key=openai_settings)
+                self.native_async = True
             case "mock":
                 # Not a random number, is the dimensionality used by
                 # the default embedding model
-                self.embedding_model = MockEmbedding(384)
+                mock_model = MockEmbedding(384)
+                self.embedding_model = mock_model
+                self.embed_queries = lambda queries: [
+                    mock_model.get_query_embedding(query) for query in queries
+                ]
+
+        if settings.embedding.query_batch_enabled:
+            self.embedding_model = self._batched(self.embedding_model, settings)
+        # Cached on top of the batching, so cached queries are served right away
+        if settings.embedding.cache_enabled:
+            self.embedding_model = self._cached(self.embedding_model, settings)
+
+    async def aget_query_embedding(self, query: str) -> list[float]:
+        """Embed a query without blocking the event loop."""
+        if self.native_async:
+            return await self.embedding_model.aget_query_embedding(query)
+        return await run_in_threadpool(self.embedding_model.get_query_embedding, query)
+
+    async def aget_text_embedding_batch(self, texts: list[str]) -> list[list[float]]:
+        """Embed many texts without blocking the event loop."""
+        if self.native_async:
+            return await self.embedding_model.aget_text_embedding_batch(texts)
+        return await run_in_threadpool(
+            self.embedding_model.get_text_embedding_batch, texts
+        )
+
+    def _batched(
+        self, embedding_model: BaseEmbedding, settings: Settings
+    ) -> BaseEmbedding:
+        if self.embed_queries is None:
+            # i.e. OpenAI, whose queries are embedded through its native async API
+            logger.info(
+                "Query embedding batching not supported by model=%s",
+                embedding_model.class_name(),
+            )
+            return embedding_model
+        batcher = QueryEmbeddingBatcher(
+            self.embed_queries,
+            max_batch_size=settings.embedding.query_batch_max_size,
+            max_latency=settings.embedding.query_batch_max_latency_ms / 1000,
+        )
+        return BatchedQueryEmbedding(embedding_model, batcher)
+
+    @staticmethod
+    def _cached(embedding_model: BaseEmbedding, settings: Settings) -> BaseEmbedding:
+        # One cache per model, embeddings of different models are not comparable
+        base_model = (
+            embedding_model.base_model
+            if isinstance(embedding_model, WrappedEmbedding)
+            else embedding_model
+        )
+        model_key = f"{base_model.class_name()}:{base_model.model_name}"
+        cache_dir = (
+            local_data_path
+            / "embeddings_cache"
+            / hashlib.sha256(model_key.encode()).hexdigest()[:16]
+        )
+        logger.info("Caching embeddings of model=%s in path=%s", model_key, cache_dir)
+        cache = EmbeddingCache(
+            cache_dir,
+            max_size_bytes=settings.embedding.cache_max_size_mb * 1024 * 1024,
+            memory_entries=settings.embedding.cache_memory_entries,
+        )
+        return CachedEmbedding(embedding_model, cache)
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import Future
+
+from llama_index.bridge.pydantic import PrivateAttr
+from llama_index.embeddings.base import BaseEmbedding, Embedding
+
+from private_gpt.components.embedding.wrapped_embedding import WrappedEmbedding
+
+logger = logging.getLogger(__name__)
+
+# Number of batches between two logs of the batch size distribution
+_LOG_EVERY_BATCHES = 1000
+
+
+class QueryEmbeddingBatcher:
+    """Group concurrent query embeddings in a single call to the embedding model.
+
+    Queries are queued and embedded by a worker thread. Once a query is queued, the
+    worker waits up to `max_latency` seconds for other queries, or until
+    `max_batch_size` queries are queued, and embeds all of them at once with
+    `embed_queries`. Each caller gets back the embedding of its own query, or the
+    error raised by `embed_queries`.
+
+    The number of queries of each batch is recorded, `batch_sizes` holds the
+    distribution of the batch sizes since the batcher was created.
+    """
+
+    def __init__(
+        self,
+        embed_queries: Callable[[list[str]], list[Embedding]],
+        max_batch_size: int,
+        max_latency: float,
+    ) -> None:
+        self._embed_queries = embed_queries
+        self._max_batch_size = max(max_batch_size, 1)
+        self._max_latency = max_latency
+        self._pending: list[tuple[str, Future[Embedding]]] = []
+        self._condition = threading.Condition()
+        self._worker: threading.Thread | None = None
+        self.batch_sizes: Counter[int] = Counter()
+
+    def submit(self, query: str) -> "Future[Embedding]":
+        """Queue `query`, the returned future resolves to its embedding."""
+        future: Future[Embedding] = Future()
+        with self._condition:
+            if self._worker is None:
+                # Started on first use, it lives as long as the process
+                self._worker = threading.Thread(
+                    target=self._run, name="query-embedding-batcher", daemon=True
+                )
+                self._worker.start()
+            self._pending.append((query, future))
+            self._condition.notify()
+        return future
+
+    def embed(self, query: str) -> Embedding:
+        return self.submit(query).result()
+
+    async def aembed(self, query: str) -> Embedding:
+        return await asyncio.wrap_future(self.submit(query))
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            try:
+                self._embed_batch(batch)
+            except BaseException:
+                # Errors are forwarded to the callers, the worker must keep running
+                logger.exception("Query embedding batch failed")
+
+    def _next_batch(self) -> list[tuple[str, "Future[Embedding]"]]:
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = time.monotonic() + self._max_latency
+            while len(self._pending) < self._max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._pending[: self._max_batch_size]
+            del self._pending[: self._max_batch_size]
+            return batch
+
+    def _embed_batch(self, batch: list[tuple[str, "Future[Embedding]"]]) -> None:
+        # Skip the queries whose callers gave up waiting
+        batch = [
+            (query, future)
+            for query, future in batch
+            if future.set_running_or_notify_cancel()
+        ]
+        if not batch:
+            return
+        # Queries repeated in the batch are only embedded once
+        queries = list(dict.fromkeys(query for query, _ in batch))
+        try:
+            embeddings = dict(zip(queries, self._embed_queries(queries), strict=True))
+        except BaseException as e:
+            for _, future in batch:
+                future.set_exception(e)
+            raise
+        # Recorded first, so the callers see the batch in the distribution
+        self.batch_sizes[len(batch)] += 1
+        logger.debug("Embedded batch of queries=%s", len(batch))
+        batches = self.batch_sizes.total()
+        if batches % _LOG_EVERY_BATCHES == 0:
+            logger.info(
+                "Embedded batches=%s queries=%s batch_sizes=%s",
+                batches,
+                sum(size * count for size, count in self.batch_sizes.items()),
+                dict(sorted(self.batch_sizes.items())),
+            )
+        for query, future in batch:
+            future.set_result(embeddings[query])
+
+
+class BatchedQueryEmbedding(WrappedEmbedding):
+    """Embedding model embedding the queries through a `QueryEmbeddingBatcher`.
+
+    Concurrent query embeddings are grouped in batches, texts are embedded as usual
+    by the wrapped model.
+    """
+
+    _batcher: QueryEmbeddingBatcher = PrivateAttr()
+
+    def __init__(
+        self, embed_model: BaseEmbedding, batcher: QueryEmbeddingBatcher
+    ) -> None:
+        super().__init__(embed_model)
+        self._batcher = batcher
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BatchedQueryEmbedding"
+
+    @property
+    def batcher(self) -> QueryEmbeddingBatcher:
+        return self._batcher
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._batcher.embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await self._batcher.aembed(query)
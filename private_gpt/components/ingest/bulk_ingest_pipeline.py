@@ -0,0 +1,278 @@
+import functools
+import logging
+import queue
+import threading
+from collections.abc import Callable, Iterable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, AnyStr
+
+from llama_index import Document, ServiceContext, VectorStoreIndex
+from llama_index.ingestion import run_transformations
+from llama_index.schema import MetadataMode
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    from llama_index.schema import BaseNode
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the items flowing through a queue
+_END = object()
+
+
+class _Abort(Exception):
+    """Raised inside a stage when another stage of the pipeline has failed."""
+
+
+@dataclass
+class _IngestingFile:
+    # Position of the file in the ingested files
+    position: int
+    documents: list[Document]
+    nodes: list["BaseNode"] = field(default_factory=list)
+
+
+class BulkIngestPipeline:
+    """Ingest many files at once, running every step as a pipeline stage.
+
+    The ingestion is split in the following stages, each one running in its own
+    thread and connected to the next one through a bounded queue:
+
+    1. parsing: files are transformed into `Document`s using `parse_file`, parsing
+       up to `parse_workers` files at the same time.
+    2. splitting: documents are transformed into nodes (using the transformations
+       of the `ServiceContext`, i.e. the `SentenceWindowNodeParser`).
+    3. embedding: nodes coming from different documents and files are grouped
+       together and embedded in batches of at least `embed_batch_size` nodes.
+    4. writing: embedded nodes are added to the index (vector store, document
+       store and index struct). It runs in the calling thread.
+
+    The bounded queues keep the memory usage stable: a fast stage blocks when the
+    next one is not able to keep up. Persisting the storage context is left to the
+    caller, so it can be done once, at the end of the whole ingestion.
+
+    Callers can hook into the processing of each file, identified by its position in
+    the ingested files: `before_embed` receives the nodes of the file before they
+    are embedded (nodes that already have an embedding are not embedded again), and
+    `after_write` receives the documents and nodes of the file once written.
+    """
+
+    def __init__(
+        self,
+        service_context: ServiceContext,
+        parse_file: Callable[[str, Any], list[Document]],
+        queue_size: int,
+        embed_batch_size: int,
+        parse_workers: int = 1,
+    ) -> None:
+        self._service_context = service_context
+        self._parse_file = parse_file
+        self._parse_workers = parse_workers
+        self._queue_size = queue_size
+        self._embed_batch_size = embed_batch_size
+
+    def run(
+        self,
+        index: VectorStoreIndex,
+        files: Iterable[tuple[str, AnyStr | Path]],
+        before_embed: Callable[[int, list["BaseNode"]], None] | None = None,
+        after_write: Callable[[int, list[Document], list["BaseNode"]], None]
+        | None = None,
+    ) -> list[Document]:
+        """Ingest the given `(file_name, file_data)` pairs into the index.
+
+        Files that cannot be parsed are logged and skipped.
+
+        :returns: the ingested documents
+        """
+        abort = threading.Event()
+        errors: list[BaseException] = []
+        documents_queue: queue.Queue[Any] = queue.Queue(maxsize=self._queue_size)
+        nodes_queue: queue.Queue[Any] = queue.Queue(maxsize=self._queue_size)
+        embedded_queue: queue.Queue[Any] = queue.Queue(maxsize=self._queue_size)
+
+        def run_stage(name: str, stage: Callable[[], None], output: Any) -> None:
+            try:
+                stage()
+                self._put(output, _END, abort)
+            except _Abort:
+                logger.debug("Stage=%s aborted", name)
+            except BaseException as e:
+                logger.exception("Stage=%s of the bulk ingestion failed", name)
+                errors.append(e)
+                abort.set()
+
+        stages = [
+            (
+                "parse",
+                lambda: self._parse(files, documents_queue, abort),
+                documents_queue,
+            ),
+            (
+                "split",
+                lambda: self._split(documents_queue, nodes_queue, abort),
+                nodes_queue,
+            ),
+            (
+                "embed",
+                lambda: self._embed(nodes_queue, embedded_queue, abort, before_embed),
+                embedded_queue,
+            ),
+        ]
+        threads = [
+            threading.Thread(
+                target=run_stage,
+                args=stage,
+                name=f"bulk-ingest-{stage[0]}",
+                daemon=True,
+            )
+            for stage in stages
+        ]
+        for thread in threads:
+            thread.start()
+
+        ingested_documents: list[Document] = []
+        try:
+            for batch in self._consume(embedded_queue, abort):
+                index.insert_nodes([node for file in batch for node in file.nodes])
+                for file in batch:
+                    for document in file.documents:
+                        index.docstore.set_document_hash(document.doc_id, document.hash)
+                    if after_write is not None:
+                        after_write(file.position, file.documents, file.nodes)
+                    ingested_documents.extend(file.documents)
+                logger.info("Written count=%s files", len(batch))
+        except _Abort:
+            # One of the stages failed, its error is already recorded
+            pass
+        except BaseException as e:
+            errors.append(e)
+            abort.set()
+        finally:
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            raise errors[0]
+        return ingested_documents
+
+    def _parse(
+        self,
+        files: Iterable[tuple[str, AnyStr | Path]],
+        output: queue.Queue[Any],
+        abort: threading.Event,
+    ) -> None:
+        if self._parse_workers <= 1:
+            for position, (file_name, file_data) in enumerate(files):
+                if abort.is_set():
+                    raise _Abort()
+                parse = functools.partial(self._parse_file, file_name, file_data)
+                self._put_parsed(position, file_name, parse, output, abort)
+            return
+
+        with ThreadPoolExecutor(
+            max_workers=self._parse_workers, thread_name_prefix="bulk-ingest-parse"
+        ) as executor:
+            in_flight: dict[Future[list[Document]], tuple[int, str]] = {}
+
+            def put_completed(return_when: str) -> None:
+                done, _ = wait(in_flight, return_when=return_when)
+                for future in done:
+                    position, file_name = in_flight.pop(future)
+                    self._put_parsed(position, file_name, future.result, output, abort)
+
+            for position, (file_name, file_data) in enumerate(files):
+                if abort.is_set():
+                    raise _Abort()
+                # Bound the files read in advance, to keep memory usage stable
+                if len(in_flight) >= 2 * self._parse_workers:
+                    put_completed(FIRST_COMPLETED)
+                future = executor.submit(self._parse_file, file_name, file_data)
+                in_flight[future] = (position, file_name)
+            while in_flight:
+                put_completed(FIRST_COMPLETED)
+
+    def _put_parsed(
+        self,
+        position: int,
+        file_name: str,
+        parse: Callable[[], list[Document]],
+        output: queue.Queue[Any],
+        abort: threading.Event,
+    ) -> None:
+        try:
+            documents = parse()
+        except Exception:
+            logger.exception("Failed to parse file=%s, skipping it", file_name)
+            return
+        self._put(output, _IngestingFile(position, documents), abort)
+
+    def _split(
+        self, source: queue.Queue[Any], output: queue.Queue[Any], abort: threading.Event
+    ) -> None:
+        for file in self._consume(source, abort):
+            file.nodes = run_transformations(
+                file.documents, self._service_context.transformations
+            )
+            self._put(output, file, abort)
+
+    def _embed(
+        self,
+        source: queue.Queue[Any],
+        output: queue.Queue[Any],
+        abort: threading.Event,
+        before_embed: Callable[[int, list["BaseNode"]], None] | None,
+    ) -> None:
+        embed_model = self._service_context.embed_model
+        pending_files: list[_IngestingFile] = []
+        pending_nodes: list[BaseNode] = []
+
+        def flush() -> None:
+            embeddings = embed_model.get_text_embedding_batch(
+                [
+                    node.get_content(metadata_mode=MetadataMode.EMBED)
+                    for node in pending_nodes
+                ]
+            )
+            for node, embedding in zip(pending_nodes, embeddings, strict=True):
+                node.embedding = embedding
+            self._put(output, pending_files.copy(), abort)
+            pending_files.clear()
+            pending_nodes.clear()
+
+        for file in self._consume(source, abort):
+            if before_embed is not None:
+                before_embed(file.position, file.nodes)
+            pending_files.append(file)
+            pending_nodes.extend(node for node in file.nodes if node.embedding is None)
+            if len(pending_nodes) >= self._embed_batch_size:
+                flush()
+        if pending_files:
+            flush()
+
+    @staticmethod
+    def _consume(source: queue.Queue[Any], abort: threading.Event) -> Iterable[Any]:
+        # Waiting with a timeout, to stop waiting for a producer that is gone
+        while not abort.is_set():
+            try:
+                item = source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _END:
+                return
+            yield item
+        raise _Abort()
+
+    @staticmethod
+    def _put(output: queue.Queue[Any], item: Any, abort: threading.Event) -> None:
+        # Waiting with a timeout, to stop waiting for a consumer that is gone
+        while not abort.is_set():
+            try:
+                output.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise _Abort()
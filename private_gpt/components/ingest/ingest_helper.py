@@ -0,0 +1,94 @@
+import logging
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, AnyStr
+
+from llama_index import Document
+from llama_index.readers import JSONReader, StringIterableReader
+from llama_index.readers.file.base import DEFAULT_FILE_READER_CLS
+
+if TYPE_CHECKING:
+    from llama_index.readers.base import BaseReader
+
+# Patching the default file reader to support other file types
+FILE_READER_CLS = DEFAULT_FILE_READER_CLS.copy()
+FILE_READER_CLS.update(
+    {
+        ".json": JSONReader,
+    }
+)
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionHelper:
+    """Helper containing the logic shared by the different ingestion flows."""
+
+    @staticmethod
+    def transform_file_into_documents(
+        file_name: str, file_data: AnyStr | Path
+    ) -> list[Document]:
+        documents = IngestionHelper._load_file_to_documents(file_name, file_data)
+        for document in documents:
+            document.metadata["file_name"] = file_name
+        IngestionHelper._exclude_metadata(documents)
+        return documents
+
+    @staticmethod
+    def _load_file_to_documents(
+        file_name: str, file_data: AnyStr | Path
+    ) -> list[Document]:
+        logger.debug("Transforming file_name=%s into documents", file_name)
+        extension = Path(file_name).suffix
+        reader_cls = FILE_READER_CLS.get(extension)
+        documents: list[Document]
+        if reader_cls is None:
+            logger.debug(
+                "No reader found for extension=%s, using default string reader",
+                extension,
+            )
+            # Read as a plain text
+            string_reader = StringIterableReader()
+            if isinstance(file_data, Path):
+                text = file_data.read_text()
+                documents = string_reader.load_data([text])
+            elif isinstance(file_data, bytes):
+                documents = string_reader.load_data([file_data.decode("utf-8")])
+            elif isinstance(file_data, str):
+                documents = string_reader.load_data([file_data])
+            else:
+                raise ValueError(f"Unsupported data type {type(file_data)}")
+        else:
+            logger.debug("Specific reader found for extension=%s", extension)
+            reader: BaseReader = reader_cls()
+            if isinstance(file_data, Path):
+                # Already a path, nothing to do
+                documents = reader.load_data(file_data)
+            else:
+                # llama-index mainly supports reading from files, so
+                # we have to create a tmp file to read for it to work
+                # delete=False to avoid a Windows 11 permission error.
+                with tempfile.NamedTemporaryFile(delete=False) as tmp:
+                    try:
+                        path_to_tmp = Path(tmp.name)
+                        if isinstance(file_data, bytes):
+                            path_to_tmp.write_bytes(file_data)
+                        else:
+                            path_to_tmp.write_text(str(file_data))
+                        documents = reader.load_data(path_to_tmp)
+                    finally:
+                        tmp.close()
+                        path_to_tmp.unlink()
+        logger.info(
+            "Transformed file=%s into count=%s documents", file_name, len(documents)
+        )
+        return documents
+
+    @staticmethod
+    def _exclude_metadata(documents: list[Document]) -> None:
+        for document in documents:
+            document.metadata["doc_id"] = document.doc_id
+            # We don't want the Embeddings search to receive this metadata
+            document.excluded_embed_metadata_keys = ["doc_id"]
+            # We don't want the LLM to receive these metadata in the context
+            document.excluded_llm_metadata_keys = ["file_name", "doc_id", "page_label"]
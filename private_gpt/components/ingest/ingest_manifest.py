@@ -0,0 +1,179 @@
+import hashlib
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING, AnyStr
+
+from llama_index.schema import MetadataMode
+from llama_index.storage.kvstore import SimpleKVStore
+from llama_index.storage.kvstore.types import BaseInMemoryKVStore
+from pydantic import BaseModel, Field
+
+from private_gpt.components.embedding.wrapped_embedding import WrappedEmbedding
+
+if TYPE_CHECKING:
+    from llama_index.embeddings.base import BaseEmbedding
+    from llama_index.schema import BaseNode
+    from llama_index.storage.kvstore.types import BaseKVStore
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FNAME = "ingest_manifest.json"
+_MANIFEST_COLLECTION = "ingest_manifest"
+# Source key of the file of each document, and the marker of its completeness
+_DOCS_COLLECTION = "ingest_manifest_docs"
+_DOCS_INDEXED_KEY = "__indexed__"
+
+
+class IngestedFile(BaseModel):
+    """Manifest entry of an ingested file."""
+
+    file_name: str
+    file_hash: str | None = Field(
+        description="Hash of the content of the file. None if the documents of the "
+        "file have been modified after its ingestion, forcing its next ingestion."
+    )
+    embed_model: str
+    doc_ids: list[str]
+    chunks: dict[str, str] = Field(
+        default_factory=dict, description="Hash of the chunks to their node id."
+    )
+    collection: str | None = Field(
+        None, description="Collection of the documents, None for the default one."
+    )
+
+
+class IngestManifest:
+    """Content-addressed record of the files already ingested.
+
+    Each entry is identified by a source key (see `source_key`) and records the hash
+    of the file content, the embedding model used, the IDs of the resulting documents
+    and the hashes of their chunks. It allows to:
+
+    * skip the ingestion of files whose content and embedding model didn't change.
+    * reuse the embeddings of the unchanged chunks of a modified file.
+    * replace the documents of the previous version of a modified file, for the
+      sources with a stable identity (a path, or a source ID given by the caller).
+
+    The source key of the file of each document is also recorded, so the entry of a
+    document is found without reading the whole manifest.
+    """
+
+    def __init__(self, kvstore: "BaseKVStore") -> None:
+        self._kvstore = kvstore
+        if self._kvstore.get(_DOCS_INDEXED_KEY, collection=_DOCS_COLLECTION) is None:
+            # Manifest written before the documents were indexed
+            self._index_docs()
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: Path) -> "IngestManifest":
+        return cls(SimpleKVStore.from_persist_path(str(persist_dir / MANIFEST_FNAME)))
+
+    def persist(self, persist_dir: Path) -> None:
+        # Stores backed by a database are already up to date
+        if isinstance(self._kvstore, BaseInMemoryKVStore):
+            self._kvstore.persist(str(persist_dir / MANIFEST_FNAME))
+
+    def get(self, source_key: str) -> IngestedFile | None:
+        entry = self._kvstore.get(source_key, collection=_MANIFEST_COLLECTION)
+        return IngestedFile.model_validate(entry) if entry is not None else None
+
+    def put(self, source_key: str, ingested_file: IngestedFile) -> None:
+        previous = self.get(source_key)
+        self._kvstore.put(
+            source_key, ingested_file.model_dump(), collection=_MANIFEST_COLLECTION
+        )
+        for doc_id in ingested_file.doc_ids:
+            self._kvstore.put(
+                doc_id, {"source_key": source_key}, collection=_DOCS_COLLECTION
+            )
+        if previous is not None:
+            for doc_id in set(previous.doc_ids) - set(ingested_file.doc_ids):
+                self._kvstore.delete(doc_id, collection=_DOCS_COLLECTION)
+
+    def find_doc(self, doc_id: str) -> IngestedFile | None:
+        """Get the entry of the file of a document, None if not found."""
+        found = self._find_doc(doc_id)
+        return found[1] if found is not None else None
+
+    def list_files(self) -> list[IngestedFile]:
+        entries = self._kvstore.get_all(collection=_MANIFEST_COLLECTION)
+        return [IngestedFile.model_validate(entry) for entry in entries.values()]
+
+    def forget_doc(self, doc_id: str) -> None:
+        """Remove a deleted document from the entry of its file.
+
+        The file will be ingested again next time, even if it didn't change.
+        """
+        found = self._find_doc(doc_id)
+        if found is not None:
+            source_key, ingested_file = found
+            ingested_file.doc_ids.remove(doc_id)
+            ingested_file.file_hash = None
+            self.put(source_key, ingested_file)
+
+    def _find_doc(self, doc_id: str) -> tuple[str, IngestedFile] | None:
+        entry = self._kvstore.get(doc_id, collection=_DOCS_COLLECTION)
+        if entry is None:
+            return None
+        ingested_file = self.get(entry["source_key"])
+        if ingested_file is None or doc_id not in ingested_file.doc_ids:
+            return None
+        return entry["source_key"], ingested_file
+
+    def _index_docs(self) -> None:
+        entries = self._kvstore.get_all(collection=_MANIFEST_COLLECTION)
+        for source_key, entry in entries.items():
+            for doc_id in IngestedFile.model_validate(entry).doc_ids:
+                self._kvstore.put(
+                    doc_id, {"source_key": source_key}, collection=_DOCS_COLLECTION
+                )
+        self._kvstore.put(_DOCS_INDEXED_KEY, {}, collection=_DOCS_COLLECTION)
+
+    @staticmethod
+    def source_key(
+        file_data: AnyStr | Path,
+        file_hash: str,
+        collection: str | None = None,
+        source_id: str | None = None,
+    ) -> str:
+        """Identity of an ingested source.
+
+        A file ingested from the file system is identified by its path, and an upload
+        by the `source_id` given by the caller, if any: their new versions replace the
+        previous ones. Other uploads are only identified by their content, their name
+        not being unique: a different file with the same name is a new source.
+        """
+        if source_id is not None:
+            source = f"source:{source_id}"
+        elif isinstance(file_data, Path):
+            source = str(file_data.absolute())
+        else:
+            source = f"sha256:{file_hash}"
+        # The same file can be ingested in different collections
+        return f"{collection}:{source}" if collection is not None else source
+
+    @staticmethod
+    def file_hash(file_data: AnyStr | Path) -> str:
+        file_hash = hashlib.sha256()
+        if isinstance(file_data, Path):
+            with file_data.open("rb") as f:
+                while block := f.read(1024 * 1024):
+                    file_hash.update(block)
+        elif isinstance(file_data, bytes):
+            file_hash.update(file_data)
+        else:
+            file_hash.update(str(file_data).encode("utf-8"))
+        return file_hash.hexdigest()
+
+    @staticmethod
+    def chunk_hash(node: "BaseNode") -> str:
+        # The content the embedding is computed from
+        content = node.get_content(metadata_mode=MetadataMode.EMBED)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def embed_model_name(embed_model: "BaseEmbedding") -> str:
+        # Wrappers (i.e. caching) don't change the embeddings of the model
+        if isinstance(embed_model, WrappedEmbedding):
+            embed_model = embed_model.base_model
+        return f"{embed_model.class_name()}:{embed_model.model_name}"
@@ -0,0 +1,175 @@
+import logging
+import multiprocessing
+import queue
+import weakref
+from collections.abc import Callable
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, AnyStr
+
+from llama_index import Document
+
+from private_gpt.components.ingest.ingest_helper import IngestionHelper
+
+if TYPE_CHECKING:
+    from multiprocessing.connection import Connection
+
+logger = logging.getLogger(__name__)
+
+ParseFile = Callable[[str, Any], list[Document]]
+
+# Pools not closed yet, closed on the shutdown of the app
+_open_pools: "weakref.WeakSet[ParserPool]" = weakref.WeakSet()
+
+
+def _parser_loop(connection: "Connection", parse_file: ParseFile) -> None:
+    """Main loop of a parser process: parse the files received until EOF."""
+    # Started, the imports done: the parse timeouts start from here
+    connection.send(("ready", None))
+    while True:
+        try:
+            file_name, file_data = connection.recv()
+        except EOFError:
+            return
+        try:
+            documents = parse_file(file_name, file_data)
+            connection.send(("ok", documents))
+        except Exception as e:
+            # Exceptions are sent as text, as they are not always picklable
+            connection.send(("error", f"{type(e).__name__}: {e}"))
+
+
+def _process_context() -> Any:
+    # Never fork the server: its threads, locks and connections would be copied in a
+    # state the child can't rely on. The fork server is a clean single threaded
+    # process, with the parsers already imported: its children start fast
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+class _ParserProcess:
+    def __init__(self, context: Any, parse_file: ParseFile) -> None:
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(
+            target=_parser_loop, args=(child_connection, parse_file), daemon=True
+        )
+        self._process.start()
+        child_connection.close()
+        self._ready = False
+
+    def parse(
+        self, file_name: str, file_data: AnyStr | Path, timeout: float
+    ) -> list[Document]:
+        if not self._ready:
+            try:
+                self._connection.recv()
+            except EOFError:
+                self.kill()
+                raise RuntimeError(
+                    "Parser process failed to start, "
+                    f"exit code={self._process.exitcode}"
+                ) from None
+            self._ready = True
+        self._connection.send((file_name, file_data))
+        # poll returns True as well if the process died, recv raises EOFError then
+        if not self._connection.poll(timeout):
+            self.kill()
+            raise TimeoutError(
+                f"Parsing file={file_name} took more than timeout={timeout}s"
+            )
+        try:
+            status, result = self._connection.recv()
+        except EOFError:
+            self.kill()
+            raise RuntimeError(
+                f"Parser process crashed while parsing file={file_name}, "
+                f"exit code={self._process.exitcode}"
+            ) from None
+        if status == "error":
+            raise ValueError(f"Failed to parse file={file_name}: {result}")
+        return result  # type: ignore[no-any-return]
+
+    def is_alive(self) -> bool:
+        return bool(self._process.is_alive())
+
+    def kill(self) -> None:
+        self._process.kill()
+        self._process.join()
+        self._connection.close()
+
+
+class ParserPool:
+    """Parse files into `Document`s using a pool of worker processes.
+
+    Parsing some files (PDFs, DOCX...) is CPU intensive, and some pathological files
+    can make the parsers hang or crash. Each file is parsed in a separate process,
+    so the calling process is isolated from it:
+
+    * if the parsing takes longer than `timeout` seconds, the worker process is
+      killed and a `TimeoutError` is raised.
+    * if the worker process crashes, a `RuntimeError` is raised.
+
+    In both cases the dead worker is replaced by a new one on the next parse. Worker
+    processes are started lazily and reused between files. They are started by a
+    fork server (or spawned where not available), never forked from the server.
+
+    `parse_file` runs in the worker processes, so it must be importable by them,
+    i.e. a module level function.
+
+    `parse` is thread-safe: up to `workers` files are parsed at the same time,
+    callers beyond that wait for a worker to become available.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        timeout: float,
+        parse_file: ParseFile = IngestionHelper.transform_file_into_documents,
+    ) -> None:
+        self._workers = workers
+        self._timeout = timeout
+        self._parse_file = parse_file
+        self._context = _process_context()
+        self._idle: queue.Queue[_ParserProcess | None] = queue.Queue()
+        # Slots for processes not started yet
+        for _ in range(workers):
+            self._idle.put(None)
+        _open_pools.add(self)
+
+    @staticmethod
+    def close_all() -> None:
+        """Close every pool, i.e. on the shutdown of the app."""
+        for pool in list(_open_pools):
+            pool.close()
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    def parse(self, file_name: str, file_data: AnyStr | Path) -> list[Document]:
+        process = self._idle.get()
+        try:
+            if process is None or not process.is_alive():
+                process = _ParserProcess(self._context, self._parse_file)
+            documents = process.parse(file_name, file_data, self._timeout)
+        except (TimeoutError, RuntimeError):
+            logger.warning("Parser process for file=%s killed", file_name)
+            process = None
+            raise
+        finally:
+            self._idle.put(process)
+        return documents
+
+    def close(self) -> None:
+        """Stop the worker processes that are not in use."""
+        for _ in range(self._workers):
+            try:
+                process = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if process is not None:
+                process.kill()
+            self._idle.put(None)
+        _open_pools.discard(self)
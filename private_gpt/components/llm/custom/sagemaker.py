@@ -1,13 +1,14 @@
 # mypy: ignore-errors
 from __future__ import annotations
 
-import io
 import json
 import logging
+import threading
 from typing import TYPE_CHECKING, Any
 
 import boto3  # type: ignore
-from llama_index.bridge.pydantic import Field
+from botocore.config import Config  # type: ignore
+from llama_index.bridge.pydantic import Field, PrivateAttr
 from llama_index.llms import (
     CompletionResponse,
     CustomLLM,
@@ -18,6 +19,7 @@ from llama_index.llms.base import (
     llm_completion_callback,
 )
 from llama_index.llms.generic_utils import (
+    astream_completion_response_to_chat_response,
     completion_response_to_chat_response,
     stream_completion_response_to_chat_response,
 )
@@ -27,6 +29,7 @@ from llama_index.llms.llama_utils import (
 from llama_index.llms.llama_utils import (
     messages_to_prompt as generic_messages_to_prompt,
 )
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 
 if TYPE_CHECKING:
     from collections.abc import Sequence
@@ -35,7 +38,9 @@ if TYPE_CHECKING:
     from llama_index.llms import (
         ChatMessage,
         ChatResponse,
+        ChatResponseAsyncGen,
         ChatResponseGen,
+        CompletionResponseAsyncGen,
         CompletionResponseGen,
     )
 
@@ -62,20 +67,25 @@ class LineIterator:
     {'PayloadPart': {'Bytes': b'[" problem"]}\n'}}
     ```
 
-
-    This class accounts for this by concatenating bytes written via the 'write' function
-    and then exposing a method which will return lines (ending with a '\n' character)
-    within the buffer via the 'scan_lines' function. It maintains the position of the
-    last read position to ensure that previous bytes are not exposed again. It will
-    also save any pending lines that doe not end with a '\n' to make sure truncations
-    are concatinated
+    This class accounts for this by appending the bytes of the events to a buffer,
+    and returning the lines (ending with a '\n' character) of the buffer as soon as
+    they are complete. Bytes are only scanned once for the end of a line, and the
+    lines read are dropped from the buffer once they make up half of it: the cost per
+    event is constant, and the buffer is bounded by twice the longest line (plus the
+    size of an event).
+    The last line of the stream is returned even if it doesn't end with a '\n'.
     """
 
     def __init__(self, stream: Any) -> None:
         """Line iterator initializer."""
         self.byte_iterator = iter(stream)
-        self.buffer = io.BytesIO()
+        self.buffer = bytearray()
+        # View of the buffer lines are sliced from, released before the buffer is
+        # resized
+        self.view: memoryview | None = None
+        # Start of the next line, and position from which to look for its end
         self.read_pos = 0
+        self.scan_pos = 0
 
     def __iter__(self) -> Any:
         """Self iterator."""
@@ -84,22 +94,72 @@ class LineIterator:
     def __next__(self) -> Any:
         """Next element from iterator."""
         while True:
-            self.buffer.seek(self.read_pos)
-            line = self.buffer.readline()
-            if line and line[-1] == ord("\n"):
-                self.read_pos += len(line)
-                return line[:-1]
+            line_end = self.buffer.find(b"\n", self.scan_pos)
+            if line_end >= 0:
+                line_start = self.read_pos
+                self.read_pos = self.scan_pos = line_end + 1
+                line = self._decode(line_start, line_end)
+                if line is None:
+                    continue
+                return line
+            self.scan_pos = len(self.buffer)
             try:
                 chunk = next(self.byte_iterator)
             except StopIteration:
-                if self.read_pos < self.buffer.getbuffer().nbytes:
-                    continue
+                if self.read_pos < len(self.buffer):
+                    # Last line, without a trailing '\n'
+                    line_start, self.read_pos = self.read_pos, len(self.buffer)
+                    line = self._decode(line_start, len(self.buffer))
+                    if line is not None:
+                        return line
                 raise
             if "PayloadPart" not in chunk:
                 logger.warning("Unknown event type=%s", chunk)
                 continue
-            self.buffer.seek(0, io.SEEK_END)
-            self.buffer.write(chunk["PayloadPart"]["Bytes"])
+            self._append(chunk["PayloadPart"]["Bytes"])
+
+    def _decode(self, start: int, end: int) -> Any:
+        """Decode the line between `start` and `end`, None to skip it."""
+        return self._slice(start, end).tobytes()
+
+    def _slice(self, start: int, end: int) -> memoryview:
+        if self.view is None:
+            self.view = memoryview(self.buffer)
+        return self.view[start:end]
+
+    def _append(self, data: bytes) -> None:
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        # The lines read are dropped once they make up half of the buffer, so that
+        # each byte is moved at most once on average
+        if self.read_pos == len(self.buffer):
+            self.buffer.clear()
+        elif self.read_pos * 2 >= len(self.buffer):
+            del self.buffer[: self.read_pos]
+        else:
+            self.buffer += data
+            return
+        self.scan_pos -= self.read_pos
+        self.read_pos = 0
+        self.buffer += data
+
+
+class TGIEventIterator(LineIterator):
+    """Iterator over the JSON events of a TGI server-sent events stream.
+
+    The JSON object of each `data:{...}` line is decoded straight from the buffer,
+    without copying the line. Empty lines (separating the events) and lines without
+    a JSON object are skipped.
+    """
+
+    _decoder = json.JSONDecoder()
+
+    def _decode(self, start: int, end: int) -> Any:
+        json_start = self.buffer.find(b"{", start, end)
+        if json_start < 0:
+            return None
+        return self._decoder.raw_decode(str(self._slice(json_start, end), "utf-8"))[0]
 
 
 class SagemakerLLM(CustomLLM):
@@ -118,6 +178,11 @@ class SagemakerLLM(CustomLLM):
     Make sure the credentials / roles used have the required policies to
     access the Sagemaker endpoint.
     See: https://docs.aws.amazon.com/IAM/latest/UserGuide/access_policies.html
+
+    The boto3 client is created on first use, with a pool of up to
+    `max_pool_connections` connections, and shared by the concurrent requests:
+    requests hold no state in the instance. The async methods run the requests in
+    worker threads, without blocking the event loop.
     """
 
     endpoint_name: str = Field(description="")
@@ -139,10 +204,12 @@ class SagemakerLLM(CustomLLM):
         default_factory=dict, description="Kwargs used for model initialization."
     )
     verbose: bool = Field(description="Whether to print verbose output.")
+    max_pool_connections: int = Field(
+        description="The maximum number of connections to the endpoint."
+    )
 
-    _boto_client: Any = boto3.client(
-        "sagemaker-runtime",
-    )  # TODO make it an optional field
+    _boto_client: Any = PrivateAttr(default=None)
+    _boto_client_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
 
     def __init__(
         self,
@@ -156,18 +223,23 @@ class SagemakerLLM(CustomLLM):
         generate_kwargs: dict[str, Any] | None = None,
         model_kwargs: dict[str, Any] | None = None,
         verbose: bool = True,
+        max_pool_connections: int = 10,
     ) -> None:
         """SagemakerLLM initializer."""
-        model_kwargs = model_kwargs or {}
-        model_kwargs.update({"n_ctx": context_window, "verbose": verbose})
+        model_kwargs = {
+            **(model_kwargs or {}),
+            "n_ctx": context_window,
+            "verbose": verbose,
+        }
 
         messages_to_prompt = messages_to_prompt or generic_messages_to_prompt
         completion_to_prompt = completion_to_prompt or generic_completion_to_prompt
 
-        generate_kwargs = generate_kwargs or {}
-        generate_kwargs.update(
-            {"temperature": temperature, "max_tokens": max_new_tokens}
-        )
+        generate_kwargs = {
+            **(generate_kwargs or {}),
+            "temperature": temperature,
+            "max_tokens": max_new_tokens,
+        }
 
         super().__init__(
             endpoint_name=endpoint_name,
@@ -180,8 +252,25 @@ class SagemakerLLM(CustomLLM):
             generate_kwargs=generate_kwargs,
             model_kwargs=model_kwargs,
             verbose=verbose,
+            max_pool_connections=max_pool_connections,
         )
 
+    @property
+    def client(self) -> Any:
+        """The boto3 sagemaker-runtime client, created on first use."""
+        if self._boto_client is None:
+            with self._boto_client_lock:
+                if self._boto_client is None:
+                    # Clients are thread safe, sessions are not: use a new one
+                    self._boto_client = boto3.session.Session().client(
+                        "sagemaker-runtime",
+                        config=Config(
+                            max_pool_connections=self.max_pool_connections,
+                            retries={"mode": "adaptive"},
+                        ),
+                    )
+        return self._boto_client
+
     @property
     def inference_params(self):
         # TODO expose the rest of params
@@ -202,63 +291,76 @@ class SagemakerLLM(CustomLLM):
             model_name="Sagemaker LLama 2",
         )
 
-    @llm_completion_callback()
-    def complete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
-        self.generate_kwargs.update({"stream": False})
-
-        is_formatted = kwargs.pop("formatted", False)
-        if not is_formatted:
-            prompt = self.completion_to_prompt(prompt)
+    def _format_prompt(self, prompt: str, kwargs: dict[str, Any]) -> str:
+        if kwargs.pop("formatted", False):
+            return prompt
+        return self.completion_to_prompt(prompt)
 
+    def _complete(self, prompt: str) -> CompletionResponse:
         request_params = {
             "inputs": prompt,
             "stream": False,
             "parameters": self.inference_params,
         }
 
-        resp = self._boto_client.invoke_endpoint(
+        resp = self.client.invoke_endpoint(
             EndpointName=self.endpoint_name,
             Body=json.dumps(request_params),
             ContentType="application/json",
         )
 
-        response_body = resp["Body"]
-        response_str = response_body.read().decode("utf-8")
-        response_dict = eval(response_str)
+        response = json.loads(resp["Body"].read())
+        text = response[0]["generated_text"]
+        # The generated text may start with the prompt
+        if text.startswith(prompt):
+            text = text[len(prompt) :]
+        return CompletionResponse(text=text, raw=resp)
+
+    def _stream_complete(self, prompt: str) -> CompletionResponseGen:
+        text = ""
 
-        return CompletionResponse(
-            text=response_dict[0]["generated_text"][len(prompt) :], raw=resp
+        request_params = {
+            "inputs": prompt,
+            "stream": True,
+            "parameters": self.inference_params,
+        }
+        resp = self.client.invoke_endpoint_with_response_stream(
+            EndpointName=self.endpoint_name,
+            Body=json.dumps(request_params),
+            ContentType="application/json",
         )
 
+        event_stream = resp["Body"]
+        stop_token = "<|endoftext|>"
+
+        for data in TGIEventIterator(event_stream):
+            if data["token"]["text"] != stop_token:
+                delta = data["token"]["text"]
+                text += delta
+                yield CompletionResponse(delta=delta, text=text, raw=data)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
+        return self._complete(self._format_prompt(prompt, kwargs))
+
     @llm_completion_callback()
     def stream_complete(self, prompt: str, **kwargs: Any) -> CompletionResponseGen:
-        def get_stream():
-            text = ""
-
-            request_params = {
-                "inputs": prompt,
-                "stream": True,
-                "parameters": self.inference_params,
-            }
-            resp = self._boto_client.invoke_endpoint_with_response_stream(
-                EndpointName=self.endpoint_name,
-                Body=json.dumps(request_params),
-                ContentType="application/json",
-            )
-
-            event_stream = resp["Body"]
-            start_json = b"{"
-            stop_token = "<|endoftext|>"
-
-            for line in LineIterator(event_stream):
-                if line != b"" and start_json in line:
-                    data = json.loads(line[line.find(start_json) :].decode("utf-8"))
-                    if data["token"]["text"] != stop_token:
-                        delta = data["token"]["text"]
-                        text += delta
-                        yield CompletionResponse(delta=delta, text=text, raw=data)
-
-        return get_stream()
+        return self._stream_complete(self._format_prompt(prompt, kwargs))
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
+        return await run_in_threadpool(
+            self._complete, self._format_prompt(prompt, kwargs)
+        )
+
+    @llm_completion_callback()
+    async def astream_complete(
+        self, prompt: str, **kwargs: Any
+    ) -> CompletionResponseAsyncGen:
+        # The request is sent, and each event awaited, in a worker thread
+        return iterate_in_threadpool(
+            self._stream_complete(self._format_prompt(prompt, kwargs))
+        )
 
     @llm_chat_callback()
     def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
@@ -273,3 +375,21 @@ class SagemakerLLM(CustomLLM):
         prompt = self.messages_to_prompt(messages)
         completion_response = self.stream_complete(prompt, formatted=True, **kwargs)
         return stream_completion_response_to_chat_response(completion_response)
+
+    @llm_chat_callback()
+    async def achat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponse:
+        prompt = self.messages_to_prompt(messages)
+        completion_response = await self.acomplete(prompt, formatted=True, **kwargs)
+        return completion_response_to_chat_response(completion_response)
+
+    @llm_chat_callback()
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        prompt = self.messages_to_prompt(messages)
+        completion_response = await self.astream_complete(
+            prompt, formatted=True, **kwargs
+        )
+        return astream_completion_response_to_chat_response(completion_response)
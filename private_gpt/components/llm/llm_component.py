@@ -1,7 +1,10 @@
+from collections.abc import AsyncIterator, Sequence
+
 from injector import inject, singleton
-from llama_index.llms import MockLLM
+from llama_index.llms import ChatMessage, ChatResponse, CustomLLM, MockLLM
 from llama_index.llms.base import LLM
 from llama_index.llms.llama_utils import completion_to_prompt, messages_to_prompt
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 
 from private_gpt.paths import models_path
 from private_gpt.settings.settings import Settings
@@ -17,7 +20,7 @@ class LLMComponent:
             case "local":
                 from llama_index.llms import LlamaCPP
 
-                self.llm = LlamaCPP(
+                llama_cpp_llm = LlamaCPP(
                     model_path=str(models_path / settings.local.llm_hf_model_file),
                     temperature=0.1,
                     # llama2 has a context window of 4096 tokens,
@@ -31,12 +34,27 @@ class LLMComponent:
                     completion_to_prompt=completion_to_prompt,
                     verbose=True,
                 )
+                if settings.local.prompt_cache_enabled:
+                    from llama_cpp import LlamaRAMCache  # type: ignore[import-not-found]
+
+                    # LRU of the evaluated states, keyed by their tokens. A prompt is
+                    # evaluated from the state of its longest cached prefix, i.e.
+                    # the previous turn of its conversation
+                    llama_cpp_llm._model.set_cache(
+                        LlamaRAMCache(
+                            capacity_bytes=settings.local.prompt_cache_max_size_mb
+                            * 1024
+                            * 1024
+                        )
+                    )
+                self.llm = llama_cpp_llm
 
             case "sagemaker":
                 from private_gpt.components.llm.custom.sagemaker import SagemakerLLM
 
                 self.llm = SagemakerLLM(
                     endpoint_name=settings.sagemaker.llm_endpoint_name,
+                    max_pool_connections=settings.sagemaker.max_pool_connections,
                 )
             case "openai":
                 from llama_index.llms import OpenAI
@@ -45,3 +63,31 @@ class LLMComponent:
                 self.llm = OpenAI(api_key=openai_settings)
             case "mock":
                 self.llm = MockLLM()
+
+    async def achat(self, messages: Sequence[ChatMessage]) -> ChatResponse:
+        """Chat with the LLM without blocking the event loop.
+
+        LLMs without a native async API run their sync API in a worker thread.
+        """
+        if self._overrides_custom_llm("achat"):
+            return await self.llm.achat(messages)
+        return await run_in_threadpool(self.llm.chat, messages)
+
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage]
+    ) -> AsyncIterator[ChatResponse]:
+        """Stream a chat with the LLM without blocking the event loop.
+
+        LLMs without a native async API run their sync stream in worker threads, the
+        thread being held only while waiting for the next token.
+        """
+        if self._overrides_custom_llm("astream_chat"):
+            return await self.llm.astream_chat(messages)
+        return iterate_in_threadpool(self.llm.stream_chat(messages))
+
+    def _overrides_custom_llm(self, method_name: str) -> bool:
+        # The async API of `CustomLLM` (LlamaCPP, Sagemaker, mock...) calls the
+        # sync one from the event loop, blocking it for the whole generation
+        return not isinstance(self.llm, CustomLLM) or getattr(
+            type(self.llm), method_name
+        ) is not getattr(CustomLLM, method_name)
@@ -2,10 +2,15 @@ import logging
 
 from injector import inject, singleton
 from llama_index.storage.docstore import BaseDocumentStore, SimpleDocumentStore
-from llama_index.storage.index_store import SimpleIndexStore
+from llama_index.storage.index_store import KVIndexStore, SimpleIndexStore
 from llama_index.storage.index_store.types import BaseIndexStore
+from llama_index.storage.kvstore import SimpleKVStore
 
+from private_gpt.components.ingest.ingest_manifest import IngestManifest
+from private_gpt.components.node_store.sqlite_docstore import SqliteDocumentStore
+from private_gpt.components.node_store.sqlite_kvstore import SqliteKVStore
 from private_gpt.paths import local_data_path
+from private_gpt.settings.settings import Settings
 
 logger = logging.getLogger(__name__)
 
@@ -14,21 +19,48 @@ logger = logging.getLogger(__name__)
 class NodeStoreComponent:
     index_store: BaseIndexStore
     doc_store: BaseDocumentStore
+    ingest_manifest: IngestManifest
 
     @inject
-    def __init__(self) -> None:
-        try:
-            self.index_store = SimpleIndexStore.from_persist_dir(
-                persist_dir=str(local_data_path)
-            )
-        except FileNotFoundError:
-            logger.debug("Local index store not found, creating a new one")
-            self.index_store = SimpleIndexStore()
-
-        try:
-            self.doc_store = SimpleDocumentStore.from_persist_dir(
-                persist_dir=str(local_data_path)
-            )
-        except FileNotFoundError:
-            logger.debug("Local document store not found, creating a new one")
-            self.doc_store = SimpleDocumentStore()
+    def __init__(self, settings: Settings) -> None:
+        match settings.nodestore.database:
+            case "simple":
+                try:
+                    self.index_store = SimpleIndexStore.from_persist_dir(
+                        persist_dir=str(local_data_path)
+                    )
+                except FileNotFoundError:
+                    logger.debug("Local index store not found, creating a new one")
+                    self.index_store = SimpleIndexStore()
+
+                try:
+                    self.doc_store = SimpleDocumentStore.from_persist_dir(
+                        persist_dir=str(local_data_path)
+                    )
+                except FileNotFoundError:
+                    logger.debug("Local document store not found, creating a new one")
+                    self.doc_store = SimpleDocumentStore()
+
+                try:
+                    self.ingest_manifest = IngestManifest.from_persist_dir(
+                        persist_dir=local_data_path
+                    )
+                except FileNotFoundError:
+                    logger.debug("Local ingest manifest not found, creating a new one")
+                    self.ingest_manifest = IngestManifest(SimpleKVStore())
+
+            case "sqlite":
+                # All stores share the same database, using different namespaces.
+                # Changes are written as they happen, so persisting the storage
+                # context is a no-op for them.
+                kvstore = SqliteKVStore(local_data_path / "nodestore.sqlite")
+                self.index_store = KVIndexStore(kvstore)
+                self.doc_store = SqliteDocumentStore(kvstore)
+                self.ingest_manifest = IngestManifest(kvstore)
+
+            case _:
+                # Should be unreachable
+                # The settings validator should have caught this
+                raise ValueError(
+                    f"Nodestore database {settings.nodestore.database} not supported"
+                )
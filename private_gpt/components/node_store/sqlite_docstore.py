@@ -0,0 +1,36 @@
+from llama_index.schema import BaseNode
+from llama_index.storage.docstore import KVDocumentStore
+from llama_index.storage.docstore.utils import json_to_doc
+
+from private_gpt.components.node_store.sqlite_kvstore import SqliteKVStore
+
+
+class SqliteDocumentStore(KVDocumentStore):
+    """Document store backed by a `SqliteKVStore`.
+
+    Fetches many nodes with a single query, instead of one query per node.
+    """
+
+    def __init__(self, kvstore: SqliteKVStore) -> None:
+        super().__init__(kvstore)
+        self._sqlite_kvstore = kvstore
+
+    def get_nodes(
+        self, node_ids: list[str], raise_error: bool = True
+    ) -> list[BaseNode]:
+        """Get nodes from docstore, missing nodes are skipped if not `raise_error`."""
+        node_jsons = self._sqlite_kvstore.get_many(
+            node_ids, collection=self._node_collection
+        )
+        nodes = []
+        for node_id in node_ids:
+            node_json = node_jsons.get(node_id)
+            if node_json is None:
+                if raise_error:
+                    raise ValueError(f"doc_id {node_id} not found.")
+                continue
+            node = json_to_doc(node_json)
+            if not isinstance(node, BaseNode):
+                raise ValueError(f"Document {node_id} is not a Node.")
+            nodes.append(node)
+        return nodes
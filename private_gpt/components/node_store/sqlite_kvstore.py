@@ -0,0 +1,108 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any
+
+from llama_index.storage.kvstore.types import DEFAULT_COLLECTION, BaseKVStore
+
+# Max number of variables of a SQLite statement in old SQLite versions
+_SQLITE_MAX_VARIABLES = 999
+
+
+class SqliteKVStore(BaseKVStore):
+    """Key-Value store persisted in a local SQLite database.
+
+    Every `put` and `delete` is written straight to the database, so the cost of
+    persisting changes is proportional to the amount of changed entries instead of
+    the size of the whole store (as it happens with `SimpleKVStore`, that dumps the
+    full JSON on each persist).
+
+    The database is opened in WAL mode: writes are appended to the write-ahead log
+    and readers are never blocked by an ongoing ingestion.
+
+    Args:
+        db_path: path of the SQLite database file, created if it doesn't exist
+    """
+
+    def __init__(self, db_path: Path | str) -> None:
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        # The connection is shared between the request threads of the server,
+        # access to it is serialized through the lock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            str(db_path), check_same_thread=False, isolation_level=None
+        )
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS kvstore ("
+                "collection TEXT NOT NULL, "
+                "key TEXT NOT NULL, "
+                "value TEXT NOT NULL, "
+                "PRIMARY KEY (collection, key))"
+            )
+
+    def put(
+        self, key: str, val: dict[str, Any], collection: str = DEFAULT_COLLECTION
+    ) -> None:
+        """Put a key-value pair into the store."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO kvstore (collection, key, value) "
+                "VALUES (?, ?, ?)",
+                (collection, key, json.dumps(val)),
+            )
+
+    def get(
+        self, key: str, collection: str = DEFAULT_COLLECTION
+    ) -> dict[str, Any] | None:
+        """Get a value from the store."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM kvstore WHERE collection = ? AND key = ?",
+                (collection, key),
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])  # type: ignore[no-any-return]
+
+    def get_many(
+        self, keys: list[str], collection: str = DEFAULT_COLLECTION
+    ) -> dict[str, dict[str, Any]]:
+        """Get the values of many keys at once, missing keys are omitted."""
+        values: dict[str, dict[str, Any]] = {}
+        for start in range(0, len(keys), _SQLITE_MAX_VARIABLES - 1):
+            chunk = keys[start : start + _SQLITE_MAX_VARIABLES - 1]
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT key, value FROM kvstore WHERE collection = ? "
+                    f"AND key IN ({', '.join('?' * len(chunk))})",
+                    (collection, *chunk),
+                ).fetchall()
+            values.update((key, json.loads(value)) for key, value in rows)
+        return values
+
+    def get_all(
+        self, collection: str = DEFAULT_COLLECTION
+    ) -> dict[str, dict[str, Any]]:
+        """Get all values from the store."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT key, value FROM kvstore WHERE collection = ?", (collection,)
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        """Delete a value from the store."""
+        with self._lock:
+            cursor = self._connection.execute(
+                "DELETE FROM kvstore WHERE collection = ? AND key = ?",
+                (collection, key),
+            )
+        return cursor.rowcount > 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,70 @@
+import logging
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from llama_index.schema import BaseNode
+    from llama_index.storage.docstore import BaseDocumentStore
+
+logger = logging.getLogger(__name__)
+
+
+class NodeOrdinalIndex:
+    """Ordering of the nodes of each document, to resolve windows of sibling nodes.
+
+    The order of the nodes of a document (`ref_doc_id` to its ordered node IDs) is
+    taken from the document store, that records the node IDs of each document in
+    insertion order, and kept in memory until `clear` is called.
+
+    With it, the IDs of the `n` nodes before or after a node are known without
+    fetching the nodes in between, so the windows of many nodes can be fetched with
+    a single bulk call to the document store.
+    """
+
+    def __init__(self, docstore: "BaseDocumentStore") -> None:
+        self._docstore = docstore
+        self._lock = threading.Lock()
+        # ref_doc_id to its ordered node IDs and the position of each of them
+        self._orders: dict[str, tuple[list[str], dict[str, int]]] = {}
+
+    def window(self, node: "BaseNode", count: int, forward: bool) -> list[str]:
+        """IDs of the `count` siblings after (or before) `node`, nearest first.
+
+        The window stops at the boundaries of the document of `node`. It is empty if
+        the order of the document doesn't match the relationships of `node`.
+        """
+        if count <= 0 or node.ref_doc_id is None:
+            return []
+        node_ids, positions = self._get_order(node.ref_doc_id)
+        position = positions.get(node.node_id)
+        if position is None:
+            return []
+        if forward:
+            window = node_ids[position + 1 : position + 1 + count]
+            related = node.next_node
+        else:
+            window = node_ids[max(position - count, 0) : position][::-1]
+            related = node.prev_node
+        # Only trust the order if it agrees with the node's own relationships
+        if window and (related is None or related.node_id != window[0]):
+            logger.debug("Order of document=%s out of date", node.ref_doc_id)
+            return []
+        return window
+
+    def clear(self) -> None:
+        with self._lock:
+            self._orders.clear()
+
+    def _get_order(self, ref_doc_id: str) -> tuple[list[str], dict[str, int]]:
+        with self._lock:
+            order = self._orders.get(ref_doc_id)
+        if order is None:
+            ref_doc_info = self._docstore.get_ref_doc_info(ref_doc_id)
+            node_ids = ref_doc_info.node_ids if ref_doc_info is not None else []
+            order = (
+                node_ids,
+                {node_id: position for position, node_id in enumerate(node_ids)},
+            )
+            with self._lock:
+                self._orders[ref_doc_id] = order
+        return order
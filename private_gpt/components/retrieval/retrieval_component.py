@@ -0,0 +1,156 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from injector import inject, singleton
+from llama_index import ServiceContext, StorageContext, VectorStoreIndex
+from llama_index.indices.vector_store import VectorIndexRetriever
+from llama_index.schema import NodeWithScore, QueryBundle
+from starlette.concurrency import run_in_threadpool
+
+from private_gpt.components.embedding.embedding_component import EmbeddingComponent
+from private_gpt.components.llm.llm_component import LLMComponent
+from private_gpt.components.node_store.node_store_component import NodeStoreComponent
+from private_gpt.components.retrieval.node_ordinal_index import NodeOrdinalIndex
+from private_gpt.components.vector_store.vector_store_component import (
+    VectorStoreComponent,
+)
+from private_gpt.open_ai.extensions.context_filter import ContextFilter
+from private_gpt.settings.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+# Max number of distinct (context filter, top k) retrievers kept
+_MAX_CACHED_RETRIEVERS = 256
+
+
+@singleton
+class RetrievalComponent:
+    """Long-lived retrieval engine shared by the services querying the index.
+
+    The `VectorStoreIndex` of each collection is built once and reused by every
+    request, as are the retrievers, cached by the shape of the request (its
+    `ContextFilter`, including its collection, and number of results). Retrievers
+    hold no per-request state, so they are shared between concurrent requests.
+
+    It also keeps the `NodeOrdinalIndex` used to resolve the siblings of the
+    retrieved nodes.
+
+    The indexes, the retrievers and the node ordering are only rebuilt after
+    `invalidate` is called, i.e. when the ingestion mutates the stores, which also
+    bumps the `corpus_version` the results derived from the stores can be keyed by.
+    It is only bumped by the ingestion of this process: documents ingested by another
+    one (i.e. scripts/ingest_folder.py) don't change it.
+    """
+
+    storage_context: StorageContext
+    service_context: ServiceContext
+    node_ordinal_index: NodeOrdinalIndex
+
+    @inject
+    def __init__(
+        self,
+        llm_component: LLMComponent,
+        vector_store_component: VectorStoreComponent,
+        embedding_component: EmbeddingComponent,
+        node_store_component: NodeStoreComponent,
+        settings: Settings,
+    ) -> None:
+        self.vector_store_component = vector_store_component
+        self.embedding_component = embedding_component
+        self.node_store_component = node_store_component
+        self.storage_context = StorageContext.from_defaults(
+            vector_store=vector_store_component.vector_store,
+            docstore=node_store_component.doc_store,
+            index_store=node_store_component.index_store,
+        )
+        self.service_context = ServiceContext.from_defaults(
+            llm=llm_component.llm, embed_model=embedding_component.embedding_model
+        )
+        self.node_ordinal_index = NodeOrdinalIndex(node_store_component.doc_store)
+        self.corpus_version = 0
+        self._lock = threading.Lock()
+        self._max_indexes = settings.vectorstore.max_open_collections + 1
+        self._indexes: OrderedDict[str | None, VectorStoreIndex] = OrderedDict()
+        self._retrievers: OrderedDict[
+            tuple[str, int], VectorIndexRetriever
+        ] = OrderedDict()
+
+    @property
+    def index(self) -> VectorStoreIndex:
+        """Index of the default collection."""
+        with self._lock:
+            return self._get_index(None)
+
+    def get_retriever(
+        self, context_filter: ContextFilter | None = None, similarity_top_k: int = 2
+    ) -> VectorIndexRetriever:
+        key = (
+            context_filter.model_dump_json() if context_filter else "",
+            similarity_top_k,
+        )
+        with self._lock:
+            retriever = self._retrievers.get(key)
+            if retriever is None:
+                retriever = self.vector_store_component.get_retriever(
+                    index=self._get_index(
+                        context_filter.collection if context_filter else None
+                    ),
+                    context_filter=context_filter,
+                    similarity_top_k=similarity_top_k,
+                )
+                self._retrievers[key] = retriever
+                if len(self._retrievers) > _MAX_CACHED_RETRIEVERS:
+                    self._retrievers.popitem(last=False)
+            else:
+                self._retrievers.move_to_end(key)
+            return retriever
+
+    async def aretrieve(
+        self,
+        text: str,
+        context_filter: ContextFilter | None = None,
+        similarity_top_k: int = 2,
+    ) -> list[NodeWithScore]:
+        """Retrieve the nodes most similar to `text` without blocking the event loop.
+
+        The query is embedded through the async API of the embedding model. The
+        vector store is queried in a worker thread: the async API of the vector
+        stores is either missing (it calls the sync one) or, for Qdrant, limited to
+        remote gRPC servers.
+        """
+        embedding = await self.embedding_component.aget_query_embedding(text)
+        retriever = self.get_retriever(context_filter, similarity_top_k)
+        return await run_in_threadpool(
+            retriever.retrieve, QueryBundle(query_str=text, embedding=embedding)
+        )
+
+    def invalidate(self) -> None:
+        """Discard the indexes, retrievers and node ordering, rebuilt on next use."""
+        with self._lock:
+            logger.debug("Invalidating the retrieval indexes")
+            self._indexes.clear()
+            self._retrievers.clear()
+            self.corpus_version += 1
+        self.node_ordinal_index.clear()
+
+    def _get_index(self, collection: str | None) -> VectorStoreIndex:
+        index = self._indexes.get(collection)
+        if index is not None:
+            self._indexes.move_to_end(collection)
+            return index
+        vector_store = self.vector_store_component.get_vector_store(collection)
+        index = VectorStoreIndex.from_vector_store(
+            vector_store,
+            storage_context=StorageContext.from_defaults(
+                vector_store=vector_store,
+                docstore=self.node_store_component.doc_store,
+                index_store=self.node_store_component.index_store,
+            ),
+            service_context=self.service_context,
+        )
+        self._indexes[collection] = index
+        # Bounded as the open vector stores, the indexes keep them open
+        if len(self._indexes) > self._max_indexes:
+            self._indexes.popitem(last=False)
+        return index
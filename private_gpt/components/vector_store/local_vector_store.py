@@ -0,0 +1,534 @@
+import json
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+from llama_index.schema import BaseNode
+from llama_index.vector_stores.types import (
+    ExactMatchFilter,
+    VectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from llama_index.vector_stores.utils import (
+    metadata_dict_to_node,
+    node_to_metadata_dict,
+)
+
+logger = logging.getLogger(__name__)
+
+# Rows the vectors file grows by, at least
+_MIN_GROWTH = 1024
+# Max number of inverted lists, and of training vectors per list
+_MAX_LISTS = 1024
+_TRAINING_VECTORS_PER_LIST = 64
+_KMEANS_ITERATIONS = 10
+# Max number of variables of a SQLite statement in old SQLite versions
+_SQLITE_MAX_VARIABLES = 999
+
+FloatArray = npt.NDArray[np.float32]
+IntArray = npt.NDArray[np.int64]
+
+
+@dataclass(frozen=True)
+class _Snapshot:
+    """State of the index read by a query, never modified once published."""
+
+    vectors: FloatArray
+    norms: FloatArray
+    # Whether each row holds a vector
+    valid: npt.NDArray[np.bool_]
+    node_ids: list[str | None]
+    doc_rows: dict[str, IntArray]
+    centroids: FloatArray | None
+    lists: list[IntArray]
+
+
+class LocalVectorStore(VectorStore):
+    """In-process vector store, without any extra service.
+
+    Embeddings are stored in `persist_dir` in two files:
+
+    * `vectors.f32`: memory-mapped matrix of float32, one row per node. It grows as
+      nodes are added, the rows of deleted nodes are reused.
+    * `index.sqlite`: the node (without its embedding) and document ID of each row,
+      and the inverted list the row belongs to.
+
+    Queries are answered by cosine similarity. Below `ivf_min_vectors` vectors, the
+    search is exact. Above, an IVF index is trained (spherical k-means over a
+    sample of the vectors), and only the rows of the `ivf_probes` lists whose
+    centroids are the most similar to the query are scored. The index is trained
+    again every time the number of vectors doubles.
+
+    Queries filtered by `doc_ids` only score the rows of those documents, exactly.
+    """
+
+    stores_text: bool = True
+
+    def __init__(
+        self, persist_dir: Path, ivf_min_vectors: int = 20000, ivf_probes: int = 16
+    ) -> None:
+        persist_dir.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = persist_dir / "vectors.f32"
+        self._centroids_path = persist_dir / "centroids.npy"
+        self._ivf_min_vectors = ivf_min_vectors
+        self._ivf_probes = ivf_probes
+        self._database_path = persist_dir / "index.sqlite"
+        # Changes are serialized by the lock, queries run concurrently with their
+        # own connection and a snapshot of the index
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connection = self._connect()
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS rows ("
+            "row INTEGER PRIMARY KEY, "
+            "node_id TEXT NOT NULL UNIQUE, "
+            "doc_id TEXT, "
+            "node TEXT NOT NULL, "
+            "list INTEGER)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS rows_doc_id ON rows (doc_id)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        # Number of vectors when the IVF index was trained
+        self._trained_size = 0
+        self._snapshot = self._load()
+
+    @property
+    def client(self) -> Any:
+        return self
+
+    def add(self, nodes: list[BaseNode], **add_kwargs: Any) -> list[str]:
+        if not nodes:
+            return []
+        embeddings = np.array(
+            [node.get_embedding() for node in nodes], dtype=np.float32
+        )
+        with self._lock:
+            # Nodes added again replace their previous embedding
+            self._delete_rows(self._get_rows([node.node_id for node in nodes]))
+            snapshot = self._snapshot
+
+            free_rows = np.flatnonzero(~snapshot.valid)[: len(nodes)]
+            new_rows = np.arange(
+                len(snapshot.valid), len(snapshot.valid) + len(nodes) - len(free_rows)
+            )
+            rows = np.concatenate([free_rows, new_rows]).astype(np.int64)
+            vectors = self._ensure_capacity(
+                snapshot.vectors, int(rows.max()) + 1, embeddings.shape[1]
+            )
+            vectors[rows] = embeddings
+            # The vectors must be on disk before the index points to them
+            if isinstance(vectors, np.memmap):
+                vectors.flush()
+
+            valid = np.zeros(len(vectors), dtype=np.bool_)
+            valid[: len(snapshot.valid)] = snapshot.valid
+            valid[rows] = True
+            norms = np.zeros(len(vectors), dtype=np.float32)
+            norms[: len(snapshot.norms)] = snapshot.norms
+            norms[rows] = np.linalg.norm(embeddings, axis=1)
+            node_ids = snapshot.node_ids + [None] * (
+                len(vectors) - len(snapshot.node_ids)
+            )
+            for row, node in zip(rows, nodes, strict=True):
+                node_ids[row] = node.node_id
+
+            assigned = (
+                self._assign(embeddings, snapshot.centroids)
+                if snapshot.centroids is not None
+                else None
+            )
+            self._connection.execute("BEGIN")
+            self._connection.executemany(
+                "INSERT INTO rows (row, node_id, doc_id, node, list) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        int(row),
+                        node.node_id,
+                        node.ref_doc_id,
+                        json.dumps(node_to_metadata_dict(node, remove_text=False)),
+                        int(assigned[position]) if assigned is not None else None,
+                    )
+                    for position, (row, node) in enumerate(
+                        zip(rows, nodes, strict=True)
+                    )
+                ],
+            )
+            self._connection.execute("COMMIT")
+
+            doc_rows = dict(snapshot.doc_rows)
+            for doc_id in {node.ref_doc_id for node in nodes}:
+                if doc_id is None:
+                    continue
+                added = [
+                    row
+                    for row, node in zip(rows, nodes, strict=True)
+                    if node.ref_doc_id == doc_id
+                ]
+                doc_rows[doc_id] = np.concatenate(
+                    [doc_rows.get(doc_id, np.empty(0, np.int64)), added]
+                ).astype(np.int64)
+            lists = snapshot.lists
+            if assigned is not None:
+                lists = [
+                    np.concatenate([rows_of_list, rows[assigned == number]])
+                    for number, rows_of_list in enumerate(lists)
+                ]
+
+            self._snapshot = _Snapshot(
+                vectors=vectors,
+                norms=norms,
+                valid=valid,
+                node_ids=node_ids,
+                doc_rows=doc_rows,
+                centroids=snapshot.centroids,
+                lists=lists,
+            )
+            size = int(valid.sum())
+            if size >= self._ivf_min_vectors and size >= 2 * self._trained_size:
+                self._train()
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        with self._lock:
+            rows = self._snapshot.doc_rows.get(ref_doc_id)
+            if rows is not None:
+                self._delete_rows(rows)
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.query_embedding is None:
+            raise ValueError("Query embedding is required")
+        snapshot = self._snapshot
+        embedding = np.asarray(query.query_embedding, dtype=np.float32)
+
+        doc_ids = self._filtered_doc_ids(query)
+        if doc_ids is not None:
+            # Only the rows of the documents, scored exactly
+            rows_of_docs = [
+                snapshot.doc_rows[doc_id]
+                for doc_id in doc_ids
+                if doc_id in snapshot.doc_rows
+            ]
+            candidates = (
+                np.concatenate(rows_of_docs) if rows_of_docs else np.empty(0, np.int64)
+            )
+        elif snapshot.centroids is not None:
+            candidates = self._probe(snapshot, embedding)
+        else:
+            candidates = None
+        if query.node_ids is not None:
+            allowed = np.asarray(self._get_rows(query.node_ids), dtype=np.int64)
+            candidates = (
+                allowed if candidates is None else np.intersect1d(candidates, allowed)
+            )
+
+        rows, similarities = self._top_k(
+            snapshot, embedding, candidates, query.similarity_top_k
+        )
+        nodes = self._get_nodes(rows.tolist())
+        # Rows deleted since the snapshot are skipped, and so are the rows reused
+        # since by another node, which may not match the filters of the query
+        allowed_doc_ids = set(doc_ids) if doc_ids is not None else None
+        allowed_node_ids = set(query.node_ids) if query.node_ids is not None else None
+        found = [
+            (node, similarity)
+            for row, similarity in zip(
+                rows.tolist(), similarities.tolist(), strict=True
+            )
+            if (node := nodes.get(row)) is not None
+            and node.node_id == snapshot.node_ids[row]
+            and (allowed_doc_ids is None or node.ref_doc_id in allowed_doc_ids)
+            and (allowed_node_ids is None or node.node_id in allowed_node_ids)
+        ]
+        return VectorStoreQueryResult(
+            nodes=[node for node, _ in found],
+            similarities=[similarity for _, similarity in found],
+            ids=[node.node_id for node, _ in found],
+        )
+
+    def get_embeddings(self, node_ids: list[str]) -> dict[str, list[float]]:
+        """Get the stored embeddings of the given nodes, by node id."""
+        snapshot = self._snapshot
+        rows = self._get_rows(node_ids)
+        return {
+            snapshot.node_ids[row] or "": snapshot.vectors[row].tolist() for row in rows
+        }
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        # Vectors and rows are written on every change
+        return None
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection: sqlite3.Connection | None = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                str(self._database_path), check_same_thread=False, isolation_level=None
+            )
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _filtered_doc_ids(query: VectorStoreQuery) -> list[str] | None:
+        doc_ids = query.doc_ids
+        for query_filter in query.filters.filters if query.filters else []:
+            if not isinstance(
+                query_filter, ExactMatchFilter
+            ) or query_filter.key not in (
+                "doc_id",
+                "ref_doc_id",
+            ):
+                raise ValueError(
+                    f"Filter on key={query_filter.key} not supported, only doc_id"
+                )
+            filter_doc_ids = [str(query_filter.value)]
+            doc_ids = (
+                filter_doc_ids
+                if doc_ids is None
+                else [doc_id for doc_id in doc_ids if doc_id in filter_doc_ids]
+            )
+        return doc_ids
+
+    def _probe(self, snapshot: _Snapshot, embedding: FloatArray) -> IntArray:
+        assert snapshot.centroids is not None
+        scores = snapshot.centroids @ embedding
+        probes = min(self._ivf_probes, len(scores))
+        nearest = np.argpartition(-scores, probes - 1)[:probes]
+        return np.concatenate([snapshot.lists[number] for number in nearest])
+
+    @staticmethod
+    def _top_k(
+        snapshot: _Snapshot,
+        embedding: FloatArray,
+        candidates: IntArray | None,
+        top_k: int,
+    ) -> tuple[IntArray, FloatArray]:
+        if candidates is None:
+            rows = np.flatnonzero(snapshot.valid)
+            if len(rows) and rows[-1] == len(rows) - 1:
+                # No gap, scored over the contiguous rows without copying them
+                scores = snapshot.vectors[: len(rows)] @ embedding
+            else:
+                scores = snapshot.vectors[rows] @ embedding
+        else:
+            rows = candidates[snapshot.valid[candidates]]
+            scores = snapshot.vectors[rows] @ embedding
+        if len(rows) == 0:
+            return rows, np.empty(0, np.float32)
+        norms = snapshot.norms[rows] * np.linalg.norm(embedding)
+        scores = np.divide(scores, norms, out=np.zeros_like(scores), where=norms > 0)
+        top_k = min(top_k, len(rows))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return rows[best], scores[best]
+
+    def _delete_rows(self, rows: IntArray | list[int]) -> None:
+        snapshot = self._snapshot
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+        self._connection.executemany(
+            "DELETE FROM rows WHERE row = ?", [(int(row),) for row in rows]
+        )
+        valid = snapshot.valid.copy()
+        valid[rows] = False
+        node_ids = list(snapshot.node_ids)
+        for row in rows:
+            node_ids[row] = None
+        doc_rows = {
+            doc_id: remaining
+            for doc_id, doc_rows_of_doc in snapshot.doc_rows.items()
+            if len(remaining := np.setdiff1d(doc_rows_of_doc, rows)) > 0
+        }
+        lists = [np.setdiff1d(rows_of_list, rows) for rows_of_list in snapshot.lists]
+        self._snapshot = _Snapshot(
+            vectors=snapshot.vectors,
+            norms=snapshot.norms,
+            valid=valid,
+            node_ids=node_ids,
+            doc_rows=doc_rows,
+            centroids=snapshot.centroids,
+            lists=lists,
+        )
+
+    def _get_nodes(self, rows: list[int]) -> dict[int, BaseNode]:
+        nodes: dict[int, BaseNode] = {}
+        for start in range(0, len(rows), _SQLITE_MAX_VARIABLES):
+            chunk = rows[start : start + _SQLITE_MAX_VARIABLES]
+            for row, node in self._connect().execute(
+                f"SELECT row, node FROM rows WHERE row IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            ):
+                nodes[row] = metadata_dict_to_node(json.loads(node))
+        return nodes
+
+    def _get_rows(self, node_ids: list[str]) -> list[int]:
+        rows: list[int] = []
+        for start in range(0, len(node_ids), _SQLITE_MAX_VARIABLES):
+            chunk = node_ids[start : start + _SQLITE_MAX_VARIABLES]
+            rows.extend(
+                row
+                for (row,) in self._connect().execute(
+                    "SELECT row FROM rows "
+                    f"WHERE node_id IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+            )
+        return rows
+
+    def _ensure_capacity(
+        self, vectors: FloatArray, size: int, dimension: int
+    ) -> FloatArray:
+        if len(vectors) >= size and (
+            len(vectors) == 0 or vectors.shape[1] == dimension
+        ):
+            return vectors
+        if len(vectors) and vectors.shape[1] != dimension:
+            raise ValueError(
+                f"Embedding dimension={dimension} doesn't match the dimension="
+                f"{vectors.shape[1]} of the stored embeddings"
+            )
+        capacity = max(size, 2 * len(vectors), _MIN_GROWTH)
+        logger.debug("Growing vectors path=%s rows=%s", self._vectors_path, capacity)
+        if len(vectors) == 0:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('dimension', ?)",
+                (str(dimension),),
+            )
+        # Grown in place, the rows already written are kept
+        with self._vectors_path.open("ab") as f:
+            f.truncate(capacity * dimension * np.dtype(np.float32).itemsize)
+        return np.memmap(
+            self._vectors_path,
+            dtype=np.float32,
+            mode="r+",
+            shape=(capacity, dimension),
+        )
+
+    def _train(self) -> None:
+        snapshot = self._snapshot
+        rows = np.flatnonzero(snapshot.valid)
+        list_count = min(_MAX_LISTS, max(int(np.sqrt(len(rows))), 1))
+        logger.info("Training IVF index vectors=%s lists=%s", len(rows), list_count)
+
+        rng = np.random.default_rng(0)
+        sample_size = min(len(rows), list_count * _TRAINING_VECTORS_PER_LIST)
+        sample = self._normalized(
+            snapshot.vectors[np.sort(rng.choice(rows, sample_size, replace=False))]
+        )
+        centroids = sample[rng.choice(len(sample), list_count, replace=False)]
+        for _ in range(_KMEANS_ITERATIONS):
+            assigned = np.argmax(sample @ centroids.T, axis=1)
+            for number in range(list_count):
+                members = sample[assigned == number]
+                if len(members):
+                    centroids[number] = members.mean(axis=0)
+            centroids = self._normalized(centroids)
+
+        assigned = np.empty(len(rows), dtype=np.int64)
+        for start in range(0, len(rows), 65536):
+            chunk = rows[start : start + 65536]
+            assigned[start : start + len(chunk)] = self._assign(
+                snapshot.vectors[chunk], centroids
+            )
+        self._connection.execute("BEGIN")
+        self._connection.executemany(
+            "UPDATE rows SET list = ? WHERE row = ?",
+            zip(assigned.tolist(), rows.tolist(), strict=True),
+        )
+        self._connection.execute("COMMIT")
+        np.save(self._centroids_path, centroids)
+
+        self._trained_size = len(rows)
+        self._snapshot = _Snapshot(
+            vectors=snapshot.vectors,
+            norms=snapshot.norms,
+            valid=snapshot.valid,
+            node_ids=snapshot.node_ids,
+            doc_rows=snapshot.doc_rows,
+            centroids=centroids,
+            lists=[rows[assigned == number] for number in range(list_count)],
+        )
+
+    def _assign(self, vectors: FloatArray, centroids: FloatArray) -> IntArray:
+        assigned: IntArray = np.argmax(vectors @ centroids.T, axis=1).astype(np.int64)
+        return assigned
+
+    @staticmethod
+    def _normalized(vectors: FloatArray) -> FloatArray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.where(norms > 0, norms, 1)).astype(np.float32)
+
+    def _load(self) -> _Snapshot:
+        rows = self._connection.execute(
+            "SELECT row, node_id, doc_id, list FROM rows ORDER BY row"
+        ).fetchall()
+        vectors: FloatArray = np.zeros((0, 0), dtype=np.float32)
+        dimension = self._connection.execute(
+            "SELECT value FROM meta WHERE key = 'dimension'"
+        ).fetchone()
+        if self._vectors_path.exists() and dimension is not None:
+            row_size = int(dimension[0]) * np.dtype(np.float32).itemsize
+            vectors = np.memmap(
+                self._vectors_path,
+                dtype=np.float32,
+                mode="r+",
+                shape=(
+                    self._vectors_path.stat().st_size // row_size,
+                    int(dimension[0]),
+                ),
+            )
+        size = len(vectors)
+        valid = np.zeros(size, dtype=np.bool_)
+        node_ids: list[str | None] = [None] * size
+        grouped_doc_rows: dict[str, list[int]] = {}
+        lists_of_rows: dict[int, list[int]] = {}
+        for row, node_id, doc_id, list_number in rows:
+            valid[row] = True
+            node_ids[row] = node_id
+            if doc_id is not None:
+                grouped_doc_rows.setdefault(doc_id, []).append(row)
+            if list_number is not None:
+                lists_of_rows.setdefault(list_number, []).append(row)
+        norms = np.zeros(size, dtype=np.float32)
+        for start in range(0, size, 65536):
+            norms[start : start + 65536] = np.linalg.norm(
+                vectors[start : start + 65536], axis=1
+            )
+
+        centroids = None
+        lists: list[IntArray] = []
+        if self._centroids_path.exists() and lists_of_rows:
+            centroids = np.load(self._centroids_path).astype(np.float32)
+            lists = [
+                np.asarray(lists_of_rows.get(number, []), dtype=np.int64)
+                for number in range(len(centroids))
+            ]
+            self._trained_size = int(valid.sum())
+        logger.info("Loaded local vector store vectors=%s", int(valid.sum()))
+        return _Snapshot(
+            vectors=vectors,
+            norms=norms,
+            valid=valid,
+            node_ids=node_ids,
+            doc_rows={
+                doc_id: np.asarray(doc_rows, dtype=np.int64)
+                for doc_id, doc_rows in grouped_doc_rows.items()
+            },
+            centroids=centroids,
+            lists=lists,
+        )
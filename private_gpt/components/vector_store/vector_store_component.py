@@ -1,5 +1,8 @@
 import logging
+import threading
 import typing
+import weakref
+from collections import OrderedDict
 
 from injector import inject, singleton
 from llama_index import VectorStoreIndex
@@ -7,6 +10,7 @@ from llama_index.indices.vector_store import VectorIndexRetriever
 from llama_index.vector_stores.types import VectorStore
 
 from private_gpt.components.vector_store.batched_chroma import BatchedChromaVectorStore
+from private_gpt.components.vector_store.local_vector_store import LocalVectorStore
 from private_gpt.open_ai.extensions.context_filter import ContextFilter
 from private_gpt.paths import local_data_path
 from private_gpt.settings.settings import Settings
@@ -35,10 +39,32 @@ def _chromadb_doc_id_metadata_filter(
 
 @singleton
 class VectorStoreComponent:
+    """Vector stores of the collections of the ingested documents.
+
+    Each collection (or tenant) has its own vector store: a collection of the
+    Chroma or Qdrant database, or a directory of the local store. Searches of a
+    collection only scan the vectors of that collection.
+
+    Vector stores are opened lazily, on first use of their collection. At most
+    `vectorstore.max_open_collections` are kept open, the least recently used ones
+    are released beyond. `vector_store` is the store of the default collection,
+    always open.
+    """
+
     vector_store: VectorStore
 
     @inject
     def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        self.default_collection = settings.vectorstore.collection
+        self._lock = threading.Lock()
+        self._open_stores: OrderedDict[str, VectorStore] = OrderedDict()
+        # Local stores still used after being released (i.e. by an ongoing
+        # ingestion) must not be opened twice, they are written by one instance
+        self._local_stores: weakref.WeakValueDictionary[
+            str, LocalVectorStore
+        ] = weakref.WeakValueDictionary()
+
         match settings.vectorstore.database:
             case "chroma":
                 try:
@@ -54,23 +80,12 @@ class VectorStoreComponent:
                     ) from e
 
                 chroma_settings = ChromaSettings(anonymized_telemetry=False)
-                chroma_client = chromadb.PersistentClient(
+                self._client = chromadb.PersistentClient(
                     path=str((local_data_path / "chroma_db").absolute()),
                     settings=chroma_settings,
                 )
-                chroma_collection = chroma_client.get_or_create_collection(
-                    "make_this_parameterizable_per_api_call"
-                )  # TODO
-
-                self.vector_store = typing.cast(
-                    VectorStore,
-                    BatchedChromaVectorStore(
-                        chroma_client=chroma_client, chroma_collection=chroma_collection
-                    ),
-                )
 
             case "qdrant":
-                from llama_index.vector_stores.qdrant import QdrantVectorStore
                 from qdrant_client import QdrantClient
 
                 if settings.qdrant is None:
@@ -78,24 +93,65 @@ class VectorStoreComponent:
                         "Qdrant config not found. Using default settings."
                         "Trying to connect to Qdrant at localhost:6333."
                     )
-                    client = QdrantClient()
+                    self._client = QdrantClient()
                 else:
-                    client = QdrantClient(
+                    self._client = QdrantClient(
                         **settings.qdrant.model_dump(exclude_none=True)
                     )
-                self.vector_store = typing.cast(
-                    VectorStore,
-                    QdrantVectorStore(
-                        client=client,
-                        collection_name="make_this_parameterizable_per_api_call",
-                    ),  # TODO
-                )
+            case "local":
+                self._client = None
             case _:
                 # Should be unreachable
                 # The settings validator should have caught this
                 raise ValueError(
                     f"Vectorstore database {settings.vectorstore.database} not supported"
                 )
+        self.vector_store = self._open(self.default_collection)
+
+    def get_vector_store(self, collection: str | None = None) -> VectorStore:
+        """Get the vector store of a collection, the default one if None."""
+        if collection is None or collection == self.default_collection:
+            return self.vector_store
+        with self._lock:
+            vector_store = self._open_stores.get(collection)
+            if vector_store is not None:
+                self._open_stores.move_to_end(collection)
+                return vector_store
+            vector_store = self._open(collection)
+            self._open_stores[collection] = vector_store
+            if len(self._open_stores) > self.settings.vectorstore.max_open_collections:
+                released, _ = self._open_stores.popitem(last=False)
+                logger.debug("Releasing the vector store of collection=%s", released)
+            return vector_store
+
+    def _open(self, collection: str) -> VectorStore:
+        logger.debug("Opening the vector store of collection=%s", collection)
+        match self.settings.vectorstore.database:
+            case "chroma":
+                chroma_collection = self._client.get_or_create_collection(collection)
+                return typing.cast(
+                    VectorStore,
+                    BatchedChromaVectorStore(
+                        chroma_client=self._client, chroma_collection=chroma_collection
+                    ),
+                )
+            case "qdrant":
+                from llama_index.vector_stores.qdrant import QdrantVectorStore
+
+                return typing.cast(
+                    VectorStore,
+                    QdrantVectorStore(client=self._client, collection_name=collection),
+                )
+            case _:
+                local_store = self._local_stores.get(collection)
+                if local_store is None:
+                    local_store = LocalVectorStore(
+                        persist_dir=local_data_path / "local_vector_store" / collection,
+                        ivf_min_vectors=self.settings.vectorstore.ivf_min_vectors,
+                        ivf_probes=self.settings.vectorstore.ivf_probes,
+                    )
+                    self._local_stores[collection] = local_store
+                return local_store
 
     @staticmethod
     def get_retriever(
@@ -103,7 +159,8 @@ class VectorStoreComponent:
         context_filter: ContextFilter | None = None,
         similarity_top_k: int = 2,
     ) -> VectorIndexRetriever:
-        # This way we support qdrant (using doc_ids) and chroma (using where clause)
+        # This way we support qdrant and local (using doc_ids) and chroma (using where
+        # clause)
         return VectorIndexRetriever(
             index=index,
             similarity_top_k=similarity_top_k,
@@ -113,6 +170,45 @@ class VectorStoreComponent:
             },
         )
 
+    def get_embeddings(
+        self, node_ids: list[str], collection: str | None = None
+    ) -> dict[str, list[float]]:
+        """Get the stored embeddings of the given nodes of a collection, by node id.
+
+        Nodes not found are missing in the result. The result is empty if the
+        vector store doesn't support fetching embeddings.
+        """
+        from llama_index.vector_stores.qdrant import QdrantVectorStore
+
+        if not node_ids:
+            return {}
+        vector_store = self.get_vector_store(collection)
+        try:
+            if isinstance(vector_store, LocalVectorStore):
+                return vector_store.get_embeddings(node_ids)
+            if isinstance(vector_store, BatchedChromaVectorStore):
+                result = vector_store._collection.get(
+                    ids=node_ids, include=["embeddings"]
+                )
+                return dict(zip(result["ids"], result["embeddings"], strict=True))
+            if isinstance(vector_store, QdrantVectorStore):
+                records = vector_store.client.retrieve(
+                    collection_name=vector_store.collection_name,
+                    ids=node_ids,
+                    with_payload=False,
+                    with_vectors=True,
+                )
+                return {str(record.id): record.vector for record in records}
+        except Exception:
+            logger.warning("Could not fetch the stored embeddings", exc_info=True)
+        return {}
+
     def close(self) -> None:
-        if hasattr(self.vector_store.client, "close"):
-            self.vector_store.client.close()
+        with self._lock:
+            vector_stores = [self.vector_store, *self._open_stores.values()]
+        # Database clients are shared by the collections, local stores are their
+        # own client
+        clients = {id(store.client): store.client for store in vector_stores}
+        for client in clients.values():
+            if hasattr(client, "close"):
+                client.close()
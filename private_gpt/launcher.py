@@ -7,6 +7,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
 from injector import Injector
 
+from private_gpt.components.ingest.parser_pool import ParserPool
 from private_gpt.paths import docs_path
 from private_gpt.server.chat.chat_router import chat_router
 from private_gpt.server.chunks.chunks_router import chunks_router
@@ -106,6 +107,9 @@ def create_app(root_injector: Injector) -> FastAPI:
         app.include_router(embeddings_router)
         app.include_router(health_router)
 
+        # Stop the parser processes of the ingestion, if any
+        app.add_event_handler("shutdown", ParserPool.close_all)
+
         settings = root_injector.get(Settings)
         if settings.server.cors.enabled:
             logger.debug("Setting up CORS middleware")
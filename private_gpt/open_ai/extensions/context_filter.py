@@ -1,7 +1,18 @@
 from pydantic import BaseModel, Field
 
+# Valid as a collection name of every vector store, and as a directory name
+COLLECTION_PATTERN = r"^[a-zA-Z0-9][a-zA-Z0-9_-]{1,61}[a-zA-Z0-9]$"
+
 
 class ContextFilter(BaseModel):
     docs_ids: list[str] | None = Field(
-        examples=[["c202d5e6-7b69-4869-81cc-dd574ee8ee11"]]
+        None, examples=[["c202d5e6-7b69-4869-81cc-dd574ee8ee11"]]
+    )
+    collection: str | None = Field(
+        None,
+        pattern=COLLECTION_PATTERN,
+        description=(
+            "Collection of the documents to use, the default collection if not set."
+        ),
+        examples=["sales"],
     )
@@ -1,6 +1,6 @@
 import time
 import uuid
-from collections.abc import Iterator
+from collections.abc import AsyncIterator, Iterator
 from typing import Literal
 
 from llama_index.llms import ChatResponse, CompletionResponse
@@ -109,14 +109,32 @@ def to_openai_response(
         )
 
 
+def _to_openai_sse_event(
+    response: str | CompletionResponse | ChatResponse,
+    sources: list[Chunk] | None = None,
+) -> str:
+    if isinstance(response, CompletionResponse | ChatResponse):
+        return f"data: {OpenAICompletion.json_from_delta(text=response.delta)}\n\n"
+    return (
+        f"data: {OpenAICompletion.json_from_delta(text=response, sources=sources)}\n\n"
+    )
+
+
 def to_openai_sse_stream(
     response_generator: Iterator[str | CompletionResponse | ChatResponse],
     sources: list[Chunk] | None = None,
 ) -> Iterator[str]:
     for response in response_generator:
-        if isinstance(response, CompletionResponse | ChatResponse):
-            yield f"data: {OpenAICompletion.json_from_delta(text=response.delta)}\n\n"
-        else:
-            yield f"data: {OpenAICompletion.json_from_delta(text=response, sources=sources)}\n\n"
+        yield _to_openai_sse_event(response, sources)
+    yield f"data: {OpenAICompletion.json_from_delta(text=None, finish_reason='stop')}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+async def to_openai_sse_astream(
+    response_generator: AsyncIterator[str | CompletionResponse | ChatResponse],
+    sources: list[Chunk] | None = None,
+) -> AsyncIterator[str]:
+    async for response in response_generator:
+        yield _to_openai_sse_event(response, sources)
     yield f"data: {OpenAICompletion.json_from_delta(text=None, finish_reason='stop')}\n\n"
     yield "data: [DONE]\n\n"
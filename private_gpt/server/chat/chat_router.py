@@ -8,9 +8,10 @@ from private_gpt.open_ai.openai_models import (
     OpenAICompletion,
     OpenAIMessage,
     to_openai_response,
-    to_openai_sse_stream,
+    to_openai_sse_astream,
 )
 from private_gpt.server.chat.chat_service import ChatService
+from private_gpt.server.chat.response_cache import ResponseCacheStats
 from private_gpt.server.utils.auth import authenticated
 
 chat_router = APIRouter(prefix="/v1", dependencies=[Depends(authenticated)])
@@ -37,7 +38,8 @@ class ChatBody(BaseModel):
                     "use_context": True,
                     "include_sources": True,
                     "context_filter": {
-                        "docs_ids": ["c202d5e6-7b69-4869-81cc-dd574ee8ee11"]
+                        "docs_ids": ["c202d5e6-7b69-4869-81cc-dd574ee8ee11"],
+                        "collection": "sales",
                     },
                 }
             ]
@@ -51,7 +53,7 @@ class ChatBody(BaseModel):
     responses={200: {"model": OpenAICompletion}},
     tags=["Contextual Completions"],
 )
-def chat_completion(
+async def chat_completion(
     request: Request, body: ChatBody
 ) -> OpenAICompletion | StreamingResponse:
     """Given a list of messages comprising a conversation, return a response.
@@ -61,6 +63,8 @@ def chat_completion(
     be filtered using the `context_filter` and passing the document IDs to be used.
     Ingested documents IDs can be found using `/ingest/list` endpoint. If you want
     all ingested documents to be used, remove `context_filter` altogether.
+    The context comes from the default collection, or from the `collection` of the
+    `context_filter`.
 
     When using `'include_sources': true`, the API will return the source Chunks used
     to create the response, which come from the context provided.
@@ -78,18 +82,35 @@ def chat_completion(
         ChatMessage(content=m.content, role=MessageRole(m.role)) for m in body.messages
     ]
     if body.stream:
-        completion_gen = service.stream_chat(
+        completion_gen = await service.astream_chat(
             all_messages, body.use_context, body.context_filter
         )
         return StreamingResponse(
-            to_openai_sse_stream(
+            to_openai_sse_astream(
                 completion_gen.response,
                 completion_gen.sources if body.include_sources else None,
             ),
             media_type="text/event-stream",
         )
     else:
-        completion = service.chat(all_messages, body.use_context, body.context_filter)
+        completion = await service.achat(
+            all_messages, body.use_context, body.context_filter
+        )
         return to_openai_response(
             completion.response, completion.sources if body.include_sources else None
         )
+
+
+@chat_router.get("/chat/cache", tags=["Contextual Completions"])
+def chat_cache_stats(request: Request) -> ResponseCacheStats:
+    """Get the statistics of the cache of the chat and completions responses.
+
+    The `hit_rate` is the ratio of the requests answered from the cache, either
+    identical (`exact_hits`) or, if the semantic cache is enabled, with a similar last
+    message (`semantic_hits`). Cached responses are dropped when documents are
+    ingested or deleted, or after the `response_cache.ttl_seconds` setting.
+    """
+    service: ChatService = request.state.injector.get(ChatService)
+    if service.response_cache is None:
+        return ResponseCacheStats(enabled=False)
+    return service.response_cache.stats()
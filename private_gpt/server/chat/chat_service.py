@@ -1,23 +1,30 @@
+from collections.abc import AsyncIterator, Generator, Iterator
+from typing import TYPE_CHECKING
+
 from injector import inject, singleton
-from llama_index import ServiceContext, StorageContext, VectorStoreIndex
-from llama_index.chat_engine import ContextChatEngine
-from llama_index.chat_engine.types import (
-    BaseChatEngine,
-)
+from llama_index.chat_engine.context import DEFAULT_CONTEXT_TEMPLATE
 from llama_index.indices.postprocessor import MetadataReplacementPostProcessor
 from llama_index.llm_predictor.utils import stream_chat_response_to_tokens
-from llama_index.llms import ChatMessage
+from llama_index.llms import ChatMessage, ChatResponse, MessageRole
+from llama_index.memory import ChatMemoryBuffer
+from llama_index.schema import MetadataMode, NodeWithScore, QueryBundle
 from llama_index.types import TokenGen
 from pydantic import BaseModel
 
 from private_gpt.components.embedding.embedding_component import EmbeddingComponent
 from private_gpt.components.llm.llm_component import LLMComponent
-from private_gpt.components.node_store.node_store_component import NodeStoreComponent
-from private_gpt.components.vector_store.vector_store_component import (
-    VectorStoreComponent,
-)
+from private_gpt.components.retrieval.retrieval_component import RetrievalComponent
 from private_gpt.open_ai.extensions.context_filter import ContextFilter
+from private_gpt.server.chat.response_cache import (
+    CachedResponse,
+    ResponseCache,
+    ResponseCacheKey,
+)
 from private_gpt.server.chunks.chunks_service import Chunk
+from private_gpt.settings.settings import Settings
+
+if TYPE_CHECKING:
+    from llama_index.postprocessor.types import BaseNodePostprocessor
 
 
 class Completion(BaseModel):
@@ -30,46 +37,178 @@ class CompletionGen(BaseModel):
     sources: list[Chunk] | None = None
 
 
+class AsyncCompletionGen(BaseModel):
+    response: AsyncIterator[str]
+    sources: list[Chunk] | None = None
+
+    model_config = {"arbitrary_types_allowed": True}
+
+
+async def _astream_tokens(stream: AsyncIterator[ChatResponse]) -> AsyncIterator[str]:
+    async for response in stream:
+        yield response.delta or ""
+
+
 @singleton
 class ChatService:
+    """Chat with the LLM, optionally using the ingested documents as context.
+
+    When using the context, the nodes most relevant to the last message are set as
+    the system prompt, followed by the chat history that fits in the context window
+    of the LLM (the same prompt the llama_index `ContextChatEngine` builds).
+
+    Every method has an async version, for the server to serve many concurrent
+    chats without holding a worker thread per chat.
+
+    If enabled, the responses are cached in a `ResponseCache`: repeated (or, if
+    semantic, similar) requests are answered without retrieving the context nor
+    calling the LLM, and streamed responses are replayed delta by delta.
+    """
+
     @inject
     def __init__(
         self,
         llm_component: LLMComponent,
-        vector_store_component: VectorStoreComponent,
+        retrieval_component: RetrievalComponent,
         embedding_component: EmbeddingComponent,
-        node_store_component: NodeStoreComponent,
+        settings: Settings,
     ) -> None:
         self.llm_service = llm_component
-        self.vector_store_component = vector_store_component
-        self.storage_context = StorageContext.from_defaults(
-            vector_store=vector_store_component.vector_store,
-            docstore=node_store_component.doc_store,
-            index_store=node_store_component.index_store,
+        self.retrieval_component = retrieval_component
+        self.embedding_component = embedding_component
+        self.node_postprocessors: list[BaseNodePostprocessor] = [
+            MetadataReplacementPostProcessor(target_metadata_key="window"),
+        ]
+        cache_settings = settings.response_cache
+        self.response_cache: ResponseCache | None = None
+        if cache_settings.enabled:
+            self.response_cache = ResponseCache(
+                max_entries=cache_settings.max_entries,
+                ttl=cache_settings.ttl_seconds,
+                similarity_threshold=(
+                    cache_settings.semantic_similarity_threshold
+                    if cache_settings.semantic_enabled
+                    else None
+                ),
+            )
+
+    def _cache_key(
+        self,
+        messages: list[ChatMessage],
+        use_context: bool,
+        context_filter: ContextFilter | None,
+    ) -> ResponseCacheKey | None:
+        if self.response_cache is None:
+            return None
+        return ResponseCache.key(
+            messages,
+            use_context,
+            context_filter,
+            self.retrieval_component.corpus_version,
         )
-        self.service_context = ServiceContext.from_defaults(
-            llm=llm_component.llm, embed_model=embedding_component.embedding_model
+
+    def _cache_get(self, key: ResponseCacheKey | None) -> CachedResponse | None:
+        if key is None or self.response_cache is None:
+            return None
+        cached = self.response_cache.get(key)
+        if cached is None and self.response_cache.semantic:
+            embedding_model = self.embedding_component.embedding_model
+            key.embedding = embedding_model.get_query_embedding(key.query)
+            cached = self.response_cache.get(key)
+        return cached
+
+    async def _acache_get(self, key: ResponseCacheKey | None) -> CachedResponse | None:
+        if key is None or self.response_cache is None:
+            return None
+        cached = self.response_cache.get(key)
+        if cached is None and self.response_cache.semantic:
+            key.embedding = await self.embedding_component.aget_query_embedding(
+                key.query
+            )
+            cached = self.response_cache.get(key)
+        return cached
+
+    def _cache_put(
+        self,
+        key: ResponseCacheKey | None,
+        deltas: list[str],
+        sources: list[Chunk] | None,
+    ) -> None:
+        if key is not None and self.response_cache is not None:
+            self.response_cache.put(key, CachedResponse(tuple(deltas), sources))
+
+    def _record_tokens(
+        self,
+        key: ResponseCacheKey | None,
+        tokens: Iterator[str],
+        sources: list[Chunk] | None,
+    ) -> Generator[str, None, None]:
+        deltas = []
+        for token in tokens:
+            deltas.append(token)
+            yield token
+        # Not reached if the stream is closed before its end
+        self._cache_put(key, deltas, sources)
+
+    async def _arecord_tokens(
+        self,
+        key: ResponseCacheKey | None,
+        tokens: AsyncIterator[str],
+        sources: list[Chunk] | None,
+    ) -> AsyncIterator[str]:
+        deltas = []
+        async for token in tokens:
+            deltas.append(token)
+            yield token
+        self._cache_put(key, deltas, sources)
+
+    @staticmethod
+    def _last_message(messages: list[ChatMessage]) -> str:
+        last_message = messages[-1].content
+        return last_message if last_message is not None else ""
+
+    def _retrieve_context(
+        self, message: str, context_filter: ContextFilter | None
+    ) -> list[NodeWithScore]:
+        retriever = self.retrieval_component.get_retriever(
+            context_filter=context_filter
         )
-        self.index = VectorStoreIndex.from_vector_store(
-            vector_store_component.vector_store,
-            storage_context=self.storage_context,
-            service_context=self.service_context,
-            show_progress=True,
+        return self._postprocess(message, retriever.retrieve(message))
+
+    async def _aretrieve_context(
+        self, message: str, context_filter: ContextFilter | None
+    ) -> list[NodeWithScore]:
+        nodes = await self.retrieval_component.aretrieve(
+            message, context_filter=context_filter
         )
+        return self._postprocess(message, nodes)
+
+    def _postprocess(
+        self, message: str, nodes: list[NodeWithScore]
+    ) -> list[NodeWithScore]:
+        for postprocessor in self.node_postprocessors:
+            nodes = postprocessor.postprocess_nodes(
+                nodes, query_bundle=QueryBundle(message)
+            )
+        return nodes
 
-    def _chat_engine(
-        self, context_filter: ContextFilter | None = None
-    ) -> BaseChatEngine:
-        vector_index_retriever = self.vector_store_component.get_retriever(
-            index=self.index, context_filter=context_filter
+    def _context_messages(
+        self, messages: list[ChatMessage], nodes: list[NodeWithScore]
+    ) -> list[ChatMessage]:
+        context_str = "\n\n".join(
+            node.node.get_content(metadata_mode=MetadataMode.LLM).strip()
+            for node in nodes
+        )
+        system_message = ChatMessage(
+            content=DEFAULT_CONTEXT_TEMPLATE.format(context_str=context_str),
+            role=MessageRole.SYSTEM,
         )
-        return ContextChatEngine.from_defaults(
-            retriever=vector_index_retriever,
-            service_context=self.service_context,
-            node_postprocessors=[
-                MetadataReplacementPostProcessor(target_metadata_key="window"),
-            ],
+        # Keeps the most recent messages fitting in the context window
+        memory = ChatMemoryBuffer.from_defaults(
+            chat_history=messages, llm=self.llm_service.llm
         )
+        initial_token_count = len(memory.tokenizer_fn(str(system_message.content)))
+        return [system_message, *memory.get(initial_token_count=initial_token_count)]
 
     def stream_chat(
         self,
@@ -77,25 +216,51 @@ class ChatService:
         use_context: bool = False,
         context_filter: ContextFilter | None = None,
     ) -> CompletionGen:
+        cache_key = self._cache_key(messages, use_context, context_filter)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return CompletionGen(response=cached.replay(), sources=cached.sources)
+        sources = None
         if use_context:
-            last_message = messages[-1].content
-            chat_engine = self._chat_engine(context_filter=context_filter)
-            streaming_response = chat_engine.stream_chat(
-                message=last_message if last_message is not None else "",
-                chat_history=messages[:-1],
-            )
-            sources = [
-                Chunk.from_node(node) for node in streaming_response.source_nodes
-            ]
-            completion_gen = CompletionGen(
-                response=streaming_response.response_gen, sources=sources
+            nodes = self._retrieve_context(self._last_message(messages), context_filter)
+            stream = self.llm_service.llm.stream_chat(
+                self._context_messages(messages, nodes)
             )
+            sources = [Chunk.from_node(node) for node in nodes]
         else:
             stream = self.llm_service.llm.stream_chat(messages)
-            completion_gen = CompletionGen(
-                response=stream_chat_response_to_tokens(stream)
+        return CompletionGen(
+            response=self._record_tokens(
+                cache_key, stream_chat_response_to_tokens(stream), sources
+            ),
+            sources=sources,
+        )
+
+    async def astream_chat(
+        self,
+        messages: list[ChatMessage],
+        use_context: bool = False,
+        context_filter: ContextFilter | None = None,
+    ) -> AsyncCompletionGen:
+        cache_key = self._cache_key(messages, use_context, context_filter)
+        cached = await self._acache_get(cache_key)
+        if cached is not None:
+            return AsyncCompletionGen(response=cached.areplay(), sources=cached.sources)
+        sources = None
+        if use_context:
+            nodes = await self._aretrieve_context(
+                self._last_message(messages), context_filter
             )
-        return completion_gen
+            stream = await self.llm_service.astream_chat(
+                self._context_messages(messages, nodes)
+            )
+            sources = [Chunk.from_node(node) for node in nodes]
+        else:
+            stream = await self.llm_service.astream_chat(messages)
+        return AsyncCompletionGen(
+            response=self._arecord_tokens(cache_key, _astream_tokens(stream), sources),
+            sources=sources,
+        )
 
     def chat(
         self,
@@ -103,18 +268,52 @@ class ChatService:
         use_context: bool = False,
         context_filter: ContextFilter | None = None,
     ) -> Completion:
+        cache_key = self._cache_key(messages, use_context, context_filter)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return Completion(response=cached.text, sources=cached.sources)
         if use_context:
-            last_message = messages[-1].content
-            chat_engine = self._chat_engine(context_filter=context_filter)
-            wrapped_response = chat_engine.chat(
-                message=last_message if last_message is not None else "",
-                chat_history=messages[:-1],
+            nodes = self._retrieve_context(self._last_message(messages), context_filter)
+            chat_response = self.llm_service.llm.chat(
+                self._context_messages(messages, nodes)
+            )
+            completion = Completion(
+                response=str(chat_response.message.content),
+                sources=[Chunk.from_node(node) for node in nodes],
             )
-            sources = [Chunk.from_node(node) for node in wrapped_response.source_nodes]
-            completion = Completion(response=wrapped_response.response, sources=sources)
         else:
             chat_response = self.llm_service.llm.chat(messages)
             response_content = chat_response.message.content
             response = response_content if response_content is not None else ""
             completion = Completion(response=response)
+        self._cache_put(cache_key, [completion.response], completion.sources)
+        return completion
+
+    async def achat(
+        self,
+        messages: list[ChatMessage],
+        use_context: bool = False,
+        context_filter: ContextFilter | None = None,
+    ) -> Completion:
+        cache_key = self._cache_key(messages, use_context, context_filter)
+        cached = await self._acache_get(cache_key)
+        if cached is not None:
+            return Completion(response=cached.text, sources=cached.sources)
+        if use_context:
+            nodes = await self._aretrieve_context(
+                self._last_message(messages), context_filter
+            )
+            chat_response = await self.llm_service.achat(
+                self._context_messages(messages, nodes)
+            )
+            completion = Completion(
+                response=str(chat_response.message.content),
+                sources=[Chunk.from_node(node) for node in nodes],
+            )
+        else:
+            chat_response = await self.llm_service.achat(messages)
+            response_content = chat_response.message.content
+            response = response_content if response_content is not None else ""
+            completion = Completion(response=response)
+        self._cache_put(cache_key, [completion.response], completion.sources)
         return completion
@@ -0,0 +1,232 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Generator
+from dataclasses import dataclass, field
+
+import numpy as np
+from llama_index.llms import ChatMessage
+from pydantic import BaseModel, Field
+
+from private_gpt.open_ai.extensions.context_filter import ContextFilter
+from private_gpt.server.chunks.chunks_service import Chunk
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCacheStats(BaseModel):
+    enabled: bool = Field(default=False, description="Whether responses are cached.")
+    entries: int = Field(default=0, description="Number of cached responses.")
+    exact_hits: int = Field(
+        default=0, description="Requests answered by an identical one."
+    )
+    semantic_hits: int = Field(
+        default=0, description="Requests answered by one with a similar last message."
+    )
+    misses: int = Field(default=0, description="Requests answered by the LLM.")
+    evictions: int = Field(
+        default=0, description="Responses evicted as least recently used."
+    )
+    expirations: int = Field(default=0, description="Responses evicted as expired.")
+    hit_rate: float = Field(
+        default=0, description="Ratio of the requests served cached."
+    )
+
+
+@dataclass
+class ResponseCacheKey:
+    """Identity of a chat request in the cache.
+
+    The scope covers everything but the last message: the earlier messages, the use
+    of the context, its filter and the version of the corpus it is retrieved from.
+    Semantic hits are only looked for in the same scope.
+    """
+
+    scope: str
+    exact: str
+    query: str
+    embedding: list[float] | None = None
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    deltas: tuple[str, ...]
+    sources: list[Chunk] | None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.deltas)
+
+    def replay(self) -> Generator[str, None, None]:
+        yield from self.deltas
+
+    async def areplay(self) -> AsyncIterator[str]:
+        for delta in self.deltas:
+            yield delta
+
+
+@dataclass
+class _Entry:
+    response: CachedResponse
+    scope: str
+    created: float
+    embedding: np.ndarray | None = field(default=None, repr=False)
+
+
+def _normalize(text: str | None) -> str:
+    # Requests differing only in case and spacing get the same answer
+    return " ".join((text or "").split()).casefold()
+
+
+class ResponseCache:
+    """In-memory LRU cache of the chat responses, with a TTL.
+
+    An exact hit requires the same normalized messages, context use, context filter
+    and corpus version. With a `similarity_threshold`, a request whose last message
+    embedding is at least that similar to the one of a cached response of the same
+    scope is a semantic hit.
+
+    Thread safe: it is used by the async routes and by the UI worker threads.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        similarity_threshold: float | None = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._scopes: dict[str, set[str]] = {}
+        self._stats = ResponseCacheStats(enabled=True)
+
+    @property
+    def semantic(self) -> bool:
+        return self.similarity_threshold is not None
+
+    @staticmethod
+    def key(
+        messages: list[ChatMessage],
+        use_context: bool,
+        context_filter: ContextFilter | None,
+        corpus_version: int,
+    ) -> ResponseCacheKey:
+        context = None
+        if use_context:
+            context = {
+                "docs_ids": (
+                    sorted(context_filter.docs_ids)
+                    if context_filter is not None and context_filter.docs_ids
+                    else None
+                ),
+                "collection": context_filter.collection if context_filter else None,
+                # Ingested or deleted documents change the retrieved context
+                "corpus_version": corpus_version,
+            }
+        history = [
+            (message.role.value, _normalize(message.content)) for message in messages
+        ]
+        scope = hashlib.sha256(
+            json.dumps([history[:-1], context]).encode("utf-8")
+        ).hexdigest()
+        query = (messages[-1].content or "") if messages else ""
+        exact = hashlib.sha256(
+            json.dumps([scope, history[-1:]]).encode("utf-8")
+        ).hexdigest()
+        return ResponseCacheKey(scope=scope, exact=exact, query=query)
+
+    def get(self, key: ResponseCacheKey) -> CachedResponse | None:
+        """Get the response of an identical or, if semantic, similar request.
+
+        If semantic, a key without embedding is only looked up for an exact hit, and
+        not counted as a miss: the embedding is only computed after an exact miss,
+        to look up the key again.
+        """
+        with self._lock:
+            entry = self._get_entry(key.exact)
+            if entry is not None:
+                self._stats.exact_hits += 1
+                return entry.response
+            if self.semantic:
+                if key.embedding is None:
+                    return None
+                entry = self._get_similar(key)
+                if entry is not None:
+                    self._stats.semantic_hits += 1
+                    return entry.response
+            self._stats.misses += 1
+            return None
+
+    def put(self, key: ResponseCacheKey, response: CachedResponse) -> None:
+        embedding = None
+        if self.semantic and key.embedding is not None:
+            vector = np.asarray(key.embedding, dtype=np.float32)
+            embedding = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        with self._lock:
+            self._remove(key.exact)
+            self._entries[key.exact] = _Entry(
+                response=response,
+                scope=key.scope,
+                created=time.monotonic(),
+                embedding=embedding,
+            )
+            self._scopes.setdefault(key.scope, set()).add(key.exact)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats.evictions += 1
+
+    def stats(self) -> ResponseCacheStats:
+        with self._lock:
+            stats = self._stats.model_copy(update={"entries": len(self._entries)})
+        lookups = stats.exact_hits + stats.semantic_hits + stats.misses
+        if lookups:
+            stats.hit_rate = (stats.exact_hits + stats.semantic_hits) / lookups
+        return stats
+
+    def _get_entry(self, exact: str) -> _Entry | None:
+        entry = self._entries.get(exact)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created > self.ttl:
+            self._remove(exact)
+            self._stats.expirations += 1
+            return None
+        self._entries.move_to_end(exact)
+        return entry
+
+    def _get_similar(self, key: ResponseCacheKey) -> _Entry | None:
+        assert self.similarity_threshold is not None
+        candidates = [
+            exact
+            for exact in self._scopes.get(key.scope, ())
+            if self._entries[exact].embedding is not None
+        ]
+        if not candidates:
+            return None
+        query = np.asarray(key.embedding, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        embeddings = np.stack(
+            [self._entries[exact].embedding for exact in candidates]  # type: ignore[misc]
+        )
+        similarities = embeddings @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        logger.debug(
+            "Semantic response cache hit similarity=%.3f", float(similarities[best])
+        )
+        return self._get_entry(candidates[best])
+
+    def _remove(self, exact: str) -> None:
+        entry = self._entries.pop(exact, None)
+        if entry is not None:
+            scope = self._scopes[entry.scope]
+            scope.discard(exact)
+            if not scope:
+                del self._scopes[entry.scope]
@@ -16,6 +16,22 @@ class ChunksBody(BaseModel):
     limit: int = 10
     prev_next_chunks: int = Field(default=0, examples=[2])
 
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "text": "Q3 2023 sales",
+                    "context_filter": {
+                        "docs_ids": ["c202d5e6-7b69-4869-81cc-dd574ee8ee11"],
+                        "collection": "sales",
+                    },
+                    "limit": 10,
+                    "prev_next_chunks": 2,
+                }
+            ]
+        }
+    }
+
 
 class ChunksResponse(BaseModel):
     object: Literal["list"]
@@ -24,7 +40,7 @@ class ChunksResponse(BaseModel):
 
 
 @chunks_router.post("/chunks", tags=["Context Chunks"])
-def chunks_retrieval(request: Request, body: ChunksBody) -> ChunksResponse:
+async def chunks_retrieval(request: Request, body: ChunksBody) -> ChunksResponse:
     """Given a `text`, returns the most relevant chunks from the ingested documents.
 
     The returned information can be used to generate prompts that can be
@@ -43,9 +59,12 @@ def chunks_retrieval(request: Request, body: ChunksBody) -> ChunksResponse:
     the document IDs to be used. Ingested documents IDs can be found using
     `/ingest/list` endpoint. If you want all ingested documents to be used,
     remove `context_filter` altogether.
+
+    Chunks are searched in the default collection, or in the `collection` of the
+    `context_filter`: only the documents of that collection are searched.
     """
     service = request.state.injector.get(ChunksService)
-    results = service.retrieve_relevant(
+    results = await service.aretrieve_relevant(
         body.text, body.context_filter, body.limit, body.prev_next_chunks
     )
     return ChunksResponse(
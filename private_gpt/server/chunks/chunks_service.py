@@ -1,21 +1,16 @@
 from typing import TYPE_CHECKING, Literal
 
 from injector import inject, singleton
-from llama_index import ServiceContext, StorageContext, VectorStoreIndex
 from llama_index.schema import NodeWithScore
 from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
 
-from private_gpt.components.embedding.embedding_component import EmbeddingComponent
-from private_gpt.components.llm.llm_component import LLMComponent
-from private_gpt.components.node_store.node_store_component import NodeStoreComponent
-from private_gpt.components.vector_store.vector_store_component import (
-    VectorStoreComponent,
-)
+from private_gpt.components.retrieval.retrieval_component import RetrievalComponent
 from private_gpt.open_ai.extensions.context_filter import ContextFilter
 from private_gpt.server.ingest.ingest_service import IngestedDoc
 
 if TYPE_CHECKING:
-    from llama_index.schema import RelatedNodeInfo
+    from llama_index.schema import BaseNode, RelatedNodeInfo
 
 
 class Chunk(BaseModel):
@@ -55,43 +50,79 @@ class Chunk(BaseModel):
 @singleton
 class ChunksService:
     @inject
-    def __init__(
-        self,
-        llm_component: LLMComponent,
-        vector_store_component: VectorStoreComponent,
-        embedding_component: EmbeddingComponent,
-        node_store_component: NodeStoreComponent,
-    ) -> None:
-        self.vector_store_component = vector_store_component
-        self.storage_context = StorageContext.from_defaults(
-            vector_store=vector_store_component.vector_store,
-            docstore=node_store_component.doc_store,
-            index_store=node_store_component.index_store,
-        )
-        self.query_service_context = ServiceContext.from_defaults(
-            llm=llm_component.llm, embed_model=embedding_component.embedding_model
-        )
+    def __init__(self, retrieval_component: RetrievalComponent) -> None:
+        self.retrieval_component = retrieval_component
+        self.storage_context = retrieval_component.storage_context
+
+    def _get_sibling_nodes_texts(
+        self, nodes: list[NodeWithScore], related_number: int
+    ) -> dict[tuple[int, bool], list[str]]:
+        """Get the texts of the siblings before and after each of the nodes.
 
-    def _get_sibling_nodes_text(
-        self, node_with_score: NodeWithScore, related_number: int, forward: bool = True
-    ) -> list[str]:
-        explored_nodes_texts = []
-        current_node = node_with_score.node
-        for _ in range(related_number):
-            explored_node_info: RelatedNodeInfo | None = (
-                current_node.next_node if forward else current_node.prev_node
-            )
-            if explored_node_info is None:
-                break
+        The IDs of the siblings come from the node ordinal index, so the windows of
+        all the nodes are fetched with a single bulk call to the document store,
+        fetching only once the nodes shared by overlapping windows. A window crossing
+        the boundary of its document takes a couple more calls to continue through
+        the `prev_node`/`next_node` relationship.
 
-            explored_node = self.storage_context.docstore.get_node(
-                explored_node_info.node_id
-            )
+        :returns: the texts of each window, by (position of the node, forward)
+        """
+        node_ordinal_index = self.retrieval_component.node_ordinal_index
+        windows: dict[tuple[int, bool], list[BaseNode]] = {
+            (position, forward): []
+            for position in range(len(nodes))
+            for forward in (False, True)
+        }
+        # Windows to extend from a node, following the order of its document
+        pending: list[tuple[tuple[int, bool], BaseNode]] = []
+        if related_number > 0:
+            pending = [(key, nodes[key[0]].node) for key in windows]
+        # Windows to extend with a node of another document
+        hops: list[tuple[tuple[int, bool], str]] = []
+        fetched: dict[str, BaseNode] = {}
+        while pending or hops:
+            wanted = {
+                key: node_ordinal_index.window(
+                    node, related_number - len(windows[key]), forward=key[1]
+                )
+                for key, node in pending
+            }
+            missing = {
+                node_id
+                for node_ids in [*wanted.values(), [node_id for _, node_id in hops]]
+                for node_id in node_ids
+                if node_id not in fetched
+            }
+            if missing:
+                fetched.update(
+                    (node.node_id, node)
+                    for node in self.storage_context.docstore.get_nodes(list(missing))
+                )
 
-            explored_nodes_texts.append(explored_node.get_content())
-            current_node = explored_node
+            next_pending = []
+            for key, node_id in hops:
+                windows[key].append(fetched[node_id])
+                if len(windows[key]) < related_number:
+                    next_pending.append((key, fetched[node_id]))
+            hops = []
+            for key, node in pending:
+                window = windows[key]
+                window.extend(fetched[node_id] for node_id in wanted[key])
+                if len(window) >= related_number:
+                    continue
+                # End of the document reached, continue with the related node
+                last_node = window[-1] if wanted[key] else node
+                related: RelatedNodeInfo | None = (
+                    last_node.next_node if key[1] else last_node.prev_node
+                )
+                if related is not None:
+                    hops.append((key, related.node_id))
+            pending = next_pending
 
-        return explored_nodes_texts
+        return {
+            key: [node.get_content() for node in window]
+            for key, window in windows.items()
+        }
 
     def retrieve_relevant(
         self,
@@ -100,25 +131,36 @@ class ChunksService:
         limit: int = 10,
         prev_next_chunks: int = 0,
     ) -> list[Chunk]:
-        index = VectorStoreIndex.from_vector_store(
-            self.vector_store_component.vector_store,
-            storage_context=self.storage_context,
-            service_context=self.query_service_context,
-            show_progress=True,
-        )
-        vector_index_retriever = self.vector_store_component.get_retriever(
-            index=index, context_filter=context_filter, similarity_top_k=limit
+        vector_index_retriever = self.retrieval_component.get_retriever(
+            context_filter=context_filter, similarity_top_k=limit
         )
         nodes = vector_index_retriever.retrieve(text)
+        return self._to_chunks(nodes, prev_next_chunks)
+
+    async def aretrieve_relevant(
+        self,
+        text: str,
+        context_filter: ContextFilter | None = None,
+        limit: int = 10,
+        prev_next_chunks: int = 0,
+    ) -> list[Chunk]:
+        nodes = await self.retrieval_component.aretrieve(
+            text, context_filter=context_filter, similarity_top_k=limit
+        )
+        # Fetching the siblings queries the document store, not async
+        return await run_in_threadpool(self._to_chunks, nodes, prev_next_chunks)
+
+    def _to_chunks(
+        self, nodes: list[NodeWithScore], prev_next_chunks: int
+    ) -> list[Chunk]:
         nodes.sort(key=lambda n: n.score or 0.0, reverse=True)
 
+        sibling_texts = self._get_sibling_nodes_texts(nodes, prev_next_chunks)
         retrieved_nodes = []
-        for node in nodes:
+        for position, node in enumerate(nodes):
             chunk = Chunk.from_node(node)
-            chunk.previous_texts = self._get_sibling_nodes_text(
-                node, prev_next_chunks, False
-            )
-            chunk.next_texts = self._get_sibling_nodes_text(node, prev_next_chunks)
+            chunk.previous_texts = sibling_texts[(position, False)]
+            chunk.next_texts = sibling_texts[(position, True)]
             retrieved_nodes.append(chunk)
 
         return retrieved_nodes
@@ -41,7 +41,7 @@ class CompletionsBody(BaseModel):
     responses={200: {"model": OpenAICompletion}},
     tags=["Contextual Completions"],
 )
-def prompt_completion(
+async def prompt_completion(
     request: Request, body: CompletionsBody
 ) -> OpenAICompletion | StreamingResponse:
     """We recommend most users use our Chat completions API.
@@ -52,6 +52,8 @@ def prompt_completion(
     `context_filter` and passing the document IDs to be used. Ingested documents IDs
     can be found using `/ingest/list` endpoint. If you want all ingested documents to
     be used, remove `context_filter` altogether.
+    The context comes from the default collection, or from the `collection` of the
+    `context_filter`.
 
     When using `'include_sources': true`, the API will return the source Chunks used
     to create the response, which come from the context provided.
@@ -72,4 +74,4 @@ def prompt_completion(
         include_sources=body.include_sources,
         context_filter=body.context_filter,
     )
-    return chat_completion(request, chat_body)
+    return await chat_completion(request, chat_body)
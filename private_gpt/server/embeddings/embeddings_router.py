@@ -1,11 +1,14 @@
+from collections.abc import AsyncIterator
 from typing import Literal
 
 from fastapi import APIRouter, Depends, Request
 from pydantic import BaseModel
+from starlette.responses import Response, StreamingResponse
 
 from private_gpt.server.embeddings.embeddings_service import (
     Embedding,
     EmbeddingsService,
+    EncodingFormat,
 )
 from private_gpt.server.utils.auth import authenticated
 
@@ -14,6 +17,8 @@ embeddings_router = APIRouter(prefix="/v1", dependencies=[Depends(authenticated)
 
 class EmbeddingsBody(BaseModel):
     input: str | list[str]
+    encoding_format: EncodingFormat = "float"
+    stream: bool = False
 
 
 class EmbeddingsResponse(BaseModel):
@@ -22,14 +27,44 @@ class EmbeddingsResponse(BaseModel):
     data: list[Embedding]
 
 
-@embeddings_router.post("/embeddings", tags=["Embeddings"])
-def embeddings_generation(request: Request, body: EmbeddingsBody) -> EmbeddingsResponse:
+@embeddings_router.post(
+    "/embeddings",
+    response_model=None,
+    responses={200: {"model": EmbeddingsResponse}},
+    tags=["Embeddings"],
+)
+async def embeddings_generation(request: Request, body: EmbeddingsBody) -> Response:
     """Get a vector representation of a given input.
 
     That vector representation can be easily consumed
     by machine learning models and algorithms.
+
+    When using `'encoding_format': 'base64'`, each embedding is returned as its
+    little-endian float32 values encoded in base64, following OpenAI's API. It is
+    about 4 times smaller and faster to serialize than the list of floats.
+
+    When using `'stream': true`, the input is embedded in batches and the API returns
+    the embeddings as they are computed, as newline delimited JSON (one `Embedding`
+    per line, in input order):
+    ```
+    {"index":0,"object":"embedding","embedding":[0.0023064255,-0.009327292]}
+    ```
     """
     service = request.state.injector.get(EmbeddingsService)
     input_texts = body.input if isinstance(body.input, list) else [body.input]
-    embeddings = service.texts_embeddings(input_texts)
-    return EmbeddingsResponse(object="list", model="private-gpt", data=embeddings)
+    if body.stream:
+        return StreamingResponse(
+            _to_ndjson(
+                service.astream_texts_embeddings(input_texts, body.encoding_format)
+            ),
+            media_type="application/x-ndjson",
+        )
+    embeddings = await service.atexts_embeddings(input_texts, body.encoding_format)
+    response = EmbeddingsResponse(object="list", model="private-gpt", data=embeddings)
+    # Serialized by pydantic at once, instead of walking every float of the vectors
+    return Response(response.model_dump_json(), media_type="application/json")
+
+
+async def _to_ndjson(embeddings: AsyncIterator[Embedding]) -> AsyncIterator[str]:
+    async for embedding in embeddings:
+        yield embedding.model_dump_json() + "\n"
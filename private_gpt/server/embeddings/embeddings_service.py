@@ -1,30 +1,80 @@
+import base64
+from collections.abc import AsyncIterator
 from typing import Literal
 
+import numpy as np
 from injector import inject, singleton
 from pydantic import BaseModel, Field
 
 from private_gpt.components.embedding.embedding_component import EmbeddingComponent
 
+EncodingFormat = Literal["float", "base64"]
+
 
 class Embedding(BaseModel):
     index: int
     object: Literal["embedding"]
-    embedding: list[float] = Field(examples=[[0.0023064255, -0.009327292]])
+    embedding: list[float] | str = Field(
+        examples=[[0.0023064255, -0.009327292]],
+        description="The embedding, or its little-endian float32 values encoded in "
+        "base64 when requested with `encoding_format` `base64`.",
+    )
 
 
 @singleton
 class EmbeddingsService:
     @inject
     def __init__(self, embedding_component: EmbeddingComponent) -> None:
+        self.embedding_component = embedding_component
         self.embedding_model = embedding_component.embedding_model
 
-    def texts_embeddings(self, texts: list[str]) -> list[Embedding]:
+    def texts_embeddings(
+        self, texts: list[str], encoding_format: EncodingFormat = "float"
+    ) -> list[Embedding]:
         texts_embeddings = self.embedding_model.get_text_embedding_batch(texts)
+        return self._to_embeddings(texts_embeddings, encoding_format)
+
+    async def atexts_embeddings(
+        self, texts: list[str], encoding_format: EncodingFormat = "float"
+    ) -> list[Embedding]:
+        texts_embeddings = await self.embedding_component.aget_text_embedding_batch(
+            texts
+        )
+        return self._to_embeddings(texts_embeddings, encoding_format)
+
+    async def astream_texts_embeddings(
+        self, texts: list[str], encoding_format: EncodingFormat = "float"
+    ) -> AsyncIterator[Embedding]:
+        """Embed the texts in batches of the model's size, yielding as they are done.
+
+        Only one batch is held in memory at a time, so inputs of any size can be
+        embedded.
+        """
+        batch_size = max(self.embedding_model.embed_batch_size, 1)
+        for start in range(0, len(texts), batch_size):
+            texts_embeddings = await self.embedding_component.aget_text_embedding_batch(
+                texts[start : start + batch_size]
+            )
+            for embedding in self._to_embeddings(
+                texts_embeddings, encoding_format, start
+            ):
+                yield embedding
+
+    @staticmethod
+    def _to_embeddings(
+        texts_embeddings: list[list[float]],
+        encoding_format: EncodingFormat,
+        start: int = 0,
+    ) -> list[Embedding]:
+        values: list[list[float]] | list[str] = texts_embeddings
+        if encoding_format == "base64" and texts_embeddings:
+            # Converted at once, each row is then encoded from its raw bytes
+            vectors = np.asarray(texts_embeddings, dtype="<f4")
+            values = [base64.b64encode(vector.tobytes()).decode() for vector in vectors]
+        # Built without validation, the values come straight from the model
         return [
-            Embedding(
-                index=texts_embeddings.index(embedding),
-                object="embedding",
-                embedding=embedding,
+            Embedding.model_construct(
+                index=index, object="embedding", embedding=embedding
             )
-            for embedding in texts_embeddings
+            for index, embedding in enumerate(values, start)
         ]
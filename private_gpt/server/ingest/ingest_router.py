@@ -1,13 +1,21 @@
 from typing import Literal
 
-from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, UploadFile
 from pydantic import BaseModel
 
+from private_gpt.open_ai.extensions.context_filter import COLLECTION_PATTERN
 from private_gpt.server.ingest.ingest_service import IngestedDoc, IngestService
 from private_gpt.server.utils.auth import authenticated
 
 ingest_router = APIRouter(prefix="/v1", dependencies=[Depends(authenticated)])
 
+CollectionQuery = Query(
+    None,
+    pattern=COLLECTION_PATTERN,
+    description="Collection of the documents, the default collection if not set.",
+    examples=["sales"],
+)
+
 
 class IngestResponse(BaseModel):
     object: Literal["list"]
@@ -16,7 +24,17 @@ class IngestResponse(BaseModel):
 
 
 @ingest_router.post("/ingest", tags=["Ingestion"])
-def ingest(request: Request, file: UploadFile) -> IngestResponse:
+def ingest(
+    request: Request,
+    file: UploadFile,
+    collection: str | None = CollectionQuery,
+    source_id: str
+    | None = Query(
+        None,
+        description="Stable identity of the file, i.e. its path in the caller system.",
+        examples=["reports/q3_2023.pdf"],
+    ),
+) -> IngestResponse:
     """Ingests and processes a file, storing its chunks to be used as context.
 
     The context obtained from files is later used in
@@ -31,23 +49,63 @@ def ingest(request: Request, file: UploadFile) -> IngestResponse:
     extracted Metadata (which is later used to improve context retrieval). Those IDs
     can be used to filter the context used to create responses in
     `/chat/completions`, `/completions`, and `/chunks` APIs.
+
+    Documents are ingested in the given `collection`, or in the default one. Each
+    collection has its own vector store: the context of a request using a
+    collection (see `context_filter.collection`) only comes from its documents.
+
+    Ingesting a file already ingested with the same content returns its documents.
+    Files with the same name but a different content are different files, unless
+    they have the same `source_id`: then the documents of the previous version of
+    the file are replaced by the new ones.
     """
     service = request.state.injector.get(IngestService)
     if file.filename is None:
         raise HTTPException(400, "No file name provided")
-    ingested_documents = service.ingest(file.filename, file.file.read())
+    ingested_documents = service.ingest(
+        file.filename, file.file.read(), collection, source_id
+    )
+    return IngestResponse(object="list", model="private-gpt", data=ingested_documents)
+
+
+@ingest_router.post("/ingest/bulk", tags=["Ingestion"])
+def ingest_bulk(
+    request: Request,
+    files: list[UploadFile],
+    collection: str | None = CollectionQuery,
+) -> IngestResponse:
+    """Ingests and processes many files at once, storing their chunks.
+
+    Behaves as calling `/ingest` once per file, but it is much faster when ingesting
+    many files: parsing, splitting and embedding of the different files are
+    pipelined, embeddings are computed in batches mixing chunks of different files,
+    and the storage is persisted only once, at the end.
+
+    Files that cannot be parsed are skipped. The IDs and metadata of all the
+    ingested Documents are returned in the response.
+    """
+    service = request.state.injector.get(IngestService)
+    if any(file.filename is None for file in files):
+        raise HTTPException(400, "No file name provided")
+    ingested_documents = service.ingest_bulk(
+        ((str(file.filename), file.file.read()) for file in files), collection
+    )
     return IngestResponse(object="list", model="private-gpt", data=ingested_documents)
 
 
 @ingest_router.get("/ingest/list", tags=["Ingestion"])
-def list_ingested(request: Request) -> IngestResponse:
+def list_ingested(
+    request: Request, collection: str | None = CollectionQuery
+) -> IngestResponse:
     """Lists already ingested Documents including their Document ID and metadata.
 
     Those IDs can be used to filter the context used to create responses
     in `/chat/completions`, `/completions`, and `/chunks` APIs.
+
+    Only the Documents of the given `collection` are listed, or of the default one.
     """
     service = request.state.injector.get(IngestService)
-    ingested_documents = service.list_ingested()
+    ingested_documents = service.list_ingested(collection)
     return IngestResponse(object="list", model="private-gpt", data=ingested_documents)
 
 
@@ -56,7 +114,8 @@ def delete_ingested(request: Request, doc_id: str) -> None:
     """Delete the specified ingested Document.
 
     The `doc_id` can be obtained from the `GET /ingest/list` endpoint.
-    The document will be effectively deleted from your storage context.
+    The document will be effectively deleted from your storage context, and from
+    the collection it was ingested in.
     """
     service = request.state.injector.get(IngestService)
     service.delete(doc_id)
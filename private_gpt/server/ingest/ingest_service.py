@@ -1,7 +1,7 @@
 import logging
-import tempfile
+from collections.abc import Iterable, Iterator
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, AnyStr, Literal
+from typing import Any, AnyStr, Literal
 
 from injector import inject, singleton
 from llama_index import (
@@ -11,29 +11,24 @@ from llama_index import (
     VectorStoreIndex,
     load_index_from_storage,
 )
+from llama_index.ingestion import run_transformations
 from llama_index.node_parser import SentenceWindowNodeParser
-from llama_index.readers import JSONReader, StringIterableReader
-from llama_index.readers.file.base import DEFAULT_FILE_READER_CLS
+from llama_index.schema import BaseNode
 from pydantic import BaseModel, Field
 
 from private_gpt.components.embedding.embedding_component import EmbeddingComponent
+from private_gpt.components.ingest.bulk_ingest_pipeline import BulkIngestPipeline
+from private_gpt.components.ingest.ingest_helper import IngestionHelper
+from private_gpt.components.ingest.ingest_manifest import IngestedFile, IngestManifest
+from private_gpt.components.ingest.parser_pool import ParserPool
 from private_gpt.components.llm.llm_component import LLMComponent
 from private_gpt.components.node_store.node_store_component import NodeStoreComponent
+from private_gpt.components.retrieval.retrieval_component import RetrievalComponent
 from private_gpt.components.vector_store.vector_store_component import (
     VectorStoreComponent,
 )
 from private_gpt.paths import local_data_path
-
-if TYPE_CHECKING:
-    from llama_index.readers.base import BaseReader
-
-# Patching the default file reader to support other file types
-FILE_READER_CLS = DEFAULT_FILE_READER_CLS.copy()
-FILE_READER_CLS.update(
-    {
-        ".json": JSONReader,
-    }
-)
+from private_gpt.settings.settings import Settings
 
 logger = logging.getLogger(__name__)
 
@@ -68,8 +63,16 @@ class IngestService:
         vector_store_component: VectorStoreComponent,
         embedding_component: EmbeddingComponent,
         node_store_component: NodeStoreComponent,
+        retrieval_component: RetrievalComponent,
+        settings: Settings,
     ) -> None:
         self.llm_service = llm_component
+        self.vector_store_component = vector_store_component
+        self.retrieval_component = retrieval_component
+        self.ingest_manifest = node_store_component.ingest_manifest
+        self.embed_model_name = IngestManifest.embed_model_name(
+            embedding_component.embedding_model
+        )
         self.storage_context = StorageContext.from_defaults(
             vector_store=vector_store_component.vector_store,
             docstore=node_store_component.doc_store,
@@ -80,86 +83,269 @@ class IngestService:
             embed_model=embedding_component.embedding_model,
             node_parser=SentenceWindowNodeParser.from_defaults(),
         )
-
-    def ingest(self, file_name: str, file_data: AnyStr | Path) -> list[IngestedDoc]:
-        logger.info("Ingesting file_name=%s", file_name)
-        extension = Path(file_name).suffix
-        reader_cls = FILE_READER_CLS.get(extension)
-        documents: list[Document]
-        if reader_cls is None:
-            logger.debug(
-                "No reader found for extension=%s, using default string reader",
-                extension,
+        self.parser_pool: ParserPool | None = None
+        if settings.ingestion.parse_workers > 0:
+            self.parser_pool = ParserPool(
+                workers=settings.ingestion.parse_workers,
+                timeout=settings.ingestion.parse_timeout,
             )
-            # Read as a plain text
-            string_reader = StringIterableReader()
-            if isinstance(file_data, Path):
-                text = file_data.read_text()
-                documents = string_reader.load_data([text])
-            elif isinstance(file_data, bytes):
-                documents = string_reader.load_data([file_data.decode("utf-8")])
-            elif isinstance(file_data, str):
-                documents = string_reader.load_data([file_data])
-            else:
-                raise ValueError(f"Unsupported data type {type(file_data)}")
-        else:
-            logger.debug("Specific reader found for extension=%s", extension)
-            reader: BaseReader = reader_cls()
-            if isinstance(file_data, Path):
-                # Already a path, nothing to do
-                documents = reader.load_data(file_data)
-            else:
-                # llama-index mainly supports reading from files, so
-                # we have to create a tmp file to read for it to work
-                # delete=False to avoid a Windows 11 permission error.
-                with tempfile.NamedTemporaryFile(delete=False) as tmp:
-                    try:
-                        path_to_tmp = Path(tmp.name)
-                        if isinstance(file_data, bytes):
-                            path_to_tmp.write_bytes(file_data)
-                        else:
-                            path_to_tmp.write_text(str(file_data))
-                        documents = reader.load_data(path_to_tmp)
-                    finally:
-                        tmp.close()
-                        path_to_tmp.unlink()
-        logger.info(
-            "Transformed file=%s into count=%s documents", file_name, len(documents)
+        self.bulk_ingest_pipeline = BulkIngestPipeline(
+            service_context=self.ingest_service_context,
+            parse_file=self._transform_file_into_documents,
+            queue_size=settings.ingestion.bulk_queue_size,
+            embed_batch_size=settings.ingestion.bulk_embed_batch_size,
+            parse_workers=settings.ingestion.parse_workers,
         )
-        for document in documents:
-            document.metadata["file_name"] = file_name
-        return self._save_docs(documents)
 
-    def _save_docs(self, documents: list[Document]) -> list[IngestedDoc]:
-        for document in documents:
-            document.metadata["doc_id"] = document.doc_id
-            # We don't want the Embeddings search to receive this metadata
-            document.excluded_embed_metadata_keys = ["doc_id"]
-            # We don't want the LLM to receive these metadata in the context
-            document.excluded_llm_metadata_keys = ["file_name", "doc_id", "page_label"]
+    def _collection(self, collection: str | None) -> str | None:
+        """Normalize a collection name, None being the default collection."""
+        if collection == self.vector_store_component.default_collection:
+            return None
+        return collection
 
+    def _get_storage_context(self, collection: str | None) -> StorageContext:
+        if collection is None:
+            return self.storage_context
+        # The documents of all the collections share the node stores
+        return StorageContext.from_defaults(
+            vector_store=self.vector_store_component.get_vector_store(collection),
+            docstore=self.storage_context.docstore,
+            index_store=self.storage_context.index_store,
+        )
+
+    def _get_index(self, collection: str | None = None) -> VectorStoreIndex:
+        storage_context = self._get_storage_context(collection)
         try:
-            # Load the index from storage and insert new documents,
-            index = load_index_from_storage(
-                storage_context=self.storage_context,
+            # Load the index from storage
+            return load_index_from_storage(  # type: ignore[return-value]
+                storage_context=storage_context,
                 service_context=self.ingest_service_context,
                 store_nodes_override=True,  # Force store nodes in index and document stores
                 show_progress=True,
             )
-            for doc in documents:
-                index.insert(doc)
         except ValueError:
             # Or create a new one if there is none
-            VectorStoreIndex.from_documents(
-                documents,
-                storage_context=self.storage_context,
+            return VectorStoreIndex.from_documents(
+                [],
+                storage_context=storage_context,
                 service_context=self.ingest_service_context,
                 store_nodes_override=True,  # Force store nodes in index and document stores
                 show_progress=True,
             )
 
+    def _transform_file_into_documents(
+        self, file_name: str, file_data: AnyStr | Path
+    ) -> list[Document]:
+        if self.parser_pool is not None:
+            # Parse in a worker process, isolating the server from the parser
+            return self.parser_pool.parse(file_name, file_data)
+        return IngestionHelper.transform_file_into_documents(file_name, file_data)
+
+    def ingest(
+        self,
+        file_name: str,
+        file_data: AnyStr | Path,
+        collection: str | None = None,
+        source_id: str | None = None,
+    ) -> list[IngestedDoc]:
+        """Ingest a file in a collection, the default one if None.
+
+        A new version of a file ingested from a path, or with the same `source_id`,
+        replaces the documents of the previous one.
+        """
+        collection = self._collection(collection)
+        logger.info("Ingesting file_name=%s collection=%s", file_name, collection)
+        file_hash = IngestManifest.file_hash(file_data)
+        source_key = IngestManifest.source_key(
+            file_data, file_hash, collection, source_id
+        )
+        previous = self.ingest_manifest.get(source_key)
+        if previous is not None and self._is_unchanged(previous, file_hash):
+            logger.info("Skipping unchanged file_name=%s", file_name)
+            return self._get_ingested_docs(previous.doc_ids)
+
+        documents = self._transform_file_into_documents(file_name, file_data)
+        index = self._get_index(collection)
+        nodes = run_transformations(
+            list(documents), self.ingest_service_context.transformations
+        )
+        chunk_hashes = self._reuse_embeddings(nodes, previous)
+        index.insert_nodes(nodes)
+        for document in documents:
+            index.docstore.set_document_hash(document.doc_id, document.hash)
+        self._replace_ingested_file(
+            index,
+            source_key,
+            IngestedFile(
+                file_name=file_name,
+                file_hash=file_hash,
+                embed_model=self.embed_model_name,
+                doc_ids=[document.doc_id for document in documents],
+                chunks=dict(
+                    zip(chunk_hashes, (node.node_id for node in nodes), strict=True)
+                ),
+                collection=collection,
+            ),
+            previous,
+        )
+
         # persist the index and nodes
+        self._persist()
+        return self._to_ingested_docs(documents)
+
+    def ingest_bulk(
+        self,
+        files: Iterable[tuple[str, AnyStr | Path]],
+        collection: str | None = None,
+    ) -> list[IngestedDoc]:
+        """Ingest many `(file_name, file_data)` files at once in a collection.
+
+        Parsing, splitting, embedding and storage run as pipelined stages, and the
+        storage context is persisted only once, after all files are ingested. A
+        source given more than once is only ingested once.
+        """
+        collection = self._collection(collection)
+        logger.info("Bulk ingesting files collection=%s", collection)
+        index = self._get_index(collection)
+        skipped_docs: list[IngestedDoc] = []
+        # (source key, file name, file hash, previous manifest entry) by position
+        ingesting: list[tuple[str, str, str, IngestedFile | None]] = []
+        chunk_hashes: dict[int, list[str]] = {}
+        ingesting_keys: set[str] = set()
+
+        def changed_files() -> Iterator[tuple[str, AnyStr | Path]]:
+            for file_name, file_data in files:
+                file_hash = IngestManifest.file_hash(file_data)
+                source_key = IngestManifest.source_key(file_data, file_hash, collection)
+                # Its entries would share the same previous version to replace
+                if source_key in ingesting_keys:
+                    logger.info("Skipping duplicated file_name=%s", file_name)
+                    continue
+                previous = self.ingest_manifest.get(source_key)
+                if previous is not None and self._is_unchanged(previous, file_hash):
+                    logger.info("Skipping unchanged file_name=%s", file_name)
+                    skipped_docs.extend(self._get_ingested_docs(previous.doc_ids))
+                    continue
+                ingesting.append((source_key, file_name, file_hash, previous))
+                ingesting_keys.add(source_key)
+                yield file_name, file_data
+
+        def before_embed(position: int, nodes: list[BaseNode]) -> None:
+            previous = ingesting[position][3]
+            chunk_hashes[position] = self._reuse_embeddings(nodes, previous)
+
+        def after_write(
+            position: int, documents: list[Document], nodes: list[BaseNode]
+        ) -> None:
+            source_key, file_name, file_hash, previous = ingesting[position]
+            self._replace_ingested_file(
+                index,
+                source_key,
+                IngestedFile(
+                    file_name=file_name,
+                    file_hash=file_hash,
+                    embed_model=self.embed_model_name,
+                    doc_ids=[document.doc_id for document in documents],
+                    chunks=dict(
+                        zip(
+                            chunk_hashes.pop(position),
+                            (node.node_id for node in nodes),
+                            strict=True,
+                        )
+                    ),
+                    collection=collection,
+                ),
+                previous,
+            )
+
+        documents = self.bulk_ingest_pipeline.run(
+            index, changed_files(), before_embed, after_write
+        )
+        # persist the index and nodes
+        self._persist()
+        logger.info(
+            "Bulk ingested count=%s documents, skipped count=%s unchanged documents",
+            len(documents),
+            len(skipped_docs),
+        )
+        return self._to_ingested_docs(documents) + skipped_docs
+
+    def _is_unchanged(self, ingested_file: IngestedFile, file_hash: str) -> bool:
+        return (
+            ingested_file.file_hash == file_hash
+            and ingested_file.embed_model == self.embed_model_name
+        )
+
+    def _reuse_embeddings(
+        self, nodes: list[BaseNode], previous: IngestedFile | None
+    ) -> list[str]:
+        """Copy the embeddings of the chunks that didn't change to the new nodes.
+
+        :returns: the hashes of the chunks of the nodes
+        """
+        chunk_hashes = [IngestManifest.chunk_hash(node) for node in nodes]
+        if previous is None or previous.embed_model != self.embed_model_name:
+            return chunk_hashes
+
+        previous_node_ids = {
+            chunk_hash: previous.chunks[chunk_hash]
+            for chunk_hash in chunk_hashes
+            if chunk_hash in previous.chunks
+        }
+        embeddings = self.vector_store_component.get_embeddings(
+            list(set(previous_node_ids.values())), previous.collection
+        )
+        reused = 0
+        for node, chunk_hash in zip(nodes, chunk_hashes, strict=True):
+            embedding = embeddings.get(previous_node_ids.get(chunk_hash, ""))
+            if embedding is not None:
+                node.embedding = embedding
+                reused += 1
+        logger.info(
+            "Reusing the embeddings of count=%s of count=%s chunks of file_name=%s",
+            reused,
+            len(nodes),
+            previous.file_name,
+        )
+        return chunk_hashes
+
+    def _replace_ingested_file(
+        self,
+        index: VectorStoreIndex,
+        source_key: str,
+        ingested_file: IngestedFile,
+        previous: IngestedFile | None,
+    ) -> None:
+        # The new documents are already stored, delete the old ones
+        # before pointing the manifest to the new ones
+        if previous is not None:
+            for doc_id in previous.doc_ids:
+                logger.debug("Replacing the previously ingested document=%s", doc_id)
+                index.delete_ref_doc(doc_id, delete_from_docstore=True)
+        self.ingest_manifest.put(source_key, ingested_file)
+
+    def _persist(self) -> None:
         self.storage_context.persist(persist_dir=local_data_path)
+        self.ingest_manifest.persist(local_data_path)
+        # The stores changed, the index used to answer queries is stale
+        self.retrieval_component.invalidate()
+
+    def _get_ingested_docs(self, doc_ids: list[str]) -> list[IngestedDoc]:
+        ingested_docs = []
+        for doc_id in doc_ids:
+            ref_doc_info = self.storage_context.docstore.get_ref_doc_info(doc_id)
+            doc_metadata = None
+            if ref_doc_info is not None and ref_doc_info.metadata is not None:
+                doc_metadata = IngestedDoc.curate_metadata(ref_doc_info.metadata)
+            ingested_docs.append(
+                IngestedDoc(
+                    object="ingest.document", doc_id=doc_id, doc_metadata=doc_metadata
+                )
+            )
+        return ingested_docs
+
+    @staticmethod
+    def _to_ingested_docs(documents: list[Document]) -> list[IngestedDoc]:
         return [
             IngestedDoc(
                 object="ingest.document",
@@ -169,28 +355,27 @@ class IngestService:
             for document in documents
         ]
 
-    def list_ingested(self) -> list[IngestedDoc]:
+    def list_ingested(self, collection: str | None = None) -> list[IngestedDoc]:
+        """List the documents ingested in a collection, the default one if None."""
+        collection = self._collection(collection)
         ingested_docs = []
         try:
-            docstore = self.storage_context.docstore
             ingested_docs_ids: set[str] = set()
+            if collection is not None:
+                for ingested_file in self.ingest_manifest.list_files():
+                    if ingested_file.collection == collection:
+                        ingested_docs_ids.update(ingested_file.doc_ids)
+            else:
+                docstore = self.storage_context.docstore
+                for node in docstore.docs.values():
+                    if node.ref_doc_id is not None:
+                        ingested_docs_ids.add(node.ref_doc_id)
+                # Documents of the other collections share the document store
+                for ingested_file in self.ingest_manifest.list_files():
+                    if ingested_file.collection is not None:
+                        ingested_docs_ids.difference_update(ingested_file.doc_ids)
 
-            for node in docstore.docs.values():
-                if node.ref_doc_id is not None:
-                    ingested_docs_ids.add(node.ref_doc_id)
-
-            for doc_id in ingested_docs_ids:
-                ref_doc_info = docstore.get_ref_doc_info(ref_doc_id=doc_id)
-                doc_metadata = None
-                if ref_doc_info is not None and ref_doc_info.metadata is not None:
-                    doc_metadata = IngestedDoc.curate_metadata(ref_doc_info.metadata)
-                ingested_docs.append(
-                    IngestedDoc(
-                        object="ingest.document",
-                        doc_id=doc_id,
-                        doc_metadata=doc_metadata,
-                    )
-                )
+            ingested_docs = self._get_ingested_docs(list(ingested_docs_ids))
         except ValueError:
             logger.warning("Got an exception when getting list of docs", exc_info=True)
             pass
@@ -202,13 +387,18 @@ class IngestService:
 
         :raises ValueError: if the document does not exist
         """
+        # Deleted from the collection it was ingested in
+        ingested_file = self.ingest_manifest.find_doc(doc_id)
+        collection = ingested_file.collection if ingested_file is not None else None
         logger.info(
-            "Deleting the ingested document=%s in the doc and index store", doc_id
+            "Deleting the ingested document=%s collection=%s in the doc and index store",
+            doc_id,
+            collection,
         )
 
         # Load the index with store_nodes_override=True to be able to delete them
         index = load_index_from_storage(
-            storage_context=self.storage_context,
+            storage_context=self._get_storage_context(collection),
             service_context=self.ingest_service_context,
             store_nodes_override=True,  # Force store nodes in index and document stores
             show_progress=True,
@@ -216,6 +406,7 @@ class IngestService:
 
         # Delete the document from the index
         index.delete_ref_doc(doc_id, delete_from_docstore=True)
+        self.ingest_manifest.forget_doc(doc_id)
 
         # Save the index
-        self.storage_context.persist(persist_dir=local_data_path)
+        self._persist()
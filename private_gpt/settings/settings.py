@@ -80,23 +80,229 @@ class DataSettings(BaseModel):
     )
 
 
+class IngestionSettings(BaseModel):
+    parse_workers: int = Field(
+        0,
+        description=(
+            "Number of worker processes used to parse files into documents. "
+            "If `0` - files are parsed in the server process.\n"
+            "Parsing in worker processes isolates the server from files that make "
+            "the parsers hang or crash, and allows parsing many files in parallel "
+            "during bulk ingestion."
+        ),
+    )
+    parse_timeout: float = Field(
+        300,
+        description=(
+            "Max number of seconds a worker process can spend parsing a single "
+            "file. The worker is killed and the file fails to be ingested if the "
+            "timeout is reached. Only used if `parse_workers` is greater than 0."
+        ),
+    )
+    bulk_queue_size: int = Field(
+        8,
+        description=(
+            "Max number of items waiting between two stages of the bulk ingestion "
+            "pipeline. Bounds the memory used while ingesting many files at once."
+        ),
+    )
+    bulk_embed_batch_size: int = Field(
+        64,
+        description=(
+            "Min number of nodes embedded together during bulk ingestion. Nodes coming "
+            "from different documents and files are grouped up to this size."
+        ),
+    )
+
+
 class LLMSettings(BaseModel):
     mode: Literal["local", "openai", "sagemaker", "mock"]
 
 
+class EmbeddingSettings(BaseModel):
+    cache_enabled: bool = Field(
+        False,
+        description=(
+            "Cache the computed embeddings in the local data folder, keyed by the "
+            "embedding model and the hash of the embedded text. Texts already "
+            "embedded (i.e. re-ingested chunks or repeated queries) are not sent to "
+            "the embedding model again."
+        ),
+    )
+    cache_max_size_mb: int = Field(
+        1024,
+        description=(
+            "Max size in MB of the embeddings stored on disk by each embedding "
+            "model. Once reached, the least recently used embeddings are evicted."
+        ),
+    )
+    cache_memory_entries: int = Field(
+        10000,
+        description=(
+            "Number of recently used embeddings also kept in memory, served without "
+            "reading the disk."
+        ),
+    )
+    query_batch_enabled: bool = Field(
+        False,
+        description=(
+            "Group the queries embedded concurrently (i.e. by concurrent chat or "
+            "chunks requests) in a single call to the embedding model. Not supported "
+            "by the `openai` mode."
+        ),
+    )
+    query_batch_max_size: int = Field(
+        32,
+        description="Max number of queries embedded in a single call.",
+    )
+    query_batch_max_latency_ms: float = Field(
+        5,
+        description=(
+            "Max time in milliseconds a query waits for other queries to be batched "
+            "with, before being embedded."
+        ),
+    )
+
+
+class ResponseCacheSettings(BaseModel):
+    enabled: bool = Field(
+        False,
+        description=(
+            "Cache the responses of the chat and completions APIs in memory. A "
+            "request with the same messages (ignoring case and spacing), context use "
+            "and context filter is answered without calling the LLM, until documents "
+            "are ingested or deleted by this server. Changes made by another process, "
+            "i.e. scripts/ingest_folder.py, are only seen once the responses expire."
+        ),
+    )
+    max_entries: int = Field(
+        1024,
+        description=(
+            "Max number of cached responses. Once reached, the least recently used "
+            "responses are evicted."
+        ),
+    )
+    ttl_seconds: float = Field(
+        3600, description="Time in seconds after which a cached response expires."
+    )
+    semantic_enabled: bool = Field(
+        False,
+        description=(
+            "Also answer a request with the cached response of a request with a "
+            "similar last message, the earlier messages and context being the same. "
+            "The last message of every request is embedded."
+        ),
+    )
+    semantic_similarity_threshold: float = Field(
+        0.95,
+        description=(
+            "Min cosine similarity of the embeddings of the last messages of two "
+            "requests for them to get the same response."
+        ),
+    )
+
+
 class VectorstoreSettings(BaseModel):
-    database: Literal["chroma", "qdrant"]
+    database: Literal["chroma", "qdrant", "local"] = Field(
+        description=(
+            "Vector store of the embeddings.\n"
+            "`local` stores them in `local_data_path`, searched in-process without "
+            "any extra service."
+        )
+    )
+    collection: str = Field(
+        "make_this_parameterizable_per_api_call",
+        description=(
+            "Collection of the documents ingested or queried without a collection."
+        ),
+    )
+    max_open_collections: int = Field(
+        16,
+        description=(
+            "Max number of vector stores of collections other than the default one "
+            "kept open, the least recently used ones are released beyond."
+        ),
+    )
+    ivf_min_vectors: int = Field(
+        20000,
+        description=(
+            "Only used by the `local` database. Number of vectors from which an IVF "
+            "index is trained, the search is exact below it."
+        ),
+    )
+    ivf_probes: int = Field(
+        16,
+        description=(
+            "Only used by the `local` database. Number of IVF lists searched by a "
+            "query, more is more accurate and slower."
+        ),
+    )
+
+
+class NodeStoreSettings(BaseModel):
+    database: Literal["simple", "sqlite"] = Field(
+        "simple",
+        description=(
+            "Storage of the document and index stores.\n"
+            "If `simple` - in-memory stores, fully dumped as JSON files in the "
+            "local data folder on every ingestion.\n"
+            "If `sqlite` - SQLite database in the local data folder, only the "
+            "changed nodes are written on every ingestion."
+        ),
+    )
 
 
 class LocalSettings(BaseModel):
     llm_hf_repo_id: str
     llm_hf_model_file: str
     embedding_hf_model_name: str
+    prompt_cache_enabled: bool = Field(
+        False,
+        description=(
+            "Keep in memory the llama.cpp states evaluated for the recent prompts. A "
+            "prompt starting with a cached one (i.e. the next turn of a conversation) "
+            "is evaluated from that state, only its new tokens being evaluated."
+        ),
+    )
+    prompt_cache_max_size_mb: int = Field(
+        2048,
+        description=(
+            "Max size in MB of the cached states. Once reached, the least recently "
+            "used states are evicted. A state takes up to the size of the KV cache "
+            "of the context window, i.e. about 500MB for a 7B model."
+        ),
+    )
 
 
 class SagemakerSettings(BaseModel):
     llm_endpoint_name: str
     embedding_endpoint_name: str
+    max_pool_connections: int = Field(
+        10,
+        description=(
+            "Max number of connections to each endpoint, i.e. of concurrent requests."
+        ),
+    )
+    embedding_endpoint_url: str | None = Field(
+        None,
+        description=(
+            "URL of the embedding endpoint, i.e. of a local stand-in endpoint started "
+            "with `scripts/sagemaker_embedding_stand_in.py`. The AWS one if not set."
+        ),
+    )
+    embedding_max_batch_size: int = Field(
+        32, description="Max number of texts embedded by a request."
+    )
+    embedding_max_batch_tokens: int = Field(
+        8192,
+        description="Max number of tokens, estimated from the text length, "
+        "embedded by a request.",
+    )
+    embedding_max_payload_bytes: int = Field(
+        5 * 1024 * 1024,
+        description="Max size of the body of an embedding request. SageMaker "
+        "rejects requests larger than 6MB.",
+    )
 
 
 class OpenAISettings(BaseModel):
@@ -165,12 +371,16 @@ class QdrantSettings(BaseModel):
 class Settings(BaseModel):
     server: ServerSettings
     data: DataSettings
+    ingestion: IngestionSettings
     ui: UISettings
     llm: LLMSettings
+    embedding: EmbeddingSettings
+    response_cache: ResponseCacheSettings
     local: LocalSettings
     sagemaker: SagemakerSettings
     openai: OpenAISettings
     vectorstore: VectorstoreSettings
+    nodestore: NodeStoreSettings
     qdrant: QdrantSettings | None = None
 
 
@@ -0,0 +1,94 @@
+"""Time to first token of the local LLM, with and without the prompt cache.
+
+Runs the same conversations, turn by turn, with the llama.cpp state cache enabled
+by `local.prompt_cache_enabled` and without it, and prints the time to the first
+streamed token of each turn.
+
+The conversations are interleaved: llama.cpp reuses the evaluated prefix of the
+last prompt by itself, so a single conversation served alone doesn't need the
+cache, as long as no other conversation is served in between.
+
+Needs the local model, run with `PGPT_PROFILES=local`.
+"""
+import argparse
+import statistics
+import time
+
+from llama_index.llms import ChatMessage, MessageRole
+
+from private_gpt.components.llm.llm_component import LLMComponent
+from private_gpt.settings.settings import settings
+
+SYSTEM_PROMPT = (
+    "You are a helpful assistant answering questions about the sales reports of the "
+    "company. Answer in a few sentences, quoting the figures of the reports. "
+) * 8
+QUESTIONS = [
+    "What were the total sales of Q3 2023?",
+    "How do they compare to the sales of Q2?",
+    "Which region grew the most?",
+    "What explains that growth?",
+    "What are the forecasts for Q4?",
+    "Summarize the previous answers in one sentence.",
+]
+
+
+def run_conversations(
+    llm: LLMComponent, conversations: int, turns: int
+) -> list[list[float]]:
+    """Time to first token of each turn of each conversation."""
+    histories = [
+        [ChatMessage(role=MessageRole.SYSTEM, content=SYSTEM_PROMPT)]
+        for _ in range(conversations)
+    ]
+    ttfts: list[list[float]] = [[] for _ in range(turns)]
+    for turn in range(turns):
+        for index, history in enumerate(histories):
+            question = QUESTIONS[turn % len(QUESTIONS)]
+            history.append(
+                ChatMessage(
+                    role=MessageRole.USER, content=f"{question} (conversation {index})"
+                )
+            )
+            start = time.perf_counter()
+            answer = ""
+            for response in llm.llm.stream_chat(history):
+                if not answer:
+                    ttfts[turn].append(time.perf_counter() - start)
+                answer += response.delta or ""
+            history.append(ChatMessage(role=MessageRole.ASSISTANT, content=answer))
+    return ttfts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="benchmark_llm_prompt_cache.py")
+    parser.add_argument("--conversations", type=int, default=3)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument(
+        "--max-tokens", type=int, default=64, help="Max tokens of each answer."
+    )
+    args = parser.parse_args()
+
+    if settings().llm.mode != "local" or not settings().local.prompt_cache_enabled:
+        raise SystemExit("Needs llm.mode local and local.prompt_cache_enabled true")
+    llm = LLMComponent(settings())
+    model = llm.llm._model  # type: ignore[attr-defined]
+    model_cache = model.cache
+    llm.llm.generate_kwargs["max_tokens"] = args.max_tokens  # type: ignore[attr-defined]
+
+    for name, cache in (("without cache", None), ("with cache", model_cache)):
+        model.set_cache(cache)
+        if cache is not None:
+            cache.cache_state.clear()
+        model.reset()
+        ttfts = run_conversations(llm, args.conversations, args.turns)
+        print(f"Time to first token {name}:")
+        for turn, turn_ttfts in enumerate(ttfts):
+            print(
+                f"  turn {turn + 1}: {statistics.mean(turn_ttfts) * 1000:.0f} ms "
+                f"(max {max(turn_ttfts) * 1000:.0f} ms)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Micro-benchmark of the parsing of SageMaker TGI response streams.
+
+Compares the parsing of the events of a TGI stream by `TGIEventIterator` to the
+previous parser (a `BytesIO` read line by line, then decoded and parsed).
+
+The stream is either generated, or read from a recording: the raw bytes of the
+body of a response of `invoke_endpoint_with_response_stream`. In both cases it is
+split in PayloadPart events of random sizes, so that JSON objects are split across
+events as they can be by the endpoint.
+"""
+import argparse
+import io
+import json
+import random
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+from private_gpt.components.llm.custom.sagemaker import TGIEventIterator
+
+
+class BytesIOLineIterator:
+    """Previous line parser, kept as the baseline of the benchmark."""
+
+    def __init__(self, stream: Any) -> None:
+        self.byte_iterator = iter(stream)
+        self.buffer = io.BytesIO()
+        self.read_pos = 0
+
+    def __iter__(self) -> Any:
+        return self
+
+    def __next__(self) -> Any:
+        while True:
+            self.buffer.seek(self.read_pos)
+            line = self.buffer.readline()
+            if line and line[-1] == ord("\n"):
+                self.read_pos += len(line)
+                return line[:-1]
+            chunk = next(self.byte_iterator)
+            self.buffer.seek(0, io.SEEK_END)
+            self.buffer.write(chunk["PayloadPart"]["Bytes"])
+
+
+def bytes_io_events(events: list[dict[str, Any]]) -> Iterator[Any]:
+    for line in BytesIOLineIterator(events):
+        if line != b"" and b"{" in line:
+            yield json.loads(line[line.find(b"{") :].decode("utf-8"))
+
+
+def generate_stream(tokens: int) -> bytes:
+    words = ["the", " quick", " brown", " fox", " jumps", " over", " lazy", " dog"]
+    return b"".join(
+        b"data:"
+        + json.dumps(
+            {
+                "token": {
+                    "id": i,
+                    "text": words[i % len(words)],
+                    "logprob": -0.5,
+                    "special": False,
+                },
+                "generated_text": None,
+                "details": None,
+            }
+        ).encode("utf-8")
+        + b"\n\n"
+        for i in range(tokens)
+    )
+
+
+def split_events(
+    body: bytes, max_part_size: int, rng: random.Random
+) -> list[dict[str, Any]]:
+    events = []
+    position = 0
+    while position < len(body):
+        size = rng.randint(1, max_part_size)
+        events.append({"PayloadPart": {"Bytes": body[position : position + size]}})
+        position += size
+    return events
+
+
+def run(name: str, parse: Any, events: list[dict[str, Any]], repeat: int) -> list[Any]:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parsed = list(parse(events))
+        durations.append(time.perf_counter() - start)
+    best = min(durations)
+    print(
+        f"{name:>18}: {len(parsed)} events in {best * 1000:.1f} ms "
+        f"({best / max(len(parsed), 1) * 1e6:.2f} us/event)"
+    )
+    return parsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="benchmark_sagemaker_stream.py")
+    parser.add_argument(
+        "--recording",
+        type=Path,
+        default=None,
+        help="Raw body of a recorded response stream, generated if not set.",
+    )
+    parser.add_argument(
+        "--tokens",
+        type=int,
+        default=20000,
+        help="Number of tokens of the generated stream.",
+    )
+    parser.add_argument(
+        "--max-part-size",
+        type=int,
+        default=256,
+        help="Max size in bytes of the PayloadPart events the stream is split in.",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    body = (
+        args.recording.read_bytes()
+        if args.recording is not None
+        else generate_stream(args.tokens)
+    )
+    events = split_events(body, args.max_part_size, random.Random(args.seed))
+    print(f"Stream of {len(body)} bytes in {len(events)} PayloadPart events")
+
+    expected = run("BytesIO", bytes_io_events, events, args.repeat)
+    parsed = run("TGIEventIterator", TGIEventIterator, events, args.repeat)
+    if parsed != expected:
+        raise SystemExit("TGIEventIterator events differ from the baseline ones")
+
+    iterator = TGIEventIterator(events)
+    max_buffer = 0
+    for _ in iterator:
+        max_buffer = max(max_buffer, len(iterator.buffer))
+    print(f"TGIEventIterator max buffer size: {max_buffer} bytes")
+    print(f"BytesIO final buffer size: {len(body)} bytes (the whole stream)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import argparse
 import logging
+from collections.abc import Iterator
 from pathlib import Path
 
 from private_gpt.di import global_injector
@@ -18,6 +19,12 @@ parser.add_argument(
     action=argparse.BooleanOptionalAction,
     default=False,
 )
+parser.add_argument(
+    "--collection",
+    help="Collection to ingest the documents in, the default collection if not set.",
+    type=str,
+    default=None,
+)
 parser.add_argument(
     "--log-file",
     help="Optional path to a log file. If provided, logs will be written to this file.",
@@ -38,36 +45,36 @@ if args.log_file:
     logger.addHandler(file_handler)
 
 
-total_documents = 0
-current_document_count = 0
-
-
-def count_documents(folder_path: Path) -> None:
-    global total_documents
+def _list_files(folder_path: Path) -> list[Path]:
+    files: list[Path] = []
     for file_path in folder_path.iterdir():
         if file_path.is_file():
-            total_documents += 1
+            files.append(file_path)
         elif file_path.is_dir():
-            count_documents(file_path)
+            files.extend(_list_files(file_path))
+    return files
 
 
 def _recursive_ingest_folder(folder_path: Path) -> None:
-    global current_document_count, total_documents
-    for file_path in folder_path.iterdir():
-        if file_path.is_file():
-            current_document_count += 1
+    files = _list_files(folder_path)
+    total_documents = len(files)
+    logger.info(f"Ingesting {total_documents} documents from {folder_path}")
+
+    def _with_progress() -> Iterator[tuple[str, Path]]:
+        for current_document_count, file_path in enumerate(files, start=1):
             progress_msg = f"Document {current_document_count} of {total_documents} ({(current_document_count / total_documents) * 100:.2f}%)"
             logger.info(progress_msg)
-            _do_ingest(file_path)
-        elif file_path.is_dir():
-            _recursive_ingest_folder(file_path)
+            yield file_path.name, file_path
+
+    ingest_service.ingest_bulk(_with_progress(), args.collection)
+    logger.info(f"Completed ingesting {folder_path}")
 
 
 def _do_ingest(changed_path: Path) -> None:
     try:
         if changed_path.exists():
             logger.info(f"Started ingesting {changed_path}")
-            ingest_service.ingest(changed_path.name, changed_path)
+            ingest_service.ingest(changed_path.name, changed_path, args.collection)
             logger.info(f"Completed ingesting {changed_path}")
     except Exception:
         logger.exception(
@@ -79,9 +86,6 @@ path = Path(args.folder)
 if not path.exists():
     raise ValueError(f"Path {args.folder} does not exist")
 
-# Count total documents before ingestion
-count_documents(path)
-
 _recursive_ingest_folder(path)
 if args.watch:
     logger.info(f"Watching {args.folder} for changes, press Ctrl+C to stop...")
@@ -0,0 +1,194 @@
+"""Local stand-in of a SageMaker embedding endpoint, and benchmark of its client.
+
+Serves `POST /endpoints/<name>/invocations` as a SageMaker embedding endpoint does:
+the body `{"inputs": [...]}` is answered by `{"vectors": [...]}`, after a latency
+growing with the number of texts. Bodies larger than `--max-payload-bytes` are
+rejected with a 413 and `--failure-rate` of the requests fail with a 500, to
+exercise the retries of the client.
+
+To use it from PrivateGPT, set `sagemaker.embedding_endpoint_url` to the printed
+URL. boto3 still signs the requests, any credentials and region will do, i.e.
+`AWS_ACCESS_KEY_ID=x AWS_SECRET_ACCESS_KEY=x AWS_DEFAULT_REGION=us-east-1`.
+
+With `--benchmark`, the stand-in is started in the background and texts are
+embedded by `SagemakerEmbedding` as before (requests of 10 texts, one at a time)
+and with the batching and concurrency of the settings.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+
+def embed(text: str, dimension: int) -> list[float]:
+    """Deterministic pseudo embedding of a text."""
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    values = struct.unpack("<8I", seed)
+    return [((values[i % 8] * (i + 1)) % 2000) / 1000 - 1 for i in range(dimension)]
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        dimension: int,
+        latency: float,
+        latency_per_text: float,
+        max_payload_bytes: int,
+        failure_rate: float,
+    ) -> None:
+        super().__init__(address, StandInHandler)
+        self.dimension = dimension
+        self.latency = latency
+        self.latency_per_text = latency_per_text
+        self.max_payload_bytes = max_payload_bytes
+        self.failure_rate = failure_rate
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    server: StandInServer
+
+    def do_POST(self) -> None:
+        self.server.requests += 1
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.endswith("/invocations"):
+            self._reply(404, {"message": f"Unknown path {self.path}"})
+        elif len(body) > self.server.max_payload_bytes:
+            self._reply(413, {"message": f"Payload of {len(body)} bytes too large"})
+        elif random.random() < self.server.failure_rate:
+            self._reply(500, {"message": "Random failure of the stand-in"})
+        else:
+            inputs = json.loads(body)["inputs"]
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            time.sleep(self.server.latency + self.server.latency_per_text * len(inputs))
+            vectors = [embed(text, self.server.dimension) for text in inputs]
+            self._reply(200, {"vectors": vectors})
+
+    def _reply(self, status: int, content: dict[str, Any]) -> None:
+        data = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def benchmark(server: StandInServer, args: argparse.Namespace) -> None:
+    from private_gpt.components.embedding.custom.sagemaker import SagemakerEmbedding
+    from private_gpt.settings.settings import settings
+
+    # Signed requests need credentials, even if the stand-in ignores them
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "stand-in")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "stand-in")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    rng = random.Random(args.seed)
+    words = ["sales", "quarter", "revenue", "growth", "report", "team", "market"]
+    texts = [
+        " ".join(rng.choice(words) for _ in range(rng.randint(20, 200)))
+        for _ in range(args.texts)
+    ]
+    sagemaker_settings = settings().sagemaker
+    clients = {
+        "serial, 10 per request": SagemakerEmbedding(
+            endpoint_name="stand-in",
+            endpoint_url=server.url,
+            max_pool_connections=1,
+            max_batch_size=10,
+        ),
+        "batched, concurrent": SagemakerEmbedding(
+            endpoint_name="stand-in",
+            endpoint_url=server.url,
+            max_pool_connections=sagemaker_settings.max_pool_connections,
+            max_batch_size=sagemaker_settings.embedding_max_batch_size,
+            max_batch_tokens=sagemaker_settings.embedding_max_batch_tokens,
+            max_payload_bytes=min(
+                sagemaker_settings.embedding_max_payload_bytes,
+                args.max_payload_bytes,
+            ),
+        ),
+    }
+    expected = [embed(text, args.dimension) for text in texts]
+    for name, client in clients.items():
+        server.requests = 0
+        start = time.perf_counter()
+        embeddings = client.get_text_embedding_batch(texts)
+        duration = time.perf_counter() - start
+        if embeddings != expected:
+            raise SystemExit(f"{name}: embeddings differ from the expected ones")
+        print(
+            f"{name:>24}: {len(texts)} texts in {duration:.2f} s "
+            f"({server.requests} requests)"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="sagemaker_embedding_stand_in.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Seconds per request."
+    )
+    parser.add_argument(
+        "--latency-per-text", type=float, default=0.002, help="Seconds per text."
+    )
+    parser.add_argument(
+        "--max-payload-bytes",
+        type=int,
+        default=6 * 1024 * 1024,
+        help="Size of the largest accepted body, as the 6MB limit of SageMaker.",
+    )
+    parser.add_argument(
+        "--failure-rate", type=float, default=0.0, help="Ratio of failed requests."
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Benchmark the client against the stand-in instead of serving it.",
+    )
+    parser.add_argument(
+        "--texts", type=int, default=2000, help="Number of texts of the benchmark."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = StandInServer(
+        (args.host, 0 if args.benchmark else args.port),
+        dimension=args.dimension,
+        latency=args.latency,
+        latency_per_text=args.latency_per_text,
+        max_payload_bytes=args.max_payload_bytes,
+        failure_rate=args.failure_rate,
+    )
+    if not args.benchmark:
+        print(f"Serving a SageMaker embedding stand-in endpoint on {server.url}")
+        server.serve_forever()
+        return
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        benchmark(server, args)
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import hashlib
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# (size, mtime in ns, sha256 of the content) of a source file, the hash is None until computed
+SourceState = Tuple[int, int, Optional[str]]
+
+
+class SourceManifest:
+    """
+    Sidecar record of the source files ingested in a vector store.
+
+    Each ingested file is recorded with its size, modification time and content
+    hash, in a SQLite database next to the store. It tells which files are new or
+    modified since their ingestion without reading the store: files whose size and
+    mtime didn't change are skipped without being read, the others are hashed and
+    only ingested again if their content changed.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS sources ("
+                "path TEXT PRIMARY KEY, "
+                "size INTEGER NOT NULL, "
+                "mtime INTEGER NOT NULL, "
+                "hash TEXT)"
+            )
+
+    def is_empty(self) -> bool:
+        return self.connection.execute("SELECT 1 FROM sources LIMIT 1").fetchone() is None
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM sources")
+
+    def changes(self, file_paths: Iterable[str]) -> Tuple[Dict[str, SourceState], List[str]]:
+        """
+        Finds the new and modified files among the given ones
+
+        Returns the state of the files to ingest, and the list of the modified ones
+        (their previous chunks have to be removed from the store).
+        """
+        known = {
+            path: (size, mtime, file_hash)
+            for path, size, mtime, file_hash in self.connection.execute(
+                "SELECT path, size, mtime, hash FROM sources"
+            )
+        }
+        to_ingest = {}
+        modified = []
+        touched = []
+        for file_path in file_paths:
+            state = file_state(file_path)
+            previous = known.get(file_path)
+            if previous is None:
+                to_ingest[file_path] = state
+            elif previous[:2] != state[:2]:
+                # Only read the files whose size or mtime changed
+                state = (state[0], state[1], file_hash(file_path))
+                if state[2] == previous[2]:
+                    touched.append((file_path, state))
+                else:
+                    to_ingest[file_path] = state
+                    modified.append(file_path)
+        # Same content, only the mtime changed: no need to hash them again next time
+        self.record(dict(touched))
+        return to_ingest, modified
+
+    def record(self, states: Dict[str, SourceState]):
+        """
+        Records the given files as ingested
+        """
+        rows = [
+            (path, size, mtime, state_hash if state_hash is not None else file_hash(path))
+            for path, (size, mtime, state_hash) in states.items()
+        ]
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO sources (path, size, mtime, hash) VALUES (?, ?, ?, ?)", rows
+            )
+
+    def bootstrap(self, sources: Iterable[str]):
+        """
+        Records the sources of a store created before the manifest
+
+        They are recorded with their current size, mtime and content hash, so they
+        are not ingested again unless their content changes.
+        """
+        states = {}
+        for source in sources:
+            if source not in states and os.path.exists(source):
+                states[source] = file_state(source)
+        # Hashed when recorded
+        self.record(states)
+        print(f"Recorded {len(states)} already ingested files in the source manifest")
+
+
+def file_state(file_path: str) -> SourceState:
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns, None
+
+
+def file_hash(file_path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while block := f.read(1024 * 1024):
+            sha256.update(block)
+    return sha256.hexdigest()
@@ -1,34 +1,86 @@
+import itertools
 import os
+import queue
 import re
 
-import requests
 import torch
 from transformers import pipeline
 from txtai.pipeline import Translation, Segmentation, Labels
 
+from tasks.models import models
+from tasks.ollama import TranslationCache, get_client
 
-def sentiment_analysis(text):
+# Number of (text, emotion) pairs classified in a single forward pass
+SENTIMENT_BATCH_SIZE = int(os.environ.get('SENTIMENT_BATCH_SIZE', '16'))
+
+# The models are loaded on first use, and shared by all the tasks of the process
+models.register('sentiment', lambda: Labels("facebook/bart-large-mnli"))
+models.register('paragraphs', lambda: Segmentation(paragraphs=True))
+models.register('sentences', lambda: Segmentation(sentences=True))
+
+
+def warm_up():
     """
-    Perform sentiment analysis on a text.
+    Load the models of the generic tasks, so the first tasks don't wait for them.
+    """
+    models.warm_up(['sentiment', 'paragraphs', 'sentences'])
+
+
+def sentiment_analysis(texts):
+    """
+    Perform sentiment analysis on one or many texts.
 
     The text is analyzed for five emotions (joy, sadness, anger, fear, love, surprise, neutral).
     The strongest emotion is returned as the sentiment of the text.
 
+    Many texts are classified together, in batches of SENTIMENT_BATCH_SIZE pairs
+    of text and emotion.
+
     Parameters
     ----------
-    text : str
-        The text to be processed.
+    texts : str|list
+        The text or texts to be processed.
 
     Returns
     -------
-    sentiment : str
-        The sentiment of the text.
+    sentiment : str|list
+        The sentiment of the text, or the list of sentiments of the texts.
     """
 
-    labels = Labels("facebook/bart-large-mnli")
     tags = ["joy", "sadness", "anger", "fear", "love", "surprise", "neutral"]
+    batch = [texts] if isinstance(texts, str) else list(texts)
+    if not batch:
+        return []
+
+    with models.use('sentiment') as labels:
+        # The transformers pipeline batches the inputs, txtai's Labels doesn't expose it
+        results = labels.pipeline(
+            batch, tags, multi_label=False, truncation=True, batch_size=SENTIMENT_BATCH_SIZE
+        )
+        if isinstance(results, dict):
+            results = [results]
+        sentiments = [tags[scores[0][0]] for scores in labels.outputs(results, tags, None)]
 
-    return tags[labels(text, tags)[0][0]]
+    return sentiments[0] if isinstance(texts, str) else sentiments
+
+
+# Names of the languages given to the LLM, other codes are given as they are
+LANGUAGES = {
+    "en": "English",
+    "de": "German",
+    "fr": "French",
+    "es": "Spanish",
+    "it": "Italian",
+    "nl": "Dutch",
+    "pt": "Portuguese",
+    "pl": "Polish",
+}
+
+# Translated sentences, so repeated ones (i.e. boilerplate) are not sent to the LLM again
+translations = TranslationCache(int(os.environ.get('TRANSLATION_CACHE_SIZE', '10000')))
+
+# Marks the end of the tokens of a sentence
+_END = object()
 
 
 def translate(text, target="en", source=None):
@@ -38,6 +90,10 @@ def translate(text, target="en", source=None):
     This method supports texts as a string or a list. If the input is a string,
     the return type is string. If text is a list, the return type is a list.
 
+    The texts are split into sentences, translated concurrently by the LLM
+    (OLLAMA_CONCURRENCY at a time). Sentences already translated are taken from
+    the cache.
+
     Args:
         texts: text|list
         target: target language code, defaults to "en"
@@ -53,42 +109,122 @@ def translate(text, target="en", source=None):
     if source == target:
         return text
 
-    model_name = os.environ.get('MODEL_NAME')
-    languages = {
-        "en": "English",
-        "de": "German",
-    }
+    client = get_client()
+    texts = [text] if isinstance(text, str) else list(text)
+    split_texts = [_split_lines(text) for text in texts]
 
-    prompt = f"""
-    Translate the following text from {languages[source]} to {languages[target]} without adding any comments or notes:
-    Text: {text}
-    Translation:
-    """
-    prompt = re.sub(r"\n\s+", "\n", prompt)
+    # Each distinct sentence is translated once
+    futures = {}
+    for lines in split_texts:
+        for sentence in itertools.chain.from_iterable(lines):
+            if sentence not in futures:
+                futures[sentence] = client.submit(_translate_sentence, client, sentence, source, target)
 
-    request = {
-        "model": model_name,
-        "prompt": prompt,
-        "stream": False,
-    }
+    answers = [
+        "\n".join(" ".join(futures[sentence].result() for sentence in line) for line in lines)
+        for lines in split_texts
+    ]
+    print(f"Translated {len(texts)} texts ({len(futures)} sentences) from {source} to {target}")
 
-    # Send the request to the Ollama URL
-    ollama_url = os.environ.get("OLLAMA_URL", "http://ollama")
-    ollama_port = os.environ.get("OLLAMA_PORT", "11434")
-    ollama_url = f"{ollama_url}:{ollama_port}/api/generate"
-    response = requests.post(ollama_url, json=request)
+    return answers[0] if isinstance(text, str) else answers
 
-    # Get the response as JSON
-    response = response.json()
 
-    # Get the answer from the response
-    answer = response["response"] if 'response' in response else response
+def translate_stream(text, target="en", source=None):
+    """
+    Translates a text from source language into target language, yielding the
+    translation as it is generated.
 
-    print("Orginal text: " + text)
-    print("Translated text: " + answer)
+    Like `translate`, the sentences are translated concurrently, their tokens are
+    yielded in the order of the text.
+    """
 
-    return answer
+    if source is None:
+        source = "en"
+
+    if source == target:
+        yield text
+        return
+
+    client = get_client()
+    lines = []
+    for line in _split_lines(text):
+        streams = []
+        for sentence in line:
+            tokens = queue.Queue()
+            streams.append((tokens, client.submit(_stream_sentence, client, sentence, source, target, tokens)))
+        lines.append(streams)
+
+    for number, streams in enumerate(lines):
+        if number:
+            yield "\n"
+        for position, (tokens, future) in enumerate(streams):
+            if position:
+                yield " "
+            while (token := tokens.get()) is not _END:
+                yield token
+            # Raises the error of the translation, if any
+            future.result()
+
+
+def _split_lines(text):
+    # Lines are kept, so the translation keeps the layout of the text
+    lines = text.split("\n")
+    non_empty = [line for line in lines if line.strip()]
+    sentences = iter(split_sentences(non_empty) if non_empty else [])
+    return [next(sentences) if line.strip() else [] for line in lines]
+
+
+def _translate_sentence(client, sentence, source, target):
+    key = TranslationCache.key(client.model, source, target, sentence)
+    translation = translations.get(key)
+    if translation is None:
+        translation = client.generate(_translation_prompt(sentence, source, target)).strip()
+        translations.put(key, translation)
+    return translation
+
+
+def _stream_sentence(client, sentence, source, target, tokens):
+    try:
+        key = TranslationCache.key(client.model, source, target, sentence)
+        translation = translations.get(key)
+        if translation is not None:
+            tokens.put(translation)
+            return translation
+
+        generated = []
+        for token in client.stream(_translation_prompt(sentence, source, target)):
+            # Leading whitespace of the answer is dropped, as in `translate`
+            if generated or token.strip():
+                token = token if generated else token.lstrip()
+                generated.append(token)
+                tokens.put(token)
+        translation = "".join(generated).strip()
+        translations.put(key, translation)
+        return translation
+    finally:
+        tokens.put(_END)
+
+
+def _translation_prompt(text, source, target):
+    prompt = f"""
+    Translate the following text from {LANGUAGES.get(source, source)} to {LANGUAGES.get(target, target)} without adding any comments or notes:
+    Text: {text}
+    Translation:
+    """
+    return re.sub(r"\n\s+", "\n", prompt)
+
+
+def split_paragraphs(text):
+    """
+    Split a text (or list of texts) into paragraphs.
+    """
+    with models.use('paragraphs') as segmentation:
+        return segmentation(text)
 
 
-split_paragraphs = Segmentation(paragraphs=True)
-split_sentences = Segmentation(sentences=True)
+def split_sentences(text):
+    """
+    Split a text (or list of texts) into sentences.
+    """
+    with models.use('sentences') as segmentation:
+        return segmentation(text)
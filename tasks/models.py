@@ -0,0 +1,141 @@
+import gc
+import itertools
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of the models used by the tasks.
+
+    Models are registered with the function creating them, and only created on
+    first use (or when warmed up). They are then shared by all the tasks of the
+    process.
+
+    The memory used by the loaded models is bounded by `max_memory` bytes: when a
+    model is loaded beyond it, the least recently used idle models are evicted.
+    Models in use by a task are never evicted.
+    """
+
+    def __init__(self, max_memory):
+        self.max_memory = max_memory
+        self._factories = {}
+        self._models = OrderedDict()
+        self._sizes = {}
+        self._in_use = {}
+        self._load_locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory):
+        """
+        Register the function creating a model, called on first use.
+        """
+        with self._lock:
+            self._factories[name] = factory
+            self._load_locks[name] = threading.Lock()
+
+    def warm_up(self, names=None):
+        """
+        Load the given models (all registered models by default) ahead of their use.
+        """
+        for name in names or list(self._factories):
+            with self.use(name):
+                pass
+
+    @contextmanager
+    def use(self, name):
+        """
+        Use a model for the duration of a task, loading it if needed.
+        """
+        model = self._acquire(name)
+        try:
+            yield model
+        finally:
+            with self._lock:
+                self._in_use[name] -= 1
+
+    def get(self, name):
+        """
+        Get a model, loading it if needed. It may be evicted once returned.
+        """
+        with self.use(name) as model:
+            return model
+
+    def evict(self, name):
+        with self._lock:
+            self._evict(name)
+        _release_memory()
+
+    def _acquire(self, name):
+        with self._lock:
+            if name in self._models:
+                return self._mark_used(name)
+        if name not in self._factories:
+            raise KeyError(f'No such model: {name}')
+
+        # Loaded once, even when requested by several tasks at the same time
+        with self._load_locks[name]:
+            with self._lock:
+                if name in self._models:
+                    return self._mark_used(name)
+            print(f"Loading model {name}")
+            model = self._factories[name]()
+            size = memory_size(model)
+            print(f"Loaded model {name} using {size / 1024 ** 2:.0f} MB")
+
+            with self._lock:
+                self._models[name] = model
+                self._sizes[name] = size
+                model = self._mark_used(name)
+                evicted = self._evict_idle()
+        if evicted:
+            _release_memory()
+        return model
+
+    def _mark_used(self, name):
+        self._models.move_to_end(name)
+        self._in_use[name] = self._in_use.get(name, 0) + 1
+        return self._models[name]
+
+    def _evict_idle(self):
+        evicted = False
+        for name in list(self._models):
+            if sum(self._sizes.values()) <= self.max_memory:
+                break
+            if not self._in_use.get(name):
+                self._evict(name)
+                evicted = True
+        return evicted
+
+    def _evict(self, name):
+        if self._models.pop(name, None) is not None:
+            self._sizes.pop(name)
+            print(f"Evicted model {name}")
+
+
+def memory_size(model):
+    """
+    Memory used by the weights of a txtai or transformers pipeline, 0 if unknown.
+    """
+    # txtai pipelines wrap a transformers pipeline, that wraps a torch module
+    module = getattr(getattr(model, 'pipeline', model), 'model', None)
+    if module is None or not hasattr(module, 'parameters'):
+        return 0
+    tensors = itertools.chain(module.parameters(), module.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+def _release_memory():
+    gc.collect()
+    try:
+        import torch
+    except ImportError:
+        return
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+# Registry shared by all the tasks of the process
+models = ModelRegistry(int(os.environ.get('MODELS_MAX_MEMORY_MB', '8192')) * 1024 ** 2)
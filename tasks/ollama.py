@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class OllamaClient:
+    """
+    Client of the Ollama generate API, shared by the tasks of the process.
+
+    Requests go through a pooled HTTP session, so connections are kept alive and
+    reused. At most `concurrency` requests are sent at the same time, by the
+    threads of the client's executor (see `submit`) or by the callers.
+    """
+
+    def __init__(self, url, model, concurrency=4, timeout=300):
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='ollama')
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def generate(self, prompt):
+        """
+        Generate the whole answer to a prompt.
+        """
+        return ''.join(self.stream(prompt))
+
+    def stream(self, prompt):
+        """
+        Generate the answer to a prompt, yielding its tokens as they are generated.
+        """
+        request = {
+            'model': self.model,
+            'prompt': prompt,
+            'stream': True,
+        }
+        with self._slots:
+            with self._session.post(
+                f'{self.url}/api/generate', json=request, stream=True, timeout=self.timeout
+            ) as response:
+                response.raise_for_status()
+                # One JSON object per line, the last one has "done" set
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if 'error' in chunk:
+                        raise RuntimeError(f"Ollama error: {chunk['error']}")
+                    if chunk.get('response'):
+                        yield chunk['response']
+                    if chunk.get('done'):
+                        return
+
+    def submit(self, function, *args):
+        """
+        Run a function using the client (i.e. `generate`) in the client's executor.
+        """
+        return self.executor.submit(function, *args)
+
+
+class TranslationCache:
+    """
+    In-memory LRU cache of translations, keyed by model, languages and text hash.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model, source, target, text):
+        return model, source, target, hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            translation = self._entries.get(key)
+            if translation is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return translation
+
+    def put(self, key, translation):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = translation
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Ollama client of the process, configured from the environment.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            ollama_url = os.environ.get("OLLAMA_URL", "http://ollama")
+            ollama_port = os.environ.get("OLLAMA_PORT", "11434")
+            _client = OllamaClient(
+                f"{ollama_url}:{ollama_port}",
+                os.environ.get('MODEL_NAME'),
+                concurrency=int(os.environ.get('OLLAMA_CONCURRENCY', '4')),
+                timeout=float(os.environ.get('OLLAMA_TIMEOUT', '300')),
+            )
+        return _client
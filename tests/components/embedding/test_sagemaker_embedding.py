@@ -0,0 +1,122 @@
+import random
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from private_gpt.components.embedding.custom import sagemaker
+from private_gpt.components.embedding.custom.sagemaker import SagemakerEmbedding
+
+
+def client_error(status: int, code: str) -> ClientError:
+    return ClientError(
+        {
+            "Error": {"Code": code, "Message": code},
+            "ResponseMetadata": {"HTTPStatusCode": status},
+        },
+        "InvokeEndpoint",
+    )
+
+
+class StubEndpoint:
+    """Stand-in of `SagemakerEmbedding._invoke`, failing the first calls."""
+
+    def __init__(self, errors: list[Exception] | None = None, max_size: int = 0):
+        self.errors = list(errors or [])
+        self.max_size = max_size
+        self.calls: list[list[str]] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, sentences: list[str]) -> list[list[float]]:
+        with self._lock:
+            self.calls.append(sentences)
+            error = self.errors.pop(0) if self.errors else None
+        if error is not None:
+            raise error
+        if self.max_size and len(sentences) > self.max_size:
+            raise client_error(400, "ValidationError")
+        # Batches finish out of order
+        time.sleep(random.random() / 100)
+        return [[float(sentence.split()[-1])] for sentence in sentences]
+
+
+@pytest.fixture()
+def endpoint(monkeypatch: pytest.MonkeyPatch) -> StubEndpoint:
+    stub = StubEndpoint()
+    monkeypatch.setattr(
+        SagemakerEmbedding, "_invoke", lambda self, sentences: stub(sentences)
+    )
+    monkeypatch.setattr(sagemaker.time, "sleep", lambda delay: None)
+    return stub
+
+
+def test_batches_respect_the_limits_in_order() -> None:
+    embedding = SagemakerEmbedding(
+        endpoint_name="test",
+        max_batch_size=3,
+        max_batch_tokens=20,
+        max_payload_bytes=200,
+    )
+    texts = ["a" * 8] * 5 + ["b" * 60, "c" * 150, "d" * 8]
+    batches = embedding._batches(texts)
+
+    assert [text for batch in batches for text in batch] == texts
+    # Max size, max tokens, and a text over the limits alone in its batch
+    assert [len(batch) for batch in batches] == [3, 2, 1, 1, 1]
+
+    # Texts of 12 bytes in the request, after 32 bytes around them
+    embedding = SagemakerEmbedding(endpoint_name="test", max_payload_bytes=60)
+    assert [len(batch) for batch in embedding._batches(["a" * 8] * 5)] == [2, 2, 1]
+
+
+def test_embeddings_are_reassembled_in_order(endpoint: StubEndpoint) -> None:
+    embedding = SagemakerEmbedding(endpoint_name="test", max_batch_size=3)
+    texts = [f"text {number}" for number in range(20)]
+
+    vectors = embedding.get_text_embedding_batch(texts)
+
+    assert vectors == [[float(number)] for number in range(20)]
+    assert len(endpoint.calls) == 7
+
+
+def test_failed_and_throttled_batches_are_retried(endpoint: StubEndpoint) -> None:
+    endpoint.errors = [
+        client_error(500, "InternalFailure"),
+        client_error(429, "ThrottlingException"),
+    ]
+    embedding = SagemakerEmbedding(endpoint_name="test", max_retries=2)
+
+    assert embedding.get_text_embedding_batch(["text 1", "text 2"]) == [[1.0], [2.0]]
+    # Retried as a whole, not split
+    assert endpoint.calls == [["text 1", "text 2"]] * 3
+
+
+def test_batches_still_failing_are_not_split(endpoint: StubEndpoint) -> None:
+    endpoint.errors = [client_error(429, "ThrottlingException")] * 3
+    embedding = SagemakerEmbedding(endpoint_name="test", max_retries=2)
+
+    with pytest.raises(ClientError):
+        embedding.get_text_embedding_batch(["text 1", "text 2"])
+    assert len(endpoint.calls) == 3
+
+
+def test_rejected_batches_are_not_retried(endpoint: StubEndpoint) -> None:
+    endpoint.errors = [client_error(403, "AccessDeniedException")]
+    embedding = SagemakerEmbedding(endpoint_name="test", max_retries=2)
+
+    with pytest.raises(ClientError):
+        embedding.get_text_embedding_batch(["text 1", "text 2"])
+    assert len(endpoint.calls) == 1
+
+
+def test_too_large_batches_are_split(endpoint: StubEndpoint) -> None:
+    endpoint.max_size = 2
+    embedding = SagemakerEmbedding(endpoint_name="test", max_batch_size=5)
+    texts = [f"text {number}" for number in range(10)]
+
+    assert embedding.get_text_embedding_batch(texts) == [
+        [float(number)] for number in range(10)
+    ]
+    # Each batch of 5 is split in 2 and 3, then 3 in 1 and 2
+    assert sorted(len(call) for call in endpoint.calls) == sorted([5, 2, 3, 1, 2] * 2)
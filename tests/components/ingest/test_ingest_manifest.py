@@ -0,0 +1,36 @@
+from llama_index.storage.kvstore import SimpleKVStore
+
+from private_gpt.components.ingest.ingest_manifest import IngestedFile, IngestManifest
+
+
+def ingested_file(doc_ids: list[str]) -> IngestedFile:
+    return IngestedFile(
+        file_name="test.txt", file_hash="hash", embed_model="mock", doc_ids=doc_ids
+    )
+
+
+def test_manifest_finds_the_file_of_a_document() -> None:
+    manifest = IngestManifest(SimpleKVStore())
+    manifest.put("source", ingested_file(["doc-1", "doc-2"]))
+    assert manifest.find_doc("doc-2") == ingested_file(["doc-1", "doc-2"])
+
+    # Documents of the previous version of the file are not found anymore
+    manifest.put("source", ingested_file(["doc-3"]))
+    assert manifest.find_doc("doc-1") is None
+    assert manifest.find_doc("doc-3") == ingested_file(["doc-3"])
+
+    manifest.forget_doc("doc-3")
+    assert manifest.find_doc("doc-3") is None
+    forgotten = manifest.get("source")
+    assert forgotten is not None
+    assert forgotten.doc_ids == []
+    assert forgotten.file_hash is None
+
+
+def test_manifest_indexes_the_documents_of_older_manifests() -> None:
+    kvstore = SimpleKVStore()
+    kvstore.put(
+        "source", ingested_file(["doc-1"]).model_dump(), collection="ingest_manifest"
+    )
+    manifest = IngestManifest(kvstore)
+    assert manifest.find_doc("doc-1") == ingested_file(["doc-1"])
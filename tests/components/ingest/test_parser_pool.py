@@ -0,0 +1,53 @@
+import os
+import time
+from collections.abc import Iterator
+
+import pytest
+from llama_index import Document
+
+from private_gpt.components.ingest.parser_pool import ParserPool
+
+
+def parse_text(file_name: str, file_data: str) -> list[Document]:
+    # Runs in the parser processes, as any module level function
+    if file_name == "hang.txt":
+        time.sleep(60)
+    elif file_name == "crash.txt":
+        os._exit(1)
+    elif file_name == "invalid.txt":
+        raise ValueError("Invalid file")
+    return [Document(text=file_data, metadata={"file_name": file_name})]
+
+
+@pytest.fixture()
+def parser_pool() -> Iterator[ParserPool]:
+    pool = ParserPool(workers=2, timeout=2, parse_file=parse_text)
+    yield pool
+    pool.close()
+
+
+def test_parser_pool_parses_files(parser_pool: ParserPool) -> None:
+    documents = parser_pool.parse("test.txt", "Foo bar")
+    assert [document.text for document in documents] == ["Foo bar"]
+
+
+def test_parser_pool_reports_parsing_errors(parser_pool: ParserPool) -> None:
+    with pytest.raises(ValueError, match="Invalid file"):
+        parser_pool.parse("invalid.txt", "Foo bar")
+    assert parser_pool.parse("test.txt", "Foo bar")[0].text == "Foo bar"
+
+
+def test_parser_pool_kills_hanging_parsers(parser_pool: ParserPool) -> None:
+    parser_pool.parse("test.txt", "warm up")
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        parser_pool.parse("hang.txt", "Foo bar")
+    assert time.monotonic() - start < 10
+    # The other files are still parsed, by a new process
+    assert parser_pool.parse("test.txt", "Foo bar")[0].text == "Foo bar"
+
+
+def test_parser_pool_survives_crashing_parsers(parser_pool: ParserPool) -> None:
+    with pytest.raises(RuntimeError, match="crashed"):
+        parser_pool.parse("crash.txt", "Foo bar")
+    assert parser_pool.parse("test.txt", "Foo bar")[0].text == "Foo bar"
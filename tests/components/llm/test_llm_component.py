@@ -0,0 +1,54 @@
+import sys
+from types import ModuleType
+from typing import Any
+from unittest.mock import MagicMock
+
+import llama_index.llms
+import pytest
+
+from private_gpt.components.llm.llm_component import LLMComponent
+from tests.fixtures.mock_injector import MockInjector
+
+
+class FakeLlamaRAMCache:
+    def __init__(self, capacity_bytes: int) -> None:
+        self.capacity_bytes = capacity_bytes
+
+
+class FakeLlamaCPP:
+    # Stand-in of the llama_index LLM, without loading any model
+    def __init__(self, **kwargs: Any) -> None:
+        self._model = MagicMock()
+
+
+@pytest.fixture()
+def fake_llama_cpp(monkeypatch: pytest.MonkeyPatch) -> None:
+    llama_cpp = ModuleType("llama_cpp")
+    llama_cpp.LlamaRAMCache = FakeLlamaRAMCache  # type: ignore[attr-defined]
+    monkeypatch.setitem(sys.modules, "llama_cpp", llama_cpp)
+    monkeypatch.setattr(llama_index.llms, "LlamaCPP", FakeLlamaCPP)
+
+
+@pytest.mark.usefixtures("fake_llama_cpp")
+def test_local_llm_caches_prompt_states(injector: MockInjector) -> None:
+    settings = injector.bind_settings(
+        {
+            "llm": {"mode": "local"},
+            "local": {"prompt_cache_enabled": True, "prompt_cache_max_size_mb": 16},
+        }
+    )
+    llm = LLMComponent(settings).llm
+
+    (cache,) = llm._model.set_cache.call_args.args  # type: ignore[attr-defined]
+    assert isinstance(cache, FakeLlamaRAMCache)
+    assert cache.capacity_bytes == 16 * 1024 * 1024
+
+
+@pytest.mark.usefixtures("fake_llama_cpp")
+def test_local_llm_prompt_cache_is_disabled_by_default(
+    injector: MockInjector,
+) -> None:
+    settings = injector.bind_settings({"llm": {"mode": "local"}})
+    llm = LLMComponent(settings).llm
+
+    llm._model.set_cache.assert_not_called()  # type: ignore[attr-defined]
@@ -0,0 +1,72 @@
+import json
+from collections.abc import Iterator
+
+from private_gpt.components.llm.custom.sagemaker import LineIterator, TGIEventIterator
+
+
+def events(data: bytes, size: int) -> Iterator[dict[str, dict[str, bytes]]]:
+    """Event stream of the endpoint, sending `data` in parts of `size` bytes."""
+    for start in range(0, len(data), size):
+        yield {"PayloadPart": {"Bytes": data[start : start + size]}}
+
+
+def tgi_stream(texts: list[str]) -> bytes:
+    return b"".join(
+        b"data:" + json.dumps({"token": {"text": text}}).encode("utf-8") + b"\n\n"
+        for text in texts
+    )
+
+
+def test_lines_are_returned_whatever_the_events_they_are_split_in() -> None:
+    data = b"first line\nsecond\n\nlast line without end"
+    for size in (1, 3, 7, len(data)):
+        assert list(LineIterator(events(data, size))) == [
+            b"first line",
+            b"second",
+            b"",
+            b"last line without end",
+        ]
+
+
+def test_unknown_events_are_skipped() -> None:
+    stream = [
+        {"PayloadPart": {"Bytes": b"a\n"}},
+        {"Other": {}},
+        {"PayloadPart": {"Bytes": b"b"}},
+    ]
+    assert list(LineIterator(stream)) == [b"a", b"b"]
+
+
+def test_tgi_events_split_across_parts_are_decoded() -> None:
+    # Multi-byte characters are split across parts with most sizes
+    texts = [" a", " défi", " 難しい", " problème 🚀"]
+    data = tgi_stream(texts)
+    for size in (1, 2, 5, 13, len(data)):
+        tokens = [
+            event["token"]["text"] for event in TGIEventIterator(events(data, size))
+        ]
+        assert tokens == texts
+
+
+def test_tgi_last_event_without_end_of_line_is_decoded() -> None:
+    data = tgi_stream([" a"]) + b'data:{"token": {"text": " b"}}'
+    tokens = [event["token"]["text"] for event in TGIEventIterator(events(data, 4))]
+    assert tokens == [" a", " b"]
+
+
+def test_buffer_is_bounded_by_the_longest_line() -> None:
+    texts = [f" token {number}" for number in range(5000)] + [" x" * 200]
+    data = tgi_stream(texts)
+    longest_line = max(len(line) for line in data.split(b"\n"))
+    size = 7
+    iterator = TGIEventIterator(events(data, size))
+
+    max_buffer = 0
+    tokens = []
+    for event in iterator:
+        tokens.append(event["token"]["text"])
+        max_buffer = max(max_buffer, len(iterator.buffer))
+
+    assert tokens == texts
+    # Lines read are dropped from the buffer, it doesn't grow with the stream
+    assert max_buffer <= 2 * (longest_line + 1) + size
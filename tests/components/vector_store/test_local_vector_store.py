@@ -0,0 +1,42 @@
+from pathlib import Path
+
+from llama_index.schema import NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.vector_stores.types import VectorStoreQuery
+
+from private_gpt.components.vector_store.local_vector_store import LocalVectorStore
+
+
+def make_node(node_id: str, doc_id: str, embedding: list[float]) -> TextNode:
+    return TextNode(
+        id_=node_id,
+        text=node_id,
+        embedding=embedding,
+        relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=doc_id)},
+    )
+
+
+def test_query_skips_rows_reused_since_its_snapshot(tmp_path: Path) -> None:
+    store = LocalVectorStore(tmp_path)
+    store.add(
+        [make_node("a1", "doc-a", [1.0, 0.0]), make_node("a2", "doc-a", [0.0, 1.0])]
+    )
+    snapshot = store._snapshot
+
+    # The rows of doc-a are reused by doc-b while a query reads the old snapshot
+    store.delete("doc-a")
+    store.add(
+        [make_node("b1", "doc-b", [1.0, 0.0]), make_node("b2", "doc-b", [0.0, 1.0])]
+    )
+    store._snapshot = snapshot
+
+    result = store.query(
+        VectorStoreQuery(
+            query_embedding=[1.0, 0.0], similarity_top_k=2, doc_ids=["doc-a"]
+        )
+    )
+    assert result.ids == []
+    result = store.query(
+        VectorStoreQuery(query_embedding=[1.0, 0.0], similarity_top_k=2)
+    )
+    assert result.ids == []
+    store.close()
@@ -10,10 +10,28 @@ class IngestHelper:
     def __init__(self, test_client: TestClient):
         self.test_client = test_client
 
-    def ingest_file(self, path: Path) -> IngestResponse:
+    def ingest_file(
+        self,
+        path: Path,
+        collection: str | None = None,
+        source_id: str | None = None,
+    ) -> IngestResponse:
         files = {"file": (path.name, path.open("rb"))}
+        params = {"collection": collection, "source_id": source_id}
 
-        response = self.test_client.post("/v1/ingest", files=files)
+        response = self.test_client.post(
+            "/v1/ingest",
+            files=files,
+            params={key: value for key, value in params.items() if value is not None},
+        )
+        assert response.status_code == 200
+        ingest_result = IngestResponse.model_validate(response.json())
+        return ingest_result
+
+    def ingest_files(self, paths: list[Path]) -> IngestResponse:
+        files = [("files", (path.name, path.open("rb"))) for path in paths]
+
+        response = self.test_client.post("/v1/ingest/bulk", files=files)
         assert response.status_code == 200
         ingest_result = IngestResponse.model_validate(response.json())
         return ingest_result
@@ -1,7 +1,14 @@
+import asyncio
+from pathlib import Path
+
+import httpx
+import pytest
 from fastapi.testclient import TestClient
 
 from private_gpt.open_ai.openai_models import OpenAICompletion, OpenAIMessage
 from private_gpt.server.chat.chat_router import ChatBody
+from private_gpt.server.chat.response_cache import ResponseCacheStats
+from tests.fixtures.ingest_helper import IngestHelper
 
 
 def test_chat_route_produces_a_stream(test_client: TestClient) -> None:
@@ -33,3 +40,93 @@ def test_chat_route_produces_a_single_value(test_client: TestClient) -> None:
     # No asserts, if it validates it's good
     OpenAICompletion.model_validate(response.json())
     assert response.status_code == 200
+
+
+def test_chat_route_streams_the_context_sources(
+    test_client: TestClient, ingest_helper: IngestHelper
+) -> None:
+    path = Path(__file__).parents[1] / "chunks" / "chunk_test.txt"
+    ingest_helper.ingest_file(path)
+    body = ChatBody(
+        messages=[OpenAIMessage(content="test", role="user")],
+        use_context=True,
+        stream=True,
+    )
+    response = test_client.post("/v1/chat/completions", json=body.model_dump())
+
+    raw_events = response.text.split("\n\n")
+    events = [
+        item.removeprefix("data: ") for item in raw_events if item.startswith("data: ")
+    ]
+    assert response.status_code == 200
+    assert events[-1] == "[DONE]"
+    first_chunk = OpenAICompletion.model_validate_json(events[0])
+    assert first_chunk.choices[0].sources
+
+
+def test_chat_route_serves_concurrent_streams(test_client: TestClient) -> None:
+    body = ChatBody(
+        messages=[OpenAIMessage(content="test", role="user")],
+        use_context=False,
+        stream=True,
+    )
+
+    async def stream_chats(count: int) -> list[httpx.Response]:
+        async with httpx.AsyncClient(
+            app=test_client.app, base_url="http://test"
+        ) as client:
+            return await asyncio.gather(
+                *(
+                    client.post("/v1/chat/completions", json=body.model_dump())
+                    for _ in range(count)
+                )
+            )
+
+    responses = asyncio.run(stream_chats(50))
+    assert all(response.status_code == 200 for response in responses)
+    assert all(response.text.endswith("data: [DONE]\n\n") for response in responses)
+
+
+@pytest.mark.parametrize(
+    "test_client", [{"response_cache": {"enabled": True}}], indirect=True
+)
+def test_chat_route_replays_cached_responses(
+    test_client: TestClient, ingest_helper: IngestHelper
+) -> None:
+    def chat(content: str, stream: bool) -> str:
+        body = ChatBody(
+            messages=[OpenAIMessage(content=content, role="user")],
+            use_context=True,
+            stream=stream,
+        )
+        response = test_client.post("/v1/chat/completions", json=body.model_dump())
+        assert response.status_code == 200
+        return response.text
+
+    def cache_stats() -> ResponseCacheStats:
+        return ResponseCacheStats.model_validate(
+            test_client.get("/v1/chat/cache").json()
+        )
+
+    path = Path(__file__).parents[1] / "chunks" / "chunk_test.txt"
+    ingest_result = ingest_helper.ingest_file(path)
+    chat("How do you fry an egg?", stream=True)
+    chat("How do you fry an egg?", stream=False)
+    streamed = chat("how do you  fry an EGG?", stream=True)
+    stats = cache_stats()
+    assert stats.enabled
+    assert (stats.exact_hits, stats.misses) == (2, 1)
+    assert stats.hit_rate == 2 / 3
+
+    events = [
+        item.removeprefix("data: ")
+        for item in streamed.split("\n\n")
+        if item.startswith("data: ")
+    ]
+    assert events[-1] == "[DONE]"
+    assert OpenAICompletion.model_validate_json(events[0]).choices[0].sources
+
+    # Deleting documents changes the context, the cached responses are not used
+    test_client.delete(f"/v1/ingest/{ingest_result.data[0].doc_id}")
+    chat("How do you fry an egg?", stream=False)
+    assert cache_stats().misses == 2
@@ -1,9 +1,20 @@
+import asyncio
+import uuid
 from pathlib import Path
 
+import httpx
+import pytest
 from fastapi.testclient import TestClient
 
+from private_gpt.components.embedding.embedding_component import EmbeddingComponent
+from private_gpt.components.embedding.query_embedding_batcher import (
+    BatchedQueryEmbedding,
+)
+from private_gpt.components.retrieval.retrieval_component import RetrievalComponent
+from private_gpt.open_ai.extensions.context_filter import ContextFilter
 from private_gpt.server.chunks.chunks_router import ChunksBody, ChunksResponse
 from tests.fixtures.ingest_helper import IngestHelper
+from tests.fixtures.mock_injector import MockInjector
 
 
 def test_chunks_retrieval(test_client: TestClient, ingest_helper: IngestHelper) -> None:
@@ -16,3 +27,131 @@ def test_chunks_retrieval(test_client: TestClient, ingest_helper: IngestHelper)
     assert response.status_code == 200
     chunk_response = ChunksResponse.model_validate(response.json())
     assert len(chunk_response.data) > 0
+
+
+def test_chunks_retrieval_reuses_retrievers_until_ingestion(
+    test_client: TestClient,
+    ingest_helper: IngestHelper,
+    injector: MockInjector,
+    tmp_path: Path,
+) -> None:
+    retrieval_component = injector.get(RetrievalComponent)
+    path = tmp_path / f"{uuid.uuid4()}.txt"
+    path.write_text(f"Chunk of a document {uuid.uuid4()}")
+    doc_id = ingest_helper.ingest_file(path).data[0].doc_id
+
+    body = ChunksBody(
+        text="document", context_filter=ContextFilter(docs_ids=[doc_id]), limit=4
+    )
+    first = test_client.post("/v1/chunks", json=body.model_dump())
+    retriever = retrieval_component.get_retriever(
+        context_filter=body.context_filter, similarity_top_k=4
+    )
+    second = test_client.post("/v1/chunks", json=body.model_dump())
+    assert (
+        retrieval_component.get_retriever(
+            context_filter=body.context_filter, similarity_top_k=4
+        )
+        is retriever
+    )
+    assert first.json() == second.json()
+    chunks = ChunksResponse.model_validate(second.json()).data
+    assert {chunk.document.doc_id for chunk in chunks} == {doc_id}
+
+    # Ingesting a new file invalidates the cached retrievers
+    path.write_text(f"Chunk of another document {uuid.uuid4()}")
+    ingest_helper.ingest_file(path)
+    assert (
+        retrieval_component.get_retriever(
+            context_filter=body.context_filter, similarity_top_k=4
+        )
+        is not retriever
+    )
+
+
+def test_chunks_retrieval_returns_previous_and_next_chunks(
+    test_client: TestClient, ingest_helper: IngestHelper, tmp_path: Path
+) -> None:
+    marker = uuid.uuid4()
+    path = tmp_path / f"{marker}.txt"
+    path.write_text(" ".join(f"Sentence {i} of {marker}." for i in range(8)))
+    doc_id = ingest_helper.ingest_file(path).data[0].doc_id
+
+    body = ChunksBody(
+        text="sentence",
+        context_filter=ContextFilter(docs_ids=[doc_id]),
+        limit=8,
+        prev_next_chunks=3,
+    )
+    response = test_client.post("/v1/chunks", json=body.model_dump())
+    assert response.status_code == 200
+    chunks = ChunksResponse.model_validate(response.json()).data
+    assert len(chunks) == 8
+    for chunk in chunks:
+        position = int(chunk.text.split()[1])
+        previous_positions = range(position - 1, max(position - 4, -1), -1)
+        next_positions = range(position + 1, min(position + 4, 8))
+        assert chunk.previous_texts is not None
+        assert chunk.next_texts is not None
+        assert [text.strip() for text in chunk.previous_texts] == [
+            f"Sentence {i} of {marker}." for i in previous_positions
+        ]
+        assert [text.strip() for text in chunk.next_texts] == [
+            f"Sentence {i} of {marker}." for i in next_positions
+        ]
+
+
+@pytest.mark.parametrize(
+    "test_client",
+    [{"embedding": {"query_batch_enabled": True, "query_batch_max_latency_ms": 200}}],
+    indirect=True,
+)
+def test_chunks_retrieval_batches_concurrent_query_embeddings(
+    test_client: TestClient, injector: MockInjector
+) -> None:
+    embedding_model = injector.get(EmbeddingComponent).embedding_model
+    while not isinstance(embedding_model, BatchedQueryEmbedding):
+        embedding_model = embedding_model.embed_model  # type: ignore[attr-defined]
+    batch_sizes = embedding_model.batcher.batch_sizes
+
+    async def retrieve_chunks(count: int) -> list[httpx.Response]:
+        async with httpx.AsyncClient(
+            app=test_client.app, base_url="http://test"
+        ) as client:
+            return await asyncio.gather(
+                *(
+                    client.post(
+                        "/v1/chunks",
+                        json=ChunksBody(text=f"query {uuid.uuid4()}").model_dump(),
+                    )
+                    for _ in range(count)
+                )
+            )
+
+    responses = asyncio.run(retrieve_chunks(20))
+    assert all(response.status_code == 200 for response in responses)
+    assert sum(size * count for size, count in batch_sizes.items()) == 20
+    assert batch_sizes.total() < 20
+
+
+@pytest.mark.parametrize(
+    "test_client", [{"vectorstore": {"database": "local"}}], indirect=True
+)
+def test_chunks_retrieval_with_local_vectorstore(
+    test_client: TestClient, ingest_helper: IngestHelper, tmp_path: Path
+) -> None:
+    path = tmp_path / f"{uuid.uuid4()}.txt"
+    path.write_text(f"Chunk of a document {uuid.uuid4()}")
+    doc_id = ingest_helper.ingest_file(path).data[0].doc_id
+
+    body = ChunksBody(
+        text="document", context_filter=ContextFilter(docs_ids=[doc_id]), limit=4
+    )
+    response = test_client.post("/v1/chunks", json=body.model_dump())
+    assert response.status_code == 200
+    chunks = ChunksResponse.model_validate(response.json()).data
+    assert {chunk.document.doc_id for chunk in chunks} == {doc_id}
+
+    test_client.delete(f"/v1/ingest/{doc_id}")
+    response = test_client.post("/v1/chunks", json=body.model_dump())
+    assert ChunksResponse.model_validate(response.json()).data == []
@@ -1,9 +1,18 @@
+import base64
+import uuid
+
+import numpy as np
+import pytest
 from fastapi.testclient import TestClient
 
+from private_gpt.components.embedding.embedding_cache import CachedEmbedding
+from private_gpt.components.embedding.embedding_component import EmbeddingComponent
 from private_gpt.server.embeddings.embeddings_router import (
     EmbeddingsBody,
     EmbeddingsResponse,
 )
+from private_gpt.server.embeddings.embeddings_service import Embedding
+from tests.fixtures.mock_injector import MockInjector
 
 
 def test_embeddings_generation(test_client: TestClient) -> None:
@@ -14,3 +23,66 @@ def test_embeddings_generation(test_client: TestClient) -> None:
     embedding_response = EmbeddingsResponse.model_validate(response.json())
     assert len(embedding_response.data) > 0
     assert len(embedding_response.data[0].embedding) > 0
+
+
+@pytest.mark.parametrize(
+    "test_client", [{"embedding": {"cache_enabled": True}}], indirect=True
+)
+def test_embeddings_generation_reuses_cached_embeddings(
+    test_client: TestClient, injector: MockInjector
+) -> None:
+    embedding_model = injector.get(EmbeddingComponent).embedding_model
+    assert isinstance(embedding_model, CachedEmbedding)
+    text = f"Embed me once {uuid.uuid4()}"
+    cache = embedding_model.cache
+
+    misses_before = cache.misses
+    first = test_client.post("/v1/embeddings", json={"input": [text, text]})
+    assert cache.misses > misses_before
+
+    hits_before, misses_before = cache.hits, cache.misses
+    second = test_client.post("/v1/embeddings", json={"input": [text, text]})
+    assert cache.misses == misses_before
+    assert cache.hits > hits_before
+    assert second.json()["data"] == first.json()["data"]
+
+
+def test_embeddings_generation_keeps_the_index_of_repeated_inputs(
+    test_client: TestClient,
+) -> None:
+    texts = ["Embed me", "Embed me too", "Embed me"]
+    response = test_client.post("/v1/embeddings", json={"input": texts})
+
+    embeddings = EmbeddingsResponse.model_validate(response.json()).data
+    assert [embedding.index for embedding in embeddings] == [0, 1, 2]
+    assert embeddings[0].embedding == embeddings[2].embedding
+
+
+def test_embeddings_generation_encodes_in_base64(test_client: TestClient) -> None:
+    texts = ["Embed me", "Embed me too"]
+    floats = test_client.post("/v1/embeddings", json={"input": texts}).json()
+    encoded = test_client.post(
+        "/v1/embeddings", json={"input": texts, "encoding_format": "base64"}
+    ).json()
+
+    for float_embedding, base64_embedding in zip(
+        floats["data"], encoded["data"], strict=True
+    ):
+        assert isinstance(base64_embedding["embedding"], str)
+        decoded = np.frombuffer(
+            base64.b64decode(base64_embedding["embedding"]), dtype="<f4"
+        )
+        assert decoded == pytest.approx(float_embedding["embedding"])
+
+
+def test_embeddings_generation_streams_ndjson(test_client: TestClient) -> None:
+    texts = [f"Embed me {i}" for i in range(25)]
+    response = test_client.post("/v1/embeddings", json={"input": texts, "stream": True})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    embeddings = [
+        Embedding.model_validate_json(line) for line in response.text.splitlines()
+    ]
+    assert [embedding.index for embedding in embeddings] == list(range(25))
+    assert all(len(embedding.embedding) > 0 for embedding in embeddings)
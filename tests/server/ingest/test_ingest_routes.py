@@ -1,6 +1,8 @@
 import tempfile
+import uuid
 from pathlib import Path
 
+import pytest
 from fastapi.testclient import TestClient
 
 from tests.fixtures.ingest_helper import IngestHelper
@@ -18,13 +20,27 @@ def test_ingest_accepts_pdf_files(ingest_helper: IngestHelper) -> None:
     assert len(ingest_result.data) == 1
 
 
+def test_ingest_bulk_accepts_many_files(ingest_helper: IngestHelper) -> None:
+    paths = [
+        Path(__file__).parents[0] / "test.txt",
+        Path(__file__).parents[0] / "test.pdf",
+    ]
+    ingest_result = ingest_helper.ingest_files(paths)
+    assert len(ingest_result.data) == 2
+    assert {doc.doc_metadata["file_name"] for doc in ingest_result.data} == {
+        "test.txt",
+        "test.pdf",
+    }
+
+
 def test_ingest_list_returns_something_after_ingestion(
     test_client: TestClient, ingest_helper: IngestHelper
 ) -> None:
     response_before = test_client.get("/v1/ingest/list")
     count_ingest_before = len(response_before.json()["data"])
     with tempfile.NamedTemporaryFile("w", suffix=".txt") as test_file:
-        test_file.write("Foo bar; hello there!")
+        # Uploads are identified by their content, it must not be ingested yet
+        test_file.write(f"Foo bar; hello there! {uuid.uuid4()}")
         test_file.flush()
         test_file.seek(0)
         ingest_result = ingest_helper.ingest_file(Path(test_file.name))
@@ -34,3 +50,126 @@ def test_ingest_list_returns_something_after_ingestion(
     assert (
         count_ingest_after == count_ingest_before + 1
     ), "The temp doc should be returned"
+
+
+@pytest.mark.parametrize(
+    "test_client", [{"nodestore": {"database": "sqlite"}}], indirect=True
+)
+def test_ingest_list_with_sqlite_nodestore(
+    test_client: TestClient, ingest_helper: IngestHelper
+) -> None:
+    path = Path(__file__).parents[0] / "test.txt"
+    ingest_result = ingest_helper.ingest_file(path)
+    assert len(ingest_result.data) == 1
+
+    response = test_client.get("/v1/ingest/list")
+    ingested_ids = [doc["doc_id"] for doc in response.json()["data"]]
+    assert ingest_result.data[0].doc_id in ingested_ids
+
+
+@pytest.mark.parametrize(
+    "test_client", [{"ingestion": {"parse_workers": 2}}], indirect=True
+)
+def test_ingest_with_parser_processes(
+    test_client: TestClient, ingest_helper: IngestHelper
+) -> None:
+    paths = [
+        Path(__file__).parents[0] / "test.txt",
+        Path(__file__).parents[0] / "test.pdf",
+    ]
+    ingest_result = ingest_helper.ingest_file(paths[1])
+    assert len(ingest_result.data) == 1
+
+    ingest_result = ingest_helper.ingest_files(paths)
+    assert len(ingest_result.data) == 2
+
+
+def test_ingest_skips_unchanged_and_replaces_modified_files(
+    test_client: TestClient, ingest_helper: IngestHelper, tmp_path: Path
+) -> None:
+    test_file = tmp_path / f"{uuid.uuid4()}.txt"
+    source_id = str(test_file)
+    test_file.write_text("Foo bar; hello there!")
+    first_result = ingest_helper.ingest_file(test_file, source_id=source_id)
+    first_doc_ids = {doc.doc_id for doc in first_result.data}
+
+    unchanged_result = ingest_helper.ingest_file(test_file, source_id=source_id)
+    assert {doc.doc_id for doc in unchanged_result.data} == first_doc_ids
+
+    test_file.write_text("Foo bar; hello there! And general Kenobi.")
+    modified_result = ingest_helper.ingest_file(test_file, source_id=source_id)
+    modified_doc_ids = {doc.doc_id for doc in modified_result.data}
+    assert modified_doc_ids.isdisjoint(first_doc_ids)
+
+    response = test_client.get("/v1/ingest/list")
+    ingested_doc_ids = {doc["doc_id"] for doc in response.json()["data"]}
+    assert modified_doc_ids <= ingested_doc_ids
+    assert ingested_doc_ids.isdisjoint(first_doc_ids)
+
+
+def test_ingest_keeps_different_uploads_with_the_same_name(
+    test_client: TestClient, ingest_helper: IngestHelper, tmp_path: Path
+) -> None:
+    doc_ids = set()
+    for content in (f"First report {uuid.uuid4()}", f"Second report {uuid.uuid4()}"):
+        (tmp_path / "report.txt").write_text(content)
+        ingest_result = ingest_helper.ingest_file(tmp_path / "report.txt")
+        doc_ids.update(doc.doc_id for doc in ingest_result.data)
+    assert len(doc_ids) == 2
+
+    response = test_client.get("/v1/ingest/list")
+    assert doc_ids <= {doc["doc_id"] for doc in response.json()["data"]}
+
+
+def test_ingest_bulk_ingests_duplicated_files_once(
+    test_client: TestClient, ingest_helper: IngestHelper, tmp_path: Path
+) -> None:
+    path = tmp_path / f"{uuid.uuid4()}.txt"
+    path.write_text(f"Duplicated report {uuid.uuid4()}")
+    ingest_result = ingest_helper.ingest_files([path, path])
+    assert len(ingest_result.data) == 1
+
+    response = test_client.get("/v1/ingest/list")
+    assert ingest_result.data[0].doc_id in {
+        doc["doc_id"] for doc in response.json()["data"]
+    }
+
+
+def test_ingest_in_collections_isolates_their_documents(
+    test_client: TestClient, ingest_helper: IngestHelper, tmp_path: Path
+) -> None:
+    collection = f"tenant-{uuid.uuid4().hex}"
+    path = tmp_path / f"{uuid.uuid4()}.txt"
+    path.write_text(f"Document of a tenant {uuid.uuid4()}")
+    doc_id = ingest_helper.ingest_file(path, collection=collection).data[0].doc_id
+
+    def listed(params: dict[str, str] | None = None) -> list[str]:
+        response = test_client.get("/v1/ingest/list", params=params)
+        return [doc["doc_id"] for doc in response.json()["data"]]
+
+    def retrieved(context_filter: dict[str, str] | None) -> set[str]:
+        response = test_client.post(
+            "/v1/chunks",
+            json={"text": "tenant", "context_filter": context_filter, "limit": 100},
+        )
+        assert response.status_code == 200
+        return {chunk["document"]["doc_id"] for chunk in response.json()["data"]}
+
+    assert listed({"collection": collection}) == [doc_id]
+    assert doc_id not in listed()
+    assert retrieved({"collection": collection}) == {doc_id}
+    assert doc_id not in retrieved(None)
+
+    test_client.delete(f"/v1/ingest/{doc_id}")
+    assert listed({"collection": collection}) == []
+    assert retrieved({"collection": collection}) == set()
+
+
+def test_ingest_rejects_invalid_collection_names(test_client: TestClient) -> None:
+    path = Path(__file__).parents[0] / "test.txt"
+    response = test_client.post(
+        "/v1/ingest",
+        files={"file": (path.name, path.open("rb"))},
+        params={"collection": "../tenant"},
+    )
+    assert response.status_code == 422
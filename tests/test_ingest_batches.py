@@ -0,0 +1,32 @@
+from ingest_batches import add_batches, batch_chunks
+
+
+def test_files_with_chunks_in_a_failed_batch_are_not_completed() -> None:
+    files_chunks = [("a", ["a1", "a2", "a3", "a4", "a5"]), ("b", ["b1"])]
+    added: list[list[str]] = []
+
+    def add_chunks(chunks: list[str]) -> None:
+        if "a1" in chunks:
+            raise ValueError("Batch too large")
+        added.append(chunks)
+
+    completed = [
+        file_path
+        for completed_files in add_batches(add_chunks, batch_chunks(files_chunks, 3))
+        for file_path in completed_files
+    ]
+
+    assert added == [["a4", "a5", "b1"]]
+    # The last chunks of a are added, but not its first ones
+    assert completed == ["b"]
+
+
+def test_files_are_completed_by_the_batch_of_their_last_chunk() -> None:
+    files_chunks = [("a", ["a1", "a2"]), ("b", []), ("c", ["c1", "c2", "c3"])]
+
+    batches = list(batch_chunks(files_chunks, 3))
+
+    assert batches == [
+        (["a1", "a2", "c1"], ["a", "c"], ["a", "b"]),
+        (["c2", "c3"], ["c"], ["c"]),
+    ]